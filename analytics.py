@@ -0,0 +1,193 @@
+"""Incrementally maintained trade statistics.
+
+`observe()` is fed every logged transaction state. It only acts when the
+step changes, and updates fixed-size aggregates, so reading them for
+`/stats` never scans history:
+
+- daily Buy/Sell USDT volume and Naira totals (last `retention_days` days)
+- markup revenue, from the locked quote's markup
+- settled trade counts by network (settled transaction ids are persisted
+  too, so a settled step logged again after a restart isn't counted twice)
+- receipt-upload -> admin-approval turnaround, as fixed-bucket histograms
+  from which p50/p95 are read
+"""
+
+import bisect
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+# Buy settles when the admin sends USDT, Sell when the admin sends Naira
+SETTLED_STEPS = {"Buy": 6, "Sell": 12}
+# Receipt/proof uploaded -> admin approved
+APPROVAL_STEPS = {"Buy": (3, 4), "Sell": (9, 10)}
+
+# Turnaround histogram bucket upper bounds, in seconds
+TURNAROUND_BUCKETS = (
+    5, 10, 15, 30, 45, 60, 90, 120, 180, 240, 300, 450, 600, 900,
+    1200, 1800, 2700, 3600, 5400, 7200, 14400, 28800, 86400,
+)
+
+
+class Histogram:
+    def __init__(self, bounds=TURNAROUND_BUCKETS, counts=None):
+        self.bounds = bounds
+        self.counts = list(counts) if counts else [0] * (len(bounds) + 1)
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+
+    @property
+    def total(self):
+        return sum(self.counts)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction; None when empty."""
+        total = self.total
+        if not total:
+            return None
+        target = fraction * total
+        running = 0
+        for index, count in enumerate(self.counts):
+            running += count
+            if running >= target:
+                return self.bounds[index] if index < len(self.bounds) else float("inf")
+        return float("inf")
+
+
+def _empty_day():
+    return {"buy_usdt": 0.0, "buy_naira": 0.0, "sell_usdt": 0.0, "sell_naira": 0.0, "markup_revenue": 0.0, "trades": 0}
+
+
+class StatsAggregator:
+    def __init__(self, retention_days=90, max_tracked=10000):
+        self.retention_days = retention_days
+        self.max_tracked = max_tracked
+
+        self.daily = OrderedDict()
+        self.totals = _empty_day()
+        self.networks = {}
+        self.turnaround = {"Buy": Histogram(), "Sell": Histogram()}
+
+        self._last_step = OrderedDict()
+        self._settled = OrderedDict()  # transaction ids already counted, persisted with the aggregates
+        self._receipt_at = {}
+        self._lock = threading.Lock()
+
+    def observe(self, record, now=None):
+        """Updates aggregates from a transaction record dict (as written by log_transaction)."""
+        transaction_id = record.get("transaction_id")
+        action = record.get("action")
+        step = record.get("step")
+        if not transaction_id or action not in SETTLED_STEPS or step is None:
+            return
+
+        now = now or time.time()
+        with self._lock:
+            previous = self._last_step.get(transaction_id)
+            if previous == step or transaction_id in self._settled:
+                return
+            self._track(transaction_id, step)
+
+            uploaded_step, approved_step = APPROVAL_STEPS[action]
+            if step == uploaded_step:
+                self._receipt_at[transaction_id] = now
+            elif step == approved_step and transaction_id in self._receipt_at:
+                self.turnaround[action].add(now - self._receipt_at.pop(transaction_id))
+
+            if step == SETTLED_STEPS[action]:
+                self._settle(record, action, now)
+                self._mark_settled(transaction_id)
+                self._forget(transaction_id)
+
+    def _track(self, transaction_id, step):
+        self._last_step[transaction_id] = step
+        self._last_step.move_to_end(transaction_id)
+        while len(self._last_step) > self.max_tracked:
+            oldest, _ = self._last_step.popitem(last=False)
+            self._receipt_at.pop(oldest, None)
+
+    def _mark_settled(self, transaction_id):
+        # A settled trade can be logged again after a restart (e.g. when the user confirms receipt)
+        self._settled[transaction_id] = True
+        while len(self._settled) > self.max_tracked:
+            self._settled.popitem(last=False)
+
+    def _forget(self, transaction_id):
+        # Keep the step so a repeated log of the settled state isn't counted twice
+        self._receipt_at.pop(transaction_id, None)
+
+    def _settle(self, record, action, now):
+        amount = float(record.get("amount") or 0)
+        naira = float(record.get("naira_amount") or 0)
+        quote = record.get("quote") or {}
+        network = record.get("network")
+        # The network markup always goes against the user, on top of the base markup
+        network_markup = float((quote.get("network_markups") or {}).get(network) or 0)
+        revenue = (abs(float(quote.get("markup") or 0)) + network_markup) * amount
+
+        day = self._day(datetime.date.fromtimestamp(now).isoformat())
+        prefix = "buy" if action == "Buy" else "sell"
+        for bucket in (day, self.totals):
+            bucket[f"{prefix}_usdt"] += amount
+            bucket[f"{prefix}_naira"] += naira
+            bucket["markup_revenue"] += revenue
+            bucket["trades"] += 1
+
+        network = network or "Unknown"
+        self.networks[network] = self.networks.get(network, 0) + 1
+
+    def _day(self, key):
+        day = self.daily.get(key)
+        if day is None:
+            day = self.daily[key] = _empty_day()
+            while len(self.daily) > self.retention_days:
+                self.daily.popitem(last=False)
+        return day
+
+    def summary(self, now=None):
+        today = datetime.date.fromtimestamp(now or time.time())
+        with self._lock:
+            last_7 = _empty_day()
+            for offset in range(7):
+                day = self.daily.get((today - datetime.timedelta(days=offset)).isoformat())
+                if day:
+                    for key, value in day.items():
+                        last_7[key] += value
+
+            return {
+                "today": dict(self.daily.get(today.isoformat()) or _empty_day()),
+                "last_7_days": last_7,
+                "all_time": dict(self.totals),
+                "networks": dict(self.networks),
+                "turnaround_seconds": {
+                    action: {"p50": hist.percentile(0.5), "p95": hist.percentile(0.95), "samples": hist.total}
+                    for action, hist in self.turnaround.items()
+                },
+            }
+
+    # Persistence
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "daily": dict(self.daily),
+                "totals": dict(self.totals),
+                "networks": dict(self.networks),
+                "turnaround": {action: hist.counts for action, hist in self.turnaround.items()},
+                "settled": list(self._settled),
+            }
+
+    def load(self, data):
+        if not data:
+            return
+        with self._lock:
+            self.daily = OrderedDict(sorted((data.get("daily") or {}).items())[-self.retention_days:])
+            self.totals.update(data.get("totals") or {})
+            self.networks = dict(data.get("networks") or {})
+            for action, counts in (data.get("turnaround") or {}).items():
+                if action in self.turnaround and len(counts) == len(TURNAROUND_BUCKETS) + 1:
+                    self.turnaround[action] = Histogram(counts=counts)
+            for transaction_id in (data.get("settled") or [])[-self.max_tracked:]:
+                self._settled[transaction_id] = True
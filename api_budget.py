@@ -0,0 +1,185 @@
+"""Telegram API call accounting and in-place message updates.
+
+`ApiCallCounter.install()` wraps `telebot.apihelper._make_request`, so every
+Bot API call is counted against the transaction bound in the caller's log
+context (handlers get it from LogContextMiddleware, the timer thread binds
+it itself). When a transaction ends, its count is kept for the calls per
+trade metric.
+
+`MessageTracker` remembers the last message shown in each (chat, slot), e.g.
+the flow prompt or the countdown timer, and updates it with
+`edit_message_text`/`edit_message_reply_markup` instead of sending a new
+message. An update whose text and keyboard are unchanged makes no call.
+Edits don't notify the user, so messages the user has to notice (admin
+decisions, payouts) are still sent as new messages.
+"""
+
+import logging
+import statistics
+import threading
+from collections import Counter, OrderedDict, namedtuple
+
+from telebot.apihelper import ApiTelegramException
+
+logger = logging.getLogger(__name__)
+
+# Edit errors after which the message is sent again instead
+UNEDITABLE_ERRORS = ("message to edit not found", "message can't be edited", "message_id_invalid")
+
+
+class ApiCallCounter:
+    def __init__(self, key, ignore=("getUpdates",), max_open=10000, max_finished=1000):
+        """`key()` returns the transaction id calls are attributed to, or None."""
+        self.key = key
+        self.ignore = set(ignore)
+        self.max_open = max_open
+        self.max_finished = max_finished
+        self.by_method = Counter()
+        self.unattributed = 0
+        self.outcomes = Counter()
+
+        self._open = OrderedDict()      # transaction id -> Counter(method)
+        self._finished = OrderedDict()  # transaction id -> (outcome, Counter(method))
+        self._lock = threading.Lock()
+
+    def count(self, method_name):
+        if method_name in self.ignore:
+            return
+        transaction_id = self.key()
+        with self._lock:
+            self.by_method[method_name] += 1
+            if transaction_id is None:
+                self.unattributed += 1
+                return
+            # Calls made after finish() (e.g. answering the last callback) still count
+            finished = self._finished.get(transaction_id)
+            if finished is not None:
+                finished[1][method_name] += 1
+                return
+            calls = self._open.get(transaction_id)
+            if calls is None:
+                calls = self._open[transaction_id] = Counter()
+                if len(self._open) > self.max_open:
+                    self._open.popitem(last=False)
+            calls[method_name] += 1
+
+    def install(self, apihelper):
+        """Wraps `apihelper._make_request`, which every Bot API call goes through."""
+        make_request = apihelper._make_request
+
+        def counting_make_request(token, method_name, *args, **kwargs):
+            self.count(method_name)
+            return make_request(token, method_name, *args, **kwargs)
+
+        apihelper._make_request = counting_make_request
+
+    def finish(self, transaction_id, outcome="completed"):
+        """Closes a transaction's count; returns the calls it made so far."""
+        with self._lock:
+            if transaction_id in self._finished:
+                return sum(self._finished[transaction_id][1].values())
+            calls = self._open.pop(transaction_id, None) or Counter()
+            self._finished[transaction_id] = (outcome, calls)
+            if len(self._finished) > self.max_finished:
+                self._finished.popitem(last=False)
+            self.outcomes[outcome] += 1
+        total = sum(calls.values())
+        logger.info(f"📨 Transaction {transaction_id} {outcome} after {total} API calls")
+        return total
+
+    def summary(self):
+        with self._lock:
+            per_trade = sorted(sum(calls.values()) for outcome, calls in self._finished.values() if outcome == "completed")
+            return {
+                "calls_by_method": dict(self.by_method.most_common()),
+                "unattributed_calls": self.unattributed,
+                "open_transactions": len(self._open),
+                "finished_transactions": dict(self.outcomes),
+                "calls_per_completed_trade": {
+                    "mean": round(statistics.fmean(per_trade), 2) if per_trade else None,
+                    "p50": per_trade[len(per_trade) // 2] if per_trade else None,
+                    "p95": per_trade[min(len(per_trade) - 1, int(0.95 * len(per_trade)))] if per_trade else None,
+                    "samples": len(per_trade),
+                },
+            }
+
+
+TrackedMessage = namedtuple("TrackedMessage", "message_id text markup")
+
+
+def _markup_key(reply_markup):
+    return reply_markup.to_json() if reply_markup is not None else None
+
+
+class MessageTracker:
+    def __init__(self, bot, max_messages=20000):
+        self.bot = bot
+        self.max_messages = max_messages
+        self.sent = 0
+        self.edited = 0
+        self.skipped = 0
+
+        self._messages = OrderedDict()  # (chat id, slot) -> TrackedMessage
+        self._lock = threading.Lock()
+
+    def _get(self, chat_id, slot):
+        with self._lock:
+            return self._messages.get((chat_id, slot))
+
+    def _set(self, chat_id, slot, tracked):
+        with self._lock:
+            self._messages.pop((chat_id, slot), None)
+            self._messages[(chat_id, slot)] = tracked
+            if len(self._messages) > self.max_messages:
+                self._messages.popitem(last=False)
+
+    def remember(self, chat_id, message_id, slot="prompt", text=None, reply_markup=None):
+        """Tracks a message sent elsewhere (or restored after a restart) so it can be edited."""
+        self._set(chat_id, slot, TrackedMessage(message_id, text, _markup_key(reply_markup)))
+
+    def forget(self, chat_id, slot="prompt"):
+        with self._lock:
+            self._messages.pop((chat_id, slot), None)
+
+    def show(self, chat_id, text, reply_markup=None, slot="prompt", new=False, **kwargs):
+        """Shows `text` in the chat's slot, editing the tracked message unless `new`; returns its message id."""
+        tracked = None if new else self._get(chat_id, slot)
+        if tracked is not None and self._edit(chat_id, tracked, text, reply_markup, kwargs):
+            self._set(chat_id, slot, TrackedMessage(tracked.message_id, text, _markup_key(reply_markup)))
+            return tracked.message_id
+
+        message = self.bot.send_message(chat_id, text, reply_markup=reply_markup, **kwargs)
+        self.sent += 1
+        self._set(chat_id, slot, TrackedMessage(message.message_id, text, _markup_key(reply_markup)))
+        return message.message_id
+
+    def replace(self, message, text, reply_markup=None, slot="prompt", **kwargs):
+        """Edits `message` (typically the one whose button was pressed) and tracks it in the slot."""
+        self.remember(message.chat.id, message.message_id, slot, message.text, message.reply_markup)
+        return self.show(message.chat.id, text, reply_markup, slot, **kwargs)
+
+    def _edit(self, chat_id, tracked, text, reply_markup, kwargs):
+        """Returns False if the message can no longer be edited and has to be sent again."""
+        markup = _markup_key(reply_markup)
+        if tracked.text == text and tracked.markup == markup:
+            self.skipped += 1
+            return True
+        try:
+            if tracked.text == text:
+                self.bot.edit_message_reply_markup(chat_id, tracked.message_id, reply_markup=reply_markup)
+            else:
+                self.bot.edit_message_text(text, chat_id, tracked.message_id, reply_markup=reply_markup, **kwargs)
+        except ApiTelegramException as e:
+            description = (e.description or "").lower()
+            if "message is not modified" in description:
+                self.skipped += 1
+                return True
+            if any(error in description for error in UNEDITABLE_ERRORS):
+                logger.info(f"Message {tracked.message_id} in chat {chat_id} can't be edited, sending a new one")
+                return False
+            raise
+        self.edited += 1
+        return True
+
+    def summary(self):
+        return {"sent": self.sent, "edited": self.edited, "skipped": self.skipped}
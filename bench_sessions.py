@@ -0,0 +1,130 @@
+"""Memory and lookup benchmark: dict sessions vs slotted TransactionSession.
+
+Measures the old dict-of-dicts, the slotted sessions in a plain dict, and
+the path the bot actually runs: slotted sessions in a `SessionStore`, read
+through `peek()` by a `transaction_at`-style filter.
+
+Usage: python bench_sessions.py [session_count]
+"""
+
+import datetime
+import sys
+import timeit
+import tracemalloc
+
+from session_store import SessionStore
+from sessions import Step, TransactionSession
+
+BASE_USER_ID = 5_000_000_000
+
+
+def make_dict_sessions(count):
+    sessions = {}
+    for i in range(count):
+        user_id = BASE_USER_ID + i
+        sessions[str(user_id)] = {
+            "transaction_id": datetime.datetime.now().strftime("%Y%m%d%H%M%S%f"),
+            "step": 2,
+            "action": "Buy",
+            "start_time": datetime.datetime.now().isoformat(),
+            "amount": 100.0 + i,
+            "naira_amount": (100.0 + i) * 1530.0,
+            "timer": 900,
+            "timer_message_id": 1000 + i,
+        }
+    return sessions
+
+
+def make_slotted_sessions(count):
+    sessions = {}
+    for i in range(count):
+        user_id = BASE_USER_ID + i
+        sessions[user_id] = TransactionSession(
+            user_id,
+            datetime.datetime.now().strftime("%Y%m%d%H%M%S%f"),
+            action="Buy",
+            step=Step.AWAITING_PAYMENT,
+            start_time=datetime.datetime.now().isoformat(),
+            amount=100.0 + i,
+            naira_amount=(100.0 + i) * 1530.0,
+            timer=900,
+            timer_message_id=1000 + i,
+        )
+    return sessions
+
+
+def make_store_sessions(count):
+    # The store keeps a deadline per key on top of the sessions themselves
+    store = SessionStore("transaction", ttl=3600)
+    for user_id, session in make_slotted_sessions(count).items():
+        store[user_id] = session
+    return store
+
+
+def measure_memory(factory, count):
+    tracemalloc.start()
+    sessions = factory(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sessions, current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    user_ids = [BASE_USER_ID + i for i in range(0, count, 7)]
+
+    dict_sessions, dict_bytes = measure_memory(make_dict_sessions, count)
+    slotted_sessions, slotted_bytes = measure_memory(make_slotted_sessions, count)
+    store, store_bytes = measure_memory(make_store_sessions, count)
+
+    # Same shape as the handler filters before and after the change
+    def dict_filter():
+        for uid in user_ids:
+            key = str(uid)
+            key in dict_sessions and dict_sessions[key].get("step") == 2 and dict_sessions[key].get("action") == "Buy"
+
+    def slotted_filter():
+        for uid in user_ids:
+            session = slotted_sessions.get(uid)
+            session is not None and session.step == Step.AWAITING_PAYMENT and session.action == "Buy"
+
+    def transaction_at(user_id, step, action=None):
+        session = store.peek(user_id)
+        return session is not None and session.step == step and (action is None or session.action == action)
+
+    def store_filter():
+        for uid in user_ids:
+            transaction_at(uid, Step.AWAITING_PAYMENT, "Buy")
+
+    def dict_serialize():
+        for uid in user_ids:
+            dict(dict_sessions[str(uid)])
+
+    def slotted_serialize():
+        for uid in user_ids:
+            slotted_sessions[uid].to_dict()
+
+    rounds = 20
+    lookups = len(user_ids) * rounds
+    results = {
+        "filter (dict)": min(timeit.repeat(dict_filter, number=rounds, repeat=15)) / lookups,
+        "filter (slotted)": min(timeit.repeat(slotted_filter, number=rounds, repeat=15)) / lookups,
+        "filter (store.peek)": min(timeit.repeat(store_filter, number=rounds, repeat=15)) / lookups,
+        "serialize (dict copy)": min(timeit.repeat(dict_serialize, number=rounds, repeat=15)) / lookups,
+        "serialize (to_dict)": min(timeit.repeat(slotted_serialize, number=rounds, repeat=15)) / lookups,
+    }
+
+    print(f"Sessions: {count:,}")
+    print(f"Memory  dict:    {dict_bytes / 1024 / 1024:8.2f} MiB  ({dict_bytes / count:6.0f} B/session)")
+    print(f"Memory  slotted: {slotted_bytes / 1024 / 1024:8.2f} MiB  ({slotted_bytes / count:6.0f} B/session)")
+    print(f"Memory  store:   {store_bytes / 1024 / 1024:8.2f} MiB  ({store_bytes / count:6.0f} B/session)")
+    for name, seconds in results.items():
+        print(f"{name:<24} {seconds * 1e9:8.1f} ns/op")
+    # Serializing a slotted session builds a new dict from its slots, so it costs
+    # more than copying the old dict (around 2x); it only runs on snapshots and logs
+    ratio = results["serialize (to_dict)"] / results["serialize (dict copy)"]
+    print(f"{'to_dict vs dict copy':<24} {ratio:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Bulk broadcast to registered members.
+
+Members are streamed page by page (never the whole `Members/` node). Sends
+are fanned out to a small worker pool that shares one token bucket. It
+defaults to 20 messages/second, leaving a third of Telegram's global limit
+of about 30/second for live traffic (flow prompts, admin alerts, timers)
+sent while a broadcast runs.
+Members who blocked the bot (403) or whose chat is gone are marked inactive
+and skipped next time. Progress is checkpointed after every page, so an
+interrupted broadcast resumes from the last completed page.
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+PAUSED = "paused"
+STOPPED = "stopped"
+DONE = "done"
+
+
+class TokenBucket:
+    """Blocking token bucket shared by all sender threads."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Drains the bucket so every sender backs off (used on 429)."""
+        with self._lock:
+            self._tokens = -seconds * self.rate
+            self._updated = time.monotonic()
+
+
+class Broadcaster:
+    """Runs one broadcast at a time.
+
+    The storage callables keep this module independent of the backend:
+    `fetch_page(start_after, limit)` returns [(member_key, record)] in key order,
+    `save_checkpoint(state)` / `load_checkpoint(broadcast_id)` persist progress and
+    `mark_inactive(member_key, reason)` flags unreachable members.
+    `send(chat_id, text)` raises Telegram API exceptions on failure.
+    """
+
+    def __init__(self, send, fetch_page, save_checkpoint, load_checkpoint, mark_inactive,
+                 rate=20, workers=8, page_size=100):
+        self.send = send
+        self.fetch_page = fetch_page
+        self.save_checkpoint = save_checkpoint
+        self.load_checkpoint = load_checkpoint
+        self.mark_inactive = mark_inactive
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.page_size = page_size
+
+        self.state = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._stop_status = STOPPED
+        self._lock = threading.Lock()
+
+    def is_running(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def start(self, text, created_by=None):
+        state = {
+            "broadcast_id": uuid.uuid4().hex[:10],
+            "text": text,
+            "status": RUNNING,
+            "last_key": None,
+            "sent": 0,
+            "failed": 0,
+            "inactive": 0,
+            "skipped": 0,
+            "created_by": created_by,
+            "started_at": time.time(),
+            "updated_at": time.time(),
+        }
+        self._launch(state)
+        return state["broadcast_id"]
+
+    def resume(self, broadcast_id):
+        state = self.load_checkpoint(broadcast_id)
+        if not state:
+            raise KeyError(broadcast_id)
+        if state.get("status") == DONE:
+            raise ValueError(f"Broadcast {broadcast_id} has already finished")
+        state["status"] = RUNNING
+        self._launch(state)
+        return state
+
+    def _launch(self, state):
+        with self._lock:
+            if self.is_running():
+                raise RuntimeError("A broadcast is already running")
+            self._stop.clear()
+            self.state = state
+            self.save_checkpoint(dict(state))
+            self._thread = threading.Thread(target=self._run, name="broadcast", daemon=True)
+            self._thread.start()
+
+    def stop(self, status=STOPPED, timeout=None):
+        """Stops after in-flight sends finish and checkpoints with `status`."""
+        if not self.is_running():
+            return
+        self._stop_status = status
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stop_for_shutdown(self, deadline=None):
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        self.stop(status=PAUSED, timeout=timeout)
+
+    def _run(self):
+        state = self.state
+        jobs = queue.Queue(maxsize=self.workers * 2)
+        counters_lock = threading.Lock()
+
+        def worker():
+            while True:
+                job = jobs.get()
+                if job is None:
+                    jobs.task_done()
+                    return
+                member_key, chat_id = job
+                outcome = self._deliver(member_key, chat_id, state["text"])
+                with counters_lock:
+                    state[outcome] += 1
+                jobs.task_done()
+
+        threads = [threading.Thread(target=worker, name=f"broadcast-{i}", daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        logger.info(f"📣 Broadcast {state['broadcast_id']} running from {state['last_key'] or 'the start'}")
+        try:
+            while not self._stop.is_set():
+                page = self.fetch_page(state["last_key"], self.page_size)
+                if not page:
+                    state["status"] = DONE
+                    break
+
+                for member_key, record in page:
+                    chat_id = (record or {}).get("user_id")
+                    if not chat_id or (record or {}).get("active") is False:
+                        state["skipped"] += 1
+                    else:
+                        jobs.put((member_key, chat_id))
+
+                # Only checkpoint once every send of the page has finished
+                jobs.join()
+                state["last_key"] = page[-1][0]
+                state["updated_at"] = time.time()
+                self.save_checkpoint(dict(state))
+
+                if len(page) < self.page_size:
+                    state["status"] = DONE
+                    break
+            else:
+                state["status"] = self._stop_status
+        except Exception as e:
+            logger.error(f"❌ Broadcast {state['broadcast_id']} failed: {e}")
+            state["status"] = PAUSED
+        finally:
+            for _ in threads:
+                jobs.put(None)
+            state["updated_at"] = time.time()
+            self.save_checkpoint(dict(state))
+            logger.info(f"📣 Broadcast {state['broadcast_id']} {state['status']}: "
+                        f"{state['sent']} sent, {state['failed']} failed, {state['inactive']} inactive")
+
+    def _deliver(self, member_key, chat_id, text, attempts=3):
+        for _ in range(attempts):
+            self.bucket.acquire()
+            try:
+                self.send(chat_id, text)
+                return "sent"
+            except Exception as e:
+                code = getattr(e, "error_code", None)
+                description = str(getattr(e, "description", e)).lower()
+                if code == 429:
+                    retry_after = ((getattr(e, "result_json", None) or {}).get("parameters") or {}).get("retry_after", 5)
+                    logger.warning(f"⚠️ Broadcast rate limited, backing off {retry_after}s")
+                    self.bucket.pause(retry_after)
+                    continue
+                if code == 403 or (code == 400 and "chat not found" in description):
+                    try:
+                        self.mark_inactive(member_key, description[:100])
+                    except Exception as mark_error:
+                        logger.error(f"Failed to mark {member_key} inactive: {mark_error}")
+                    return "inactive"
+                logger.error(f"Broadcast send to {member_key} failed: {e}")
+                return "failed"
+        return "failed"
@@ -0,0 +1,291 @@
+"""Runtime configuration that can change without a redeploy.
+
+Values are layered: schema defaults, then a JSON file, then `CONFIG_*`
+environment variables, then overrides stored in Firebase (written by
+`/setconfig`). Every candidate is validated against the schema as a whole
+before it is applied. A valid change builds a new immutable `ConfigSnapshot`
+with a higher version and swaps it in with a single assignment, so handlers
+read `config.current` without taking a lock and always see one consistent
+version. Every changed key is written to the audit log.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+
+from pricing import ASSETS
+from validation import is_valid_email, is_valid_wallet_address
+
+logger = logging.getLogger(__name__)
+
+KNOWN_NETWORKS = ("TRC20", "ERC20", "BEP20")
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _thaw(value):
+    if isinstance(value, MappingProxyType):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [_thaw(item) for item in value]
+    return value
+
+
+# Schema: parse(raw string) and check(value) per key
+
+def _parse_json(raw):
+    return json.loads(raw) if isinstance(raw, str) else raw
+
+def _check_pair_markups(value):
+    if "USDT" not in value:
+        raise ConfigError("needs markups for USDT")
+    markups = {}
+    for asset, actions in value.items():
+        if asset not in ASSETS:
+            raise ConfigError(f"unknown asset {asset!r}")
+        if set(actions) != {"buy", "sell"}:
+            raise ConfigError(f"{asset} needs exactly 'buy' and 'sell'")
+        markups[asset] = {action: float(markup) for action, markup in actions.items()}
+    return markups
+
+def _check_network_markups(value):
+    unknown = [network for network in value if network not in KNOWN_NETWORKS]
+    if unknown:
+        raise ConfigError(f"unknown networks: {', '.join(unknown)}")
+    markups = {network: float(markup) for network, markup in value.items()}
+    if any(markup < 0 for markup in markups.values()):
+        raise ConfigError("network markups can't be negative")
+    return markups
+
+def _check_positive(value):
+    if value <= 0:
+        raise ConfigError("must be positive")
+    return value
+
+def _check_timeout(value):
+    if not 60 <= value <= 2 * 60 * 60:
+        raise ConfigError("must be between 60 and 7200 seconds")
+    return value
+
+def _check_networks(value):
+    unknown = [network for network in value if network not in KNOWN_NETWORKS]
+    if unknown or not value:
+        raise ConfigError(f"networks must be a non-empty subset of {', '.join(KNOWN_NETWORKS)}")
+    return list(dict.fromkeys(value))
+
+def _check_wallets(value):
+    for network, address in value.items():
+        if not is_valid_wallet_address(address, network):
+            raise ConfigError(f"{address} is not a valid {network} address")
+    return dict(value)
+
+def _check_text(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ConfigError("must be non-empty text")
+    return value
+
+def _check_email(value):
+    if not is_valid_email(value):
+        raise ConfigError("must be an email address")
+    return value
+
+SCHEMA = {
+    "pair_markups": (_parse_json, _check_pair_markups),
+    "network_markups": (_parse_json, _check_network_markups),
+    "fallback_rate": (float, _check_positive),
+    "transaction_timeout": (int, _check_timeout),
+    "usdt_networks": (_parse_json, _check_networks),
+    "company_wallets": (_parse_json, _check_wallets),
+    "admin_account_details": (str, _check_text),
+    "support_email": (str, _check_email),
+}
+
+# Keys that can be set one entry at a time, e.g. `company_wallets.TRC20` or `pair_markups.USDT`
+NESTED_ITEM_PARSERS = {
+    "pair_markups": _parse_json,
+    "network_markups": float,
+    "company_wallets": str,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class ConfigSnapshot:
+    pair_markups: MappingProxyType      # asset -> {"buy": ₦, "sell": ₦} added to the market rate
+    network_markups: MappingProxyType   # network -> ₦ per USDT charged against the user
+    fallback_rate: float
+    transaction_timeout: int
+    usdt_networks: tuple
+    company_wallets: MappingProxyType
+    admin_account_details: str
+    support_email: str
+    version: int = 0
+    updated_at: float = 0.0
+    updated_by: str = "defaults"
+
+    @property
+    def enabled_networks(self):
+        """Networks that are switched on and have a company wallet to receive into."""
+        return tuple(network for network in self.usdt_networks if network in self.company_wallets)
+
+    def values(self):
+        return {key: _thaw(getattr(self, key)) for key in SCHEMA}
+
+
+def validate(values):
+    """Validates a complete set of values; returns the normalised values or raises ConfigError."""
+    missing = [key for key in SCHEMA if key not in values]
+    if missing:
+        raise ConfigError(f"missing keys: {', '.join(missing)}")
+
+    normalised = {}
+    for key, (parse, check) in SCHEMA.items():
+        try:
+            normalised[key] = check(parse(values[key]))
+        except ConfigError as e:
+            raise ConfigError(f"{key}: {e}") from None
+        except (TypeError, ValueError, AttributeError) as e:
+            raise ConfigError(f"{key}: invalid value ({e})") from None
+
+    stray = [network for network in normalised["company_wallets"] if network not in normalised["usdt_networks"]]
+    if stray:
+        raise ConfigError(f"company_wallets has networks that are not enabled: {', '.join(stray)}")
+    return normalised
+
+
+def parse_setting(key, raw, current):
+    """Parses `/setconfig key value`; returns (top-level key, new value)."""
+    key, _, item = key.partition(".")
+    if key not in SCHEMA:
+        raise ConfigError(f"unknown key {key!r}")
+    if not item:
+        return key, SCHEMA[key][0](raw)
+    if key not in NESTED_ITEM_PARSERS:
+        raise ConfigError(f"{key} can't be set per item")
+
+    value = _thaw(getattr(current, key))
+    if raw.lower() in ("none", "null", "-"):
+        value.pop(item, None)
+    else:
+        value[item] = NESTED_ITEM_PARSERS[key](raw)
+    return key, value
+
+
+# Sources
+
+def file_source(path):
+    def load():
+        if not path or not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)
+    return load
+
+def env_source(prefix="CONFIG_"):
+    def load():
+        return {key: os.environ[prefix + key.upper()] for key in SCHEMA if prefix + key.upper() in os.environ}
+    return load
+
+
+class ConfigManager:
+    def __init__(self, defaults, sources=(), audit=None, store=None):
+        """`sources` are callables returning partial dicts, lowest precedence first.
+
+        `store(key, value)` persists an override made with `set()`;
+        `audit(entry)` records one changed key.
+        """
+        self.sources = list(sources)
+        self.audit = audit
+        self.store = store
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self.current = ConfigSnapshot(**{key: _freeze(value) for key, value in validate(defaults).items()})
+        self._defaults = self.current.values()
+
+    def subscribe(self, func):
+        """Calls `func(snapshot)` now and after every applied change."""
+        self._subscribers.append(func)
+        func(self.current)
+
+    def _collect(self):
+        values = dict(self._defaults)
+        for source in self.sources:
+            values.update(source() or {})
+        return values
+
+    def reload(self, actor="reload"):
+        """Re-reads every source and applies the result if it changed. Returns the new version or None."""
+        try:
+            return self.apply(self._collect(), actor)
+        except ConfigError as e:
+            logger.error(f"❌ Rejected configuration change, keeping v{self.current.version}: {e}")
+        except Exception as e:
+            logger.error(f"❌ Failed to read configuration sources: {e}")
+        return None
+
+    def set(self, key, raw, actor):
+        """Validates and applies a single setting, then persists it as an override."""
+        key, value = parse_setting(key, raw, self.current)
+        values = self.current.values()
+        values[key] = value
+        normalised = validate(values)
+        # Persist first, so a concurrent reload() sees the override rather than reverting it
+        if self.store:
+            self.store(key, normalised[key])
+        return self.apply(normalised, actor)
+
+    def apply(self, values, actor):
+        with self._lock:
+            normalised = validate(values)
+            previous = self.current
+            old_values = previous.values()
+            changed = [key for key in SCHEMA if normalised[key] != old_values[key]]
+            if not changed:
+                return None
+
+            snapshot = ConfigSnapshot(
+                **{key: _freeze(value) for key, value in normalised.items()},
+                version=previous.version + 1,
+                updated_at=time.time(),
+                updated_by=str(actor),
+            )
+            # Readers never lock: they see either the old or the new snapshot
+            self.current = snapshot
+
+        logger.info(f"⚙️ Config v{snapshot.version} applied by {actor}: {', '.join(changed)}")
+        for key in changed:
+            self._audit({
+                "version": snapshot.version,
+                "key": key,
+                "old": old_values[key],
+                "new": normalised[key],
+                "actor": str(actor),
+                "at": snapshot.updated_at,
+            })
+        for func in self._subscribers:
+            try:
+                func(snapshot)
+            except Exception as e:
+                logger.error(f"❌ Config subscriber failed: {e}")
+        return snapshot.version
+
+    def _audit(self, entry):
+        if self.audit is None:
+            return
+        try:
+            self.audit(entry)
+        except Exception as e:
+            logger.error(f"❌ Failed to write config audit entry: {e}")
@@ -0,0 +1,141 @@
+"""Liveness and readiness reporting for the Flask health endpoints.
+
+Checks are registered with a level. A failed LIVENESS check (polling wedged,
+scheduler dead) means the process should be restarted. A failed READINESS
+check (Firebase unreachable, worker pool backed up, draining) means traffic
+should be routed away while the process recovers. INFO checks are only
+reported. Expensive checks such as the Firebase round trip run as probes
+from a background job; the endpoints only read the cached result.
+"""
+
+import logging
+import threading
+import time
+
+from telebot.handler_backends import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+LIVENESS = "liveness"
+READINESS = "readiness"
+INFO = "info"
+
+
+def age(timestamp, now=None):
+    """Seconds since `timestamp`, or None if it never happened."""
+    if not timestamp:
+        return None
+    return round((now or time.time()) - timestamp, 1)
+
+
+class HealthMonitor:
+    def __init__(self):
+        self.started_at = time.time()
+        self.last_poll = None
+        self.last_poll_error = None
+        self.poll_failures = 0
+        self.last_update = None
+        self.updates = 0
+
+        self._checks = []
+        self._probes = {}
+        self._lock = threading.Lock()
+
+    # Signals
+
+    def record_poll(self, ok=True, error=None):
+        if ok:
+            self.last_poll = time.time()
+            self.poll_failures = 0
+        else:
+            self.poll_failures += 1
+            self.last_poll_error = str(error)[:200]
+
+    def record_update(self):
+        self.last_update = time.time()
+        self.updates += 1
+
+    def track_polling(self, bot):
+        """Wraps `bot.get_updates` so every long-poll round trip is recorded."""
+        get_updates = bot.get_updates
+
+        def tracked_get_updates(*args, **kwargs):
+            try:
+                updates = get_updates(*args, **kwargs)
+            except Exception as e:
+                self.record_poll(False, e)
+                raise
+            self.record_poll(True)
+            return updates
+
+        bot.get_updates = tracked_get_updates
+
+    # Probes
+
+    def run_probe(self, name, func):
+        """Runs `func()` (returns a detail dict or raises) and caches the outcome."""
+        started = time.monotonic()
+        try:
+            detail = func() or {}
+            ok = True
+        except Exception as e:
+            detail = {"error": str(e)[:200]}
+            ok = False
+            logger.warning(f"⚠️ Health probe '{name}' failed: {e}")
+        detail["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        with self._lock:
+            self._probes[name] = (ok, detail, time.time())
+
+    def probe_check(self, name, max_age):
+        """A check function that reports the cached probe result, failing if it is stale."""
+        def check():
+            with self._lock:
+                result = self._probes.get(name)
+            if result is None:
+                return False, {"error": "not probed yet"}
+            ok, detail, checked_at = result
+            checked_age = age(checked_at)
+            return ok and checked_age <= max_age, {**detail, "checked_age": checked_age}
+        return check
+
+    # Checks
+
+    def add_check(self, name, func, level=READINESS):
+        """Registers `func() -> (ok, detail)`."""
+        self._checks.append((name, func, level))
+
+    def report(self, level):
+        """Runs the checks for `level` (readiness includes liveness); returns (ok, report)."""
+        levels = {LIVENESS} if level == LIVENESS else {LIVENESS, READINESS}
+        healthy = True
+        checks = {}
+        for name, func, check_level in self._checks:
+            try:
+                ok, detail = func()
+            except Exception as e:
+                ok, detail = False, {"error": str(e)[:200]}
+            checks[name] = {"ok": ok, "level": check_level, **detail}
+            if not ok and check_level in levels:
+                healthy = False
+
+        return healthy, {
+            "status": "ok" if healthy else "fail",
+            "uptime": age(self.started_at),
+            "checks": checks,
+        }
+
+
+class HealthMiddleware(BaseMiddleware):
+    """Records every update that was handled without an exception."""
+
+    def __init__(self, monitor):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+        self.monitor = monitor
+
+    def pre_process(self, message, data):
+        pass
+
+    def post_process(self, message, data, exception):
+        if exception is None:
+            self.monitor.record_update()
@@ -0,0 +1,228 @@
+"""Process lifecycle: graceful drain on SIGTERM.
+
+On SIGTERM (or SIGINT) the manager stops accepting new updates, waits for
+in-flight handlers up to a deadline, then runs the registered flush steps
+(persistence queues, session snapshot, scheduler state) in order. Progress is
+exposed through `status()` for the health endpoint.
+
+Once polling has stopped, `ack_offset()` gives the getUpdates offset that
+confirms every update up to the first one rejected during the drain.
+Handlers run on a worker pool, so updates above that offset may have been
+accepted too; Telegram redelivers them with the rejected ones. Their ids
+(`handled_after_ack()`) are saved with the session snapshot, and the next
+instance passes them to `skip_handled()` so they are not handled twice.
+"""
+
+import logging
+import signal
+import threading
+import time
+import traceback
+from collections import deque
+
+from telebot.handler_backends import BaseMiddleware, CancelUpdate
+
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+
+class Lifecycle:
+    def __init__(self, drain_timeout=20.0, remembered_updates=1000):
+        self.drain_timeout = drain_timeout
+        self.state = RUNNING
+        self.drain_started_at = None
+        self.drain_finished_at = None
+
+        self._in_flight = 0
+        self.last_accepted_update_id = None
+        self.first_rejected_update_id = None
+        self._recently_accepted = deque(maxlen=remembered_updates)
+        self._handled_before_restart = set()
+        self._cond = threading.Condition()
+        self._stoppers = []
+        self._flushers = []
+        self._progress = []
+        self._drained = threading.Event()
+
+    # Registration
+
+    def on_stop(self, func):
+        """Registers a callback that stops new work from arriving."""
+        self._stoppers.append(func)
+
+    def register_flush(self, name, func):
+        """Registers a flush step; `func(deadline)` gets the absolute monotonic deadline."""
+        self._flushers.append((name, func))
+
+    # In-flight tracking
+
+    def accepting(self):
+        return self.state == RUNNING
+
+    def begin(self, update_id=None):
+        """Marks a handler as started; returns False once draining has begun or if the update was already handled."""
+        with self._cond:
+            if update_id is not None and update_id in self._handled_before_restart:
+                self._handled_before_restart.discard(update_id)
+                logger.info(f"⏭️ Skipping update {update_id}, handled before the restart")
+                return False
+            if self.state != RUNNING:
+                if update_id is not None and (self.first_rejected_update_id is None or update_id < self.first_rejected_update_id):
+                    self.first_rejected_update_id = update_id
+                return False
+            self._in_flight += 1
+            if update_id is not None:
+                self._recently_accepted.append(update_id)
+                if self.last_accepted_update_id is None or update_id > self.last_accepted_update_id:
+                    self.last_accepted_update_id = update_id
+            return True
+
+    def end(self):
+        with self._cond:
+            self._in_flight = max(0, self._in_flight - 1)
+            if self._in_flight == 0:
+                self._cond.notify_all()
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def track_updates(self, bot):
+        """Stamps each payload with its update_id, which the middleware otherwise doesn't see."""
+        process_new_updates = bot.process_new_updates
+
+        def tracking_process_new_updates(updates):
+            for update in updates:
+                for payload in (update.message, update.callback_query):
+                    if payload is not None:
+                        payload.lifecycle_update_id = update.update_id
+            return process_new_updates(updates)
+
+        bot.process_new_updates = tracking_process_new_updates
+
+    def ack_offset(self):
+        """The getUpdates offset that confirms updates up to the first rejected one; None if none was accepted."""
+        with self._cond:
+            return self._ack_offset()
+
+    def _ack_offset(self):
+        # Caller holds self._cond
+        if self.last_accepted_update_id is None:
+            return None
+        offset = self.last_accepted_update_id + 1
+        if self.first_rejected_update_id is not None:
+            offset = min(offset, self.first_rejected_update_id)
+        return offset
+
+    def handled_after_ack(self):
+        """Ids of accepted updates at or above `ack_offset()`, which Telegram will redeliver."""
+        with self._cond:
+            offset = self._ack_offset()
+            if offset is None:
+                return []
+            return sorted(update_id for update_id in set(self._recently_accepted) if update_id >= offset)
+
+    def skip_handled(self, update_ids):
+        """Makes `begin()` turn away these updates once, when the previous instance already handled them."""
+        with self._cond:
+            self._handled_before_restart.update(int(update_id) for update_id in update_ids)
+
+    # Draining
+
+    def install_signal_handlers(self):
+        """Must be called from the main thread."""
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        logger.info(f"🛑 Received signal {signum}, draining...")
+        self.start_drain()
+
+    def start_drain(self):
+        with self._cond:
+            if self.state != RUNNING:
+                return
+            self.state = DRAINING
+            self.drain_started_at = time.time()
+
+        threading.Thread(target=self._drain, name="drain", daemon=True).start()
+
+    def _drain(self):
+        deadline = time.monotonic() + self.drain_timeout
+
+        for func in self._stoppers:
+            self._run_step(f"stop:{getattr(func, '__name__', 'callback')}", func)
+
+        # Let in-flight handlers finish
+        with self._cond:
+            while self._in_flight and time.monotonic() < deadline:
+                self._cond.wait(deadline - time.monotonic())
+            abandoned = self._in_flight
+        self._record("handlers", "ok" if not abandoned else f"timed out with {abandoned} in flight")
+
+        for name, func in self._flushers:
+            self._run_step(name, func, deadline)
+
+        self.state = STOPPED
+        self.drain_finished_at = time.time()
+        logger.info(f"✅ Drain finished in {self.drain_finished_at - self.drain_started_at:.1f}s")
+        self._drained.set()
+
+    def _run_step(self, name, func, *args):
+        started = time.monotonic()
+        try:
+            func(*args)
+            self._record(name, "ok", time.monotonic() - started)
+        except Exception as e:
+            logger.error(f"❌ Drain step '{name}' failed: {e}")
+            logger.error(traceback.format_exc())
+            self._record(name, f"failed: {e}", time.monotonic() - started)
+
+    def _record(self, name, result, duration=None):
+        entry = {"step": name, "result": result}
+        if duration is not None:
+            entry["seconds"] = round(duration, 3)
+        self._progress.append(entry)
+
+    def wait(self, timeout=None):
+        """Blocks until draining has finished."""
+        return self._drained.wait(timeout)
+
+    def status(self):
+        return {
+            "state": self.state,
+            "in_flight": self._in_flight,
+            "drain_started_at": self.drain_started_at,
+            "drain_finished_at": self.drain_finished_at,
+            "steps_total": len(self._flushers) + len(self._stoppers) + 1,
+            "steps": list(self._progress),
+        }
+
+
+class LifecycleMiddleware(BaseMiddleware):
+    """Counts in-flight handlers and rejects updates once draining starts.
+
+    Polling stops before the next offset is sent, so the last batch is never
+    acknowledged: left alone, Telegram would redeliver all of it, including
+    updates that were already handled. Accepted and rejected update ids are
+    recorded instead, and the entry point confirms up to `ack_offset()` after
+    the drain. Updates above that offset are redelivered to the next
+    instance, which skips the ones listed by `handled_after_ack()`.
+    """
+
+    def __init__(self, lifecycle):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+        self.lifecycle = lifecycle
+
+    def pre_process(self, message, data):
+        if not self.lifecycle.begin(getattr(message, "lifecycle_update_id", None)):
+            return CancelUpdate()
+        data["lifecycle_tracked"] = True
+
+    def post_process(self, message, data, exception):
+        if data.get("lifecycle_tracked"):
+            self.lifecycle.end()
@@ -0,0 +1,239 @@
+"""Non-blocking, structured logging pipeline.
+
+Handler threads only format the message and put the record on an in-memory
+queue; a dedicated listener thread does all disk and console I/O. File
+records are JSON lines carrying the current user id, transaction id and step
+(bound per update by `LogContextMiddleware`), the file rotates by size and
+age with gzip compression, and a rate-limit filter aggregates repeated
+identical records instead of writing them thousands of times.
+"""
+
+import contextvars
+import copy
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+from telebot.handler_backends import BaseMiddleware
+
+CONTEXT_FIELDS = ("user_id", "transaction_id", "step")
+
+_log_context = contextvars.ContextVar("log_context", default={})
+
+
+def bind_log_context(**fields):
+    """Attaches fields to every record logged from this thread until reset."""
+    merged = dict(_log_context.get())
+    merged.update({k: v for k, v in fields.items() if v is not None})
+    return _log_context.set(merged)
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+def current_log_context():
+    """The fields bound in this thread (user_id, transaction_id, step), possibly empty."""
+    return _log_context.get()
+
+
+class ContextFilter(logging.Filter):
+    """Copies the bound log context onto each record (runs in the caller's thread)."""
+
+    def filter(self, record):
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Per-logger sampling plus aggregation of repeated identical records.
+
+    Records are grouped by logger, level and message with digits stripped, so
+    "Error editing timer message: ... 1234" and "... 1235" count as the same
+    record. The first `burst` records of a group pass in each `window`; the
+    rest are counted and the total is attached as `suppressed` to the next
+    record of that group that gets through. `sample_rates` maps a logger name
+    to the fraction of its below-WARNING records to keep.
+    """
+
+    _DIGITS = re.compile(r"\d+")
+
+    def __init__(self, window=60.0, burst=5, sample_rates=None, max_keys=2048):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self.sample_rates = sample_rates or {}
+        self.max_keys = max_keys
+        self._groups = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sample_rate(self, name):
+        # Most specific configured logger prefix wins
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition(".")[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            rate = self._sample_rate(record.name)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+
+        message = record.msg if isinstance(record.msg, str) else str(record.msg)
+        key = (record.name, record.levelno, self._DIGITS.sub("#", message[:200]))
+        now = time.monotonic()
+
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None or now - group[0] >= self.window:
+                suppressed = group[2] if group else 0
+                self._groups[key] = [now, 1, 0]
+                self._groups.move_to_end(key)
+                while len(self._groups) > self.max_keys:
+                    self._groups.popitem(last=False)
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+
+            group[1] += 1
+            if group[1] <= self.burst:
+                return True
+            group[2] += 1
+            return False
+
+
+class StructuredQueueHandler(logging.handlers.QueueHandler):
+    """Resolves the message and traceback in the caller's thread, nothing else."""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        for key in CONTEXT_FIELDS + ("suppressed",):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Rotates on size or age, gzip-compressing rotated files."""
+
+    def __init__(self, filename, max_bytes, max_age, backup_count):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True)
+        self.max_age = max_age
+        self.rollover_at = time.time() + max_age
+        self.namer = lambda name: f"{name}.gz"
+        self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source, dest):
+        # Like the stdlib rotator, skip a base file that was deleted or never written
+        if not os.path.exists(source):
+            return
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record):
+        if self.max_age and time.time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.max_age
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Binds user/transaction context for the duration of each update."""
+
+    def __init__(self, resolver):
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+        self.resolver = resolver
+
+    def pre_process(self, update, data):
+        try:
+            fields = self.resolver(update) or {}
+        except Exception:
+            fields = {}
+        data["log_context_token"] = bind_log_context(**fields)
+
+    def post_process(self, update, data, exception):
+        token = data.get("log_context_token")
+        if token is not None:
+            reset_log_context(token)
+
+
+def parse_sample_rates(spec):
+    """Parses "TeleBot=0.1,urllib3=0" into {"TeleBot": 0.1, "urllib3": 0.0}."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+def setup_logging(path, level=logging.INFO, max_bytes=5 * 1024 * 1024, max_age=24 * 60 * 60,
+                  backup_count=7, window=60.0, burst=5, sample_rates=None, capture_loggers=()):
+    """Installs the queue-based pipeline on the root logger and returns the listener."""
+    file_handler = CompressingRotatingFileHandler(path, max_bytes, max_age, backup_count)
+    file_handler.setFormatter(JsonFormatter())
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter(window=window, burst=burst, sample_rates=sample_rates))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    # Libraries that attach their own console handlers write synchronously; route them through the queue
+    for name in capture_loggers:
+        captured = logging.getLogger(name)
+        for handler in list(captured.handlers):
+            captured.removeHandler(handler)
+        captured.propagate = True
+
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    return listener
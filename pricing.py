@@ -0,0 +1,187 @@
+"""Multi-source price aggregation.
+
+Each source answers every supported pair (USDT, USDC and BTC against NGN)
+with one batched request. Sources are queried concurrently, each with its
+own timeout. A refresh returns once `quorum` sources have answered, so it is
+bounded by the fastest sources, not the slowest. A source that answers late
+is still folded into the next refresh's view. For each pair the answers are
+filtered for outliers (more than `max_deviation` away from the median) and
+combined with a median or a trimmed mean.
+"""
+
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+ASSETS = ("USDT", "USDC", "BTC")
+QUOTE_CURRENCY = "NGN"
+
+
+@dataclass(frozen=True, slots=True)
+class Price:
+    asset: str
+    rate: float
+    fetched_at: float
+    sources: dict = field(default_factory=dict)   # source name -> rate used
+    rejected: dict = field(default_factory=dict)  # source name -> outlier rate
+
+
+class HttpSource:
+    """One batched GET per refresh; `parse(json)` returns {asset: NGN price}."""
+
+    def __init__(self, name, url, params, parse, timeout=4.0):
+        self.name = name
+        self.url = url
+        self.params = params
+        self.parse = parse
+        self.timeout = timeout
+
+    def fetch(self):
+        response = requests.get(self.url, params=self.params, timeout=self.timeout)
+        response.raise_for_status()
+        prices = self.parse(response.json())
+        return {asset: float(price) for asset, price in prices.items() if price and asset in ASSETS}
+
+
+COINGECKO_IDS = {"USDT": "tether", "USDC": "usd-coin", "BTC": "bitcoin"}
+
+def _parse_coingecko(data):
+    return {asset: (data.get(coin_id) or {}).get("ngn") for asset, coin_id in COINGECKO_IDS.items()}
+
+def _parse_cryptocompare(data):
+    return {asset: (data.get(asset) or {}).get(QUOTE_CURRENCY) for asset in ASSETS}
+
+def _parse_coinbase(data):
+    # Rates are quoted per 1 NGN, so invert them
+    rates = (data.get("data") or {}).get("rates") or {}
+    return {asset: 1 / float(rates[asset]) for asset in ASSETS if float(rates.get(asset) or 0) > 0}
+
+def default_sources(names, timeout):
+    available = {
+        "coingecko": lambda: HttpSource(
+            "coingecko", "https://api.coingecko.com/api/v3/simple/price",
+            {"ids": ",".join(COINGECKO_IDS.values()), "vs_currencies": "ngn"}, _parse_coingecko, timeout),
+        "cryptocompare": lambda: HttpSource(
+            "cryptocompare", "https://min-api.cryptocompare.com/data/pricemulti",
+            {"fsyms": ",".join(ASSETS), "tsyms": QUOTE_CURRENCY}, _parse_cryptocompare, timeout),
+        "coinbase": lambda: HttpSource(
+            "coinbase", "https://api.coinbase.com/v2/exchange-rates",
+            {"currency": QUOTE_CURRENCY}, _parse_coinbase, timeout),
+    }
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ValueError(f"Unknown price sources: {', '.join(unknown)}")
+    return [available[name]() for name in names]
+
+
+def aggregate(values, method="median", max_deviation=0.05, trim=0.2):
+    """Combines {source: rate}; returns (rate, used, rejected) or (None, {}, rejected)."""
+    if not values:
+        return None, {}, {}
+    median = statistics.median(values.values())
+    used = {name: rate for name, rate in values.items() if abs(rate - median) <= max_deviation * median}
+    rejected = {name: rate for name, rate in values.items() if name not in used}
+    if not used:
+        return None, {}, rejected
+
+    if method == "trimmed_mean":
+        ordered = sorted(used.values())
+        cut = int(len(ordered) * trim)
+        rate = statistics.fmean(ordered[cut:len(ordered) - cut] or ordered)
+    else:
+        rate = statistics.median(used.values())
+    return rate, used, rejected
+
+
+class PricingEngine:
+    def __init__(self, sources, quorum=2, method="median", max_deviation=0.05, max_age=120):
+        self.sources = sources
+        self.quorum = quorum
+        self.method = method
+        self.max_deviation = max_deviation
+        self.max_age = max_age
+
+        self.prices = {}
+        self.fetched_at = 0.0
+        self.source_errors = {}
+        self._latest = {}  # source name -> (fetched_at, {asset: rate})
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(sources)), thread_name_prefix="price")
+        self._lock = threading.Lock()
+
+    def _fetch(self, source):
+        try:
+            prices = source.fetch()
+        except Exception as e:
+            self.source_errors[source.name] = str(e)[:200]
+            logger.warning(f"⚠️ Price source {source.name} failed: {e}")
+            raise
+        with self._lock:
+            self._latest[source.name] = (time.time(), prices)
+        self.source_errors.pop(source.name, None)
+        return prices
+
+    def refresh(self):
+        """Queries all sources and returns once `quorum` have answered or all have finished."""
+        started = time.monotonic()
+        timeout = max(getattr(source, "timeout", 5.0) for source in self.sources) if self.sources else 0
+        # A source still running from the previous refresh is not queried twice
+        futures = []
+        for source in self.sources:
+            future = self._pending.get(source.name)
+            if future is None or future.done():
+                future = self._pending[source.name] = self._executor.submit(self._fetch, source)
+            futures.append(future)
+
+        answered = 0
+        remaining = set(futures)
+        while remaining and answered < self.quorum:
+            done, remaining = wait(remaining, timeout=max(0.0, timeout - (time.monotonic() - started)), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            answered += sum(1 for future in done if future.exception() is None)
+
+        return self._recompute(time.monotonic() - started)
+
+    def _recompute(self, elapsed=None):
+        now = time.time()
+        with self._lock:
+            fresh = {name: prices for name, (fetched_at, prices) in self._latest.items() if now - fetched_at <= self.max_age}
+
+        prices = {}
+        for asset in ASSETS:
+            values = {name: source_prices[asset] for name, source_prices in fresh.items() if asset in source_prices}
+            rate, used, rejected = aggregate(values, self.method, self.max_deviation)
+            if rejected:
+                logger.warning(f"⚠️ Rejected outlier {asset}/NGN prices: {rejected}")
+            if rate is not None:
+                prices[asset] = Price(asset, rate, now, used, rejected)
+
+        if prices:
+            self.prices = prices
+            self.fetched_at = now
+        if elapsed is not None:
+            logger.info(f"💱 Prices refreshed from {len(fresh)} source(s) in {elapsed * 1000:.0f} ms")
+        return prices
+
+    def rate(self, asset="USDT"):
+        """The aggregated rate while it is fresh, otherwise None."""
+        price = self.prices.get(asset)
+        if price is None or time.time() - price.fetched_at > self.max_age:
+            return None
+        return price.rate
+
+    def status(self):
+        return {
+            "fetched_at": self.fetched_at,
+            "prices": {asset: {"rate": price.rate, "sources": price.sources, "rejected": price.rejected}
+                       for asset, price in self.prices.items()},
+            "source_errors": dict(self.source_errors),
+        }
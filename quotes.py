@@ -0,0 +1,132 @@
+"""Signed price quotes.
+
+A quote freezes the market rate, the markup applied to it and an expiry at
+the moment a user enters an amount. The transaction keeps the quote, so the
+price shown to the user is the price the admin settles at, even if the
+market (or `/rate`) has moved since. Quotes are HMAC-signed so a stored
+quote can be checked for tampering before settlement.
+"""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Quote:
+    quote_id: str
+    action: str              # "buy" or "sell"
+    base_rate: Optional[float]  # market rate before markup, None on fallback
+    markup: float
+    rate: float              # price per USDT the user pays / receives
+    source: str              # "market" or "fallback"
+    issued_at: float
+    expires_at: float
+    signature: str = ""
+    network_markups: Optional[dict] = None  # network -> ₦ per USDT, frozen with the quote
+
+    def is_valid(self, now=None):
+        return (now or time.time()) < self.expires_at
+
+    def rate_for(self, network=None):
+        """The rate after the network markup, which always goes against the user."""
+        markup = (self.network_markups or {}).get(network, 0.0)
+        return self.rate + markup if self.action == "buy" else self.rate - markup
+
+    def naira_for(self, amount, network=None):
+        return amount * self.rate_for(network)
+
+    def usdt_for(self, naira_amount, network=None):
+        return naira_amount / self.rate_for(network)
+
+    def payload(self):
+        parts = [
+            self.quote_id, self.action, self.base_rate, self.markup,
+            self.rate, self.source, self.issued_at, self.expires_at,
+        ]
+        # Only signed when present, so quotes issued before network markups still verify
+        if self.network_markups:
+            parts.append(",".join(f"{network}={markup}" for network, markup in sorted(self.network_markups.items())))
+        return "|".join(str(part) for part in parts)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        # Firebase hands whole-number floats back as ints, which would change the signed payload
+        for key in ("markup", "rate", "issued_at", "expires_at"):
+            data[key] = float(data[key])
+        if data.get("base_rate") is not None:
+            data["base_rate"] = float(data["base_rate"])
+        if data.get("network_markups"):
+            data["network_markups"] = {network: float(markup) for network, markup in data["network_markups"].items()}
+        return cls(**data)
+
+
+class QuoteEngine:
+    def __init__(self, rate_provider, markups, fallback_rate, ttl, secret, network_markups=None):
+        """`rate_provider()` returns the current market rate or None."""
+        self.rate_provider = rate_provider
+        self.configure(markups, fallback_rate, ttl, network_markups)
+        self._secret = secret.encode() if isinstance(secret, str) else secret
+        self.issued = 0
+        self.reused = 0
+
+    def configure(self, markups, fallback_rate, ttl, network_markups=None):
+        """Swaps the pricing terms in one assignment, so a quote never mixes old and new terms."""
+        self._terms = (dict(markups), fallback_rate, ttl, dict(network_markups or {}))
+
+    @property
+    def markups(self):
+        return self._terms[0]
+
+    def _sign(self, payload):
+        return hmac.new(self._secret, payload.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def verify(self, quote):
+        return hmac.compare_digest(quote.signature, self._sign(quote.payload()))
+
+    def issue(self, action):
+        action = action.lower()
+        markups, fallback_rate, ttl, network_markups = self._terms
+        if action not in markups:
+            raise ValueError(f"Unknown quote action: {action!r}")
+
+        base_rate = self.rate_provider()
+        if base_rate is None:
+            logger.warning("⚠️ No valid exchange rate available. Quoting fallback rate.")
+            markup, rate, source = 0.0, fallback_rate, "fallback"
+        else:
+            markup = markups[action]
+            rate, source = base_rate + markup, "market"
+
+        issued_at = time.time()
+        unsigned = Quote(
+            quote_id=f"Q{secrets.token_hex(6)}",
+            action=action,
+            base_rate=base_rate,
+            markup=markup,
+            rate=rate,
+            source=source,
+            issued_at=issued_at,
+            expires_at=issued_at + ttl,
+            network_markups={network: markup for network, markup in network_markups.items() if markup} or None,
+        )
+        quote = Quote(**{**unsigned.to_dict(), "signature": self._sign(unsigned.payload())})
+        self.issued += 1
+        return quote
+
+    def quote_for(self, action, current=None):
+        """Returns `current` while it is valid for `action`, otherwise a fresh quote."""
+        if current is not None and current.action == action.lower() and current.is_valid() and self.verify(current):
+            self.reused += 1
+            return current
+        return self.issue(action)
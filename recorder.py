@@ -0,0 +1,92 @@
+"""Opt-in recording of raw incoming updates, for replay with replay.py.
+
+`UpdateRecorder.install()` wraps `telebot.apihelper.get_updates`, so every
+update is written exactly as Telegram sent it, before any handler runs.
+Each line is compact JSON: {"t": <receive time>, "u": <raw update>}. Files
+rotate on size or age and rotated files are gzip-compressed, like the log
+pipeline. Recordings contain user messages, so keep them out of the repo.
+"""
+
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from log_pipeline import CompressingRotatingFileHandler
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateRecorder:
+    def __init__(self, path, max_bytes=20 * 1024 * 1024, max_age=24 * 60 * 60, backup_count=14):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.recorded = 0
+        self._handler = CompressingRotatingFileHandler(path, max_bytes, max_age, backup_count)
+        self._lock = threading.Lock()
+        self._installed = None  # (apihelper, original get_updates) while installed
+
+    def record(self, updates, received_at=None):
+        received_at = received_at or time.time()
+        with self._lock:
+            for update in updates:
+                line = json.dumps({"t": round(received_at, 3), "u": update}, separators=(",", ":"), ensure_ascii=False)
+                # The rotating handler checks for rollover and writes the line as-is
+                self._handler.emit(logging.makeLogRecord({"msg": line}))
+                self.recorded += 1
+
+    def install(self, apihelper):
+        """Wraps `apihelper.get_updates` so received updates are recorded before they are processed."""
+        get_updates = apihelper.get_updates
+
+        def recording_get_updates(*args, **kwargs):
+            updates = get_updates(*args, **kwargs)
+            if updates:
+                try:
+                    self.record(updates)
+                except Exception as e:
+                    logger.error(f"❌ Failed to record updates: {e}")
+            return updates
+
+        apihelper.get_updates = recording_get_updates
+        self._installed = (apihelper, get_updates)
+        logger.info(f"⏺️ Recording incoming updates to {self.path}")
+
+    def uninstall(self):
+        """Restores the original `get_updates`, e.g. before the shutdown ack, whose update must not be recorded."""
+        if self._installed is not None:
+            apihelper, get_updates = self._installed
+            apihelper.get_updates = get_updates
+            self._installed = None
+
+    def close(self):
+        with self._lock:
+            self._handler.close()
+
+
+def recording_files(path):
+    """The files of a recording, oldest first: rotated `.N.gz` backups, then the live file."""
+    def backup_number(name):
+        match = re.search(r"\.(\d+)\.gz$", name)
+        return int(match.group(1)) if match else 0
+
+    backups = sorted(glob.glob(f"{glob.escape(path)}.*.gz"), key=backup_number, reverse=True)
+    return backups + ([path] if os.path.exists(path) else [])
+
+
+def read_recording(paths):
+    """Yields (received_at, raw_update) from recording files, in the order given."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entry = json.loads(line)
+                    yield entry["t"], entry["u"]
@@ -0,0 +1,294 @@
+"""Replay a recording of updates through the bot's handlers, offline.
+
+    python replay.py recordings/updates.jsonl [--speed 1] [--threaded] [--json report.json]
+
+Telegram and the database are replaced by local stand-ins: API calls are
+answered by a fake request sender that returns plausible results, and
+storage is a `MemoryStorage`. Nothing leaves the machine. Updates are fed to
+`bot.process_new_updates` at max speed (the default) or at `--speed` times
+their recorded pace. The report lists per-handler timings, the session state
+transitions each update caused and the Telegram API calls made (in total and
+per completed trade), so two runs
+(e.g. before and after a change) can be compared on the same traffic.
+
+By default handlers run one at a time, in order, which makes transitions
+deterministic. `--threaded` uses the bot's worker pool instead, to reproduce
+races such as concurrent approve/reject callbacks on one user.
+"""
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from recorder import read_recording, recording_files
+from storage import MemoryStorage
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, result):
+        self.text = json.dumps({"ok": True, "result": result})
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class FakeTelegram:
+    """A `telebot.apihelper.CUSTOM_REQUEST_SENDER` that answers API calls locally."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.message_ids = itertools.count(1_000_000)
+        self.lock = threading.Lock()
+
+    def _message(self, params, text=None):
+        chat_id = params.get("chat_id", 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        message_id = params.get("message_id") or next(self.message_ids)
+        return {
+            "message_id": int(message_id),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text if text is not None else params.get("text", ""),
+        }
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        params = params or {}
+        api_method = url.rsplit("/", 1)[-1]
+        with self.lock:
+            self.calls[api_method] += 1
+
+        if api_method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Replay", "username": "replay_bot"}
+        elif api_method == "getFile":
+            result = {"file_id": params.get("file_id"), "file_unique_id": "replay", "file_path": "replay/file"}
+        elif api_method in ("sendPhoto", "sendDocument"):
+            message = self._message(params, text="")
+            message["photo"] = [{"file_id": "replay", "file_unique_id": "replay", "width": 1, "height": 1}]
+            result = message
+        elif api_method.startswith(("send", "forward", "copy")) or api_method.startswith("editMessage"):
+            result = self._message(params)
+        else:
+            result = True
+        return FakeResponse(result)
+
+
+class FixedPriceSource:
+    """Serves a fixed USDT/NGN rate in place of the live price sources."""
+
+    name = "replay"
+    timeout = 0.1
+
+    def __init__(self, rate):
+        self.rate = rate
+
+    def fetch(self):
+        return {"USDT": self.rate, "USDC": self.rate}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Replay:
+    def __init__(self, app, telegram, threaded=False):
+        self.app = app
+        self.telegram = telegram
+        self.bot = app.bot
+        self.bot.threaded = threaded
+        self.threaded = threaded
+        self.timings = defaultdict(list)
+        self.transitions = []
+        self.transition_counts = Counter()
+        self.api_calls_per_update = []
+        self.lock = threading.Lock()
+        self._wrap_handlers()
+
+    def _wrap_handlers(self):
+        for attr in ("message_handlers", "edited_message_handlers", "callback_query_handlers"):
+            for handler in getattr(self.bot, attr, []):
+                handler["function"] = self._timed(handler["function"])
+
+    def _timed(self, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    self.timings[func.__name__].append(elapsed)
+        return timed
+
+    def _state(self):
+        state = {}
+        for user_id, session in self.app.transactions.items():
+            state[("transaction", user_id)] = f"{session.action or '-'}:{session.step.name if session.step is not None else '-'}"
+        for user_id, session in self.app.user_registration.items():
+            state[("registration", user_id)] = f"step {session.step}"
+        return state
+
+    def _record_transitions(self, update_id, before, after):
+        for key in set(before) | set(after):
+            old, new = before.get(key, "none"), after.get(key, "none")
+            if old != new:
+                kind, user_id = key
+                self.transitions.append({"update_id": update_id, "kind": kind, "user_id": user_id, "from": old, "to": new})
+                self.transition_counts[f"{kind} {old} -> {new}"] += 1
+
+    def _wait_idle(self):
+        # Handlers are in flight until the lifecycle middleware sees them finish
+        while self.bot.worker_pool.tasks.qsize() or self.app.lifecycle.in_flight:
+            time.sleep(0.005)
+
+    def run(self, entries, speed=0.0, limit=None):
+        from telebot import types
+
+        first_recorded = None
+        previous_state = self._state()
+        started = time.perf_counter()
+        count = 0
+
+        for received_at, raw in itertools.islice(entries, limit):
+            if first_recorded is None:
+                first_recorded = received_at
+            if speed > 0:
+                delay = (received_at - first_recorded) / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+            calls_before = sum(self.telegram.calls.values())
+            self.bot.process_new_updates([types.Update.de_json(raw)])
+            if not self.threaded:
+                self.api_calls_per_update.append(sum(self.telegram.calls.values()) - calls_before)
+            # In threaded mode a change may be attributed to a later update than the one that caused it
+            state = self._state()
+            self._record_transitions(raw.get("update_id"), previous_state, state)
+            previous_state = state
+            count += 1
+
+        if self.threaded:
+            self._wait_idle()
+            self._record_transitions(None, previous_state, self._state())
+        self.app.transaction_writes.flush()
+        return count, time.perf_counter() - started
+
+    def report(self, count, elapsed):
+        handlers = {}
+        for name, samples in sorted(self.timings.items()):
+            handlers[name] = {
+                "calls": len(samples),
+                "total_ms": round(sum(samples) * 1000, 3),
+                "mean_ms": round(statistics.mean(samples) * 1000, 3),
+                "p50_ms": round(percentile(samples, 0.5) * 1000, 3),
+                "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+                "max_ms": round(max(samples) * 1000, 3),
+            }
+        return {
+            "updates": count,
+            "elapsed_s": round(elapsed, 3),
+            "updates_per_s": round(count / elapsed, 1) if elapsed else None,
+            "threaded": self.threaded,
+            "handlers": handlers,
+            "transitions": dict(self.transition_counts.most_common()),
+            "transition_log": self.transitions,
+            "api_calls": dict(self.telegram.calls.most_common()),
+            "api_calls_per_update": round(statistics.mean(self.api_calls_per_update), 2) if self.api_calls_per_update else None,
+            "api_calls_per_trade": self.app.api_calls.summary()["calls_per_completed_trade"],
+        }
+
+
+def print_report(report, verbose=False):
+    print(f"Replayed {report['updates']} updates in {report['elapsed_s']}s ({report['updates_per_s']}/s)")
+    print("\nHandler timings (ms)")
+    print(f"  {'handler':40} {'calls':>6} {'mean':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+    for name, timing in report["handlers"].items():
+        print(f"  {name:40} {timing['calls']:>6} {timing['mean_ms']:>8} {timing['p50_ms']:>8} {timing['p95_ms']:>8} {timing['max_ms']:>8}")
+
+    print("\nState transitions")
+    for transition, count in report["transitions"].items():
+        print(f"  {count:>6}  {transition}")
+    if verbose:
+        for transition in report["transition_log"]:
+            print(f"  update {transition['update_id']}: {transition['kind']} {transition['user_id']} "
+                  f"{transition['from']} -> {transition['to']}")
+
+    print("\nTelegram API calls")
+    for method, count in report["api_calls"].items():
+        print(f"  {count:>6}  {method}")
+    if report["api_calls_per_update"] is not None:
+        print(f"  {report['api_calls_per_update']} calls per update")
+    per_trade = report["api_calls_per_trade"]
+    if per_trade["samples"]:
+        print(f"  {per_trade['mean']} calls per completed trade ({per_trade['samples']} trade(s), p95 {per_trade['p95']})")
+
+
+def load_app(telegram, storage, admin_chat_id, rate):
+    """Imports the bot against the local stand-ins."""
+    os.environ.setdefault("BOT_TOKEN", "0:replay")
+    os.environ.setdefault("LOG_FILE", "replay.log")
+    if admin_chat_id is not None:
+        os.environ["ADMIN_CHAT_ID"] = str(admin_chat_id)
+
+    from telebot import apihelper
+    apihelper.CUSTOM_REQUEST_SENDER = telegram
+
+    import telegram_bot
+    telegram_bot.storage = storage
+    telegram_bot.pricing.sources = [FixedPriceSource(rate)]
+    telegram_bot.pricing.quorum = 1
+    return telegram_bot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("recording", nargs="+", help="recording file(s); a live file path also picks up its rotated .N.gz backups")
+    parser.add_argument("--speed", type=float, default=0.0, help="pace relative to the recording (1 = real time, 0 = max speed)")
+    parser.add_argument("--threaded", action="store_true", help="run handlers on the bot's worker pool")
+    parser.add_argument("--limit", type=int, help="replay only the first N updates")
+    parser.add_argument("--admin-chat-id", type=int, default=os.getenv("ADMIN_CHAT_ID"), help="admin chat id the recording was made with")
+    parser.add_argument("--rate", type=float, default=1500.0, help="USDT/NGN market rate served to the bot")
+    parser.add_argument("--seed", help="JSON file with the initial database contents (e.g. a Members export)")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--verbose", action="store_true", help="list every state transition")
+    args = parser.parse_args(argv)
+
+    paths = []
+    for path in args.recording:
+        paths += [path] if path.endswith(".gz") else recording_files(path)
+    if not paths:
+        parser.error("no recording files found")
+
+    seed = None
+    if args.seed:
+        with open(args.seed) as f:
+            seed = json.load(f)
+
+    telegram = FakeTelegram()
+    app = load_app(telegram, MemoryStorage(seed), args.admin_chat_id, args.rate)
+    replay = Replay(app, telegram, threaded=args.threaded)
+    count, elapsed = replay.run(read_recording(paths), speed=args.speed, limit=args.limit)
+    report = replay.report(count, elapsed)
+
+    print_report(report, verbose=args.verbose)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, default=str)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""Velocity and fraud checks on in-memory sliding windows.
+
+Checks run before a state transition. They count recent events per user id,
+wallet address and bank account number. Hard limits (too many sessions or
+receipt uploads) block the action. Soft signals (one wallet or account used
+by several users) let the trade continue but flag it to the admin. Each
+window holds a bounded number of keys and events, so memory stays flat, and
+each flagged key produces at most one admin alert per window.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+RiskDecision = namedtuple("RiskDecision", ["allowed", "flagged", "reason", "alert"])
+
+ALLOW = RiskDecision(True, False, None, False)
+
+
+class SlidingWindowCounter:
+    """Counts events per key over the last `window` seconds."""
+
+    def __init__(self, window, max_keys=10000, max_events=64):
+        self.window = window
+        self.max_keys = max_keys
+        self.max_events = max_events
+        self._events = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prune(self, events, now):
+        while events and events[0] <= now - self.window:
+            events.popleft()
+
+    def hit(self, key, now=None):
+        """Records an event and returns the number of events in the window, including it."""
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                events = self._events[key] = deque(maxlen=self.max_events)
+                # Evict the least recently used key
+                if len(self._events) > self.max_keys:
+                    self._events.popitem(last=False)
+            else:
+                self._events.move_to_end(key)
+            self._prune(events, now)
+            events.append(now)
+            return len(events)
+
+    def count(self, key, now=None):
+        now = now or time.monotonic()
+        with self._lock:
+            events = self._events.get(key)
+            if not events:
+                return 0
+            self._prune(events, now)
+            return len(events)
+
+
+class DistinctWindow:
+    """Tracks the distinct members seen for each key over the last `window` seconds."""
+
+    def __init__(self, window, max_keys=10000, max_members=16):
+        self.window = window
+        self.max_keys = max_keys
+        self.max_members = max_members
+        self._members = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, member, now=None):
+        """Records `member` for `key` and returns how many distinct members the key has in the window."""
+        now = now or time.monotonic()
+        with self._lock:
+            members = self._members.get(key)
+            if members is None:
+                members = self._members[key] = OrderedDict()
+                if len(self._members) > self.max_keys:
+                    self._members.popitem(last=False)
+            else:
+                self._members.move_to_end(key)
+
+            for old_member, seen_at in list(members.items()):
+                if seen_at <= now - self.window:
+                    del members[old_member]
+
+            members.pop(member, None)
+            members[member] = now
+            while len(members) > self.max_members:
+                members.popitem(last=False)
+            return len(members)
+
+
+class RiskEngine:
+    def __init__(self, max_sessions=5, session_window=600, max_receipts=3, receipt_window=600,
+                 max_users_per_wallet=1, max_users_per_account=1, shared_window=86400):
+        self.max_sessions = max_sessions
+        self.max_receipts = max_receipts
+        self.max_users_per_wallet = max_users_per_wallet
+        self.max_users_per_account = max_users_per_account
+
+        self.sessions = SlidingWindowCounter(session_window)
+        self.receipts = SlidingWindowCounter(receipt_window)
+        self.wallet_users = DistinctWindow(shared_window)
+        self.account_users = DistinctWindow(shared_window)
+        # One admin alert per flagged key per window
+        self._alerts = SlidingWindowCounter(shared_window)
+
+        self.blocked = 0
+        self.flagged = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_sessions=int(os.getenv("RISK_MAX_SESSIONS", "5")),
+            session_window=int(os.getenv("RISK_SESSION_WINDOW", "600")),
+            max_receipts=int(os.getenv("RISK_MAX_RECEIPTS", "3")),
+            receipt_window=int(os.getenv("RISK_RECEIPT_WINDOW", "600")),
+            max_users_per_wallet=int(os.getenv("RISK_MAX_USERS_PER_WALLET", "1")),
+            max_users_per_account=int(os.getenv("RISK_MAX_USERS_PER_ACCOUNT", "1")),
+            shared_window=int(os.getenv("RISK_SHARED_WINDOW", "86400")),
+        )
+
+    def _block(self, kind, key, reason):
+        self.blocked += 1
+        return RiskDecision(False, True, reason, self._alerts.hit((kind, key)) == 1)
+
+    def _flag(self, kind, key, reason):
+        self.flagged += 1
+        return RiskDecision(True, True, reason, self._alerts.hit((kind, key)) == 1)
+
+    def check_session_start(self, user_id):
+        count = self.sessions.hit(user_id)
+        if count > self.max_sessions:
+            return self._block("sessions", user_id, f"{count} trades started in {self.sessions.window // 60} min")
+        return ALLOW
+
+    def check_receipt(self, user_id):
+        count = self.receipts.hit(user_id)
+        if count > self.max_receipts:
+            return self._block("receipts", user_id, f"{count} receipts uploaded in {self.receipts.window // 60} min")
+        return ALLOW
+
+    def check_wallet(self, user_id, wallet_address):
+        # EVM addresses are case-insensitive (case only carries the checksum); base58 is not
+        key = wallet_address.lower() if wallet_address.startswith("0x") else wallet_address
+        users = self.wallet_users.add(key, user_id)
+        if users > self.max_users_per_wallet:
+            return self._flag("wallet", key, f"wallet {wallet_address} used by {users} accounts")
+        return ALLOW
+
+    def check_bank_account(self, user_id, account_number):
+        users = self.account_users.add(account_number, user_id)
+        if users > self.max_users_per_account:
+            return self._flag("account", account_number, f"bank account {account_number} used by {users} accounts")
+        return ALLOW
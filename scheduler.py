@@ -0,0 +1,358 @@
+"""Event-driven background job scheduler.
+
+A single thread sleeps on a condition variable until the earliest job
+deadline instead of polling. Jobs run on their own short-lived threads so a
+slow job never delays the others, and a job is never started again while a
+previous run of it is still going. Run state is persisted to a small JSON
+file so restarts keep their cadence.
+"""
+
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class CronSpec:
+    """Minimal five-field cron expression: minute hour day month weekday."""
+
+    FIELDS = (
+        ("minute", 0, 59),
+        ("hour", 0, 23),
+        ("day", 1, 31),
+        ("month", 1, 12),
+        ("weekday", 0, 6),  # 0 = Sunday, like cron
+    )
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression!r}")
+
+        self.expression = expression
+        values = {}
+        for (name, low, high), part in zip(self.FIELDS, parts):
+            values[name] = self._parse_field(part, low, high)
+
+        self.minutes = values["minute"]
+        self.hours = values["hour"]
+        self.days = values["day"]
+        self.months = values["month"]
+        # Accept 7 as Sunday too
+        self.weekdays = {0 if d == 7 else d for d in values["weekday"]}
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        result = set()
+        for chunk in field.split(","):
+            step = 1
+            if "/" in chunk:
+                chunk, step_text = chunk.split("/", 1)
+                step = int(step_text)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step: {field!r}")
+
+            if chunk == "*":
+                start, end = low, high
+            elif "-" in chunk:
+                start_text, end_text = chunk.split("-", 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = end = int(chunk)
+
+            # Weekday fields may use 7 for Sunday
+            upper = 7 if (low, high) == (0, 6) else high
+            if start < low or end > upper or start > end:
+                raise ValueError(f"Cron field out of range: {field!r}")
+
+            result.update(range(start, end + 1, step))
+        return result
+
+    def _day_matches(self, day):
+        weekday = (day.weekday() + 1) % 7  # Python: Monday = 0, cron: Sunday = 0
+        in_days = day.day in self.days
+        in_weekdays = weekday in self.weekdays
+
+        # Standard cron: when both fields are restricted either may match
+        if self.any_day:
+            return in_weekdays
+        if self.any_weekday:
+            return in_days
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """Returns the first matching minute strictly after `moment`."""
+        candidate = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        limit = candidate + datetime.timedelta(days=366 * 5)
+
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = (candidate + datetime.timedelta(days=1)).replace(hour=0, minute=0)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = (candidate + datetime.timedelta(hours=1)).replace(minute=0)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += datetime.timedelta(minutes=1)
+                continue
+            return candidate
+
+        raise ValueError(f"Cron expression never matches: {self.expression!r}")
+
+
+class Job:
+    """A scheduled job and its run bookkeeping."""
+
+    def __init__(self, name, func, kind, interval=None, cron=None, run_at=None, jitter=0):
+        self.name = name
+        self.func = func
+        self.kind = kind  # "interval", "cron" or "once"
+        self.interval = interval
+        self.cron = cron
+        self.run_at = run_at
+        self.jitter = jitter
+
+        self.next_run = None
+        self.last_run = None
+        self.last_duration = None
+        self.last_error = None
+        self.run_count = 0
+        self.failures = 0
+        self.skipped_overlaps = 0
+        self.running = False
+
+    def compute_next(self, now):
+        """Returns the next deadline (epoch seconds) after `now`, or None when done."""
+        spread = random.uniform(0, self.jitter) if self.jitter else 0
+
+        if self.kind == "interval":
+            return now + self.interval + spread
+        if self.kind == "cron":
+            moment = datetime.datetime.fromtimestamp(now)
+            return self.cron.next_after(moment).timestamp() + spread
+        return None  # One-shot jobs never repeat
+
+    def to_state(self):
+        return {
+            "next_run": self.next_run,
+            "last_run": self.last_run,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+            "run_count": self.run_count,
+            "failures": self.failures,
+            "cron": self.cron.expression if self.cron else None,
+        }
+
+    def status(self):
+        state = self.to_state()
+        state.update({"kind": self.kind, "running": self.running, "skipped_overlaps": self.skipped_overlaps})
+        return state
+
+
+class Scheduler:
+    """Runs interval, cron and one-shot jobs from a single sleeping thread."""
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self.heartbeat = None
+
+        self._jobs = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()  # job threads save concurrently; one writer at a time
+        self._thread = None
+        self._stopped = False
+        self._saved_state = self._load_state()
+
+    # Job registration
+
+    def every(self, name, seconds, func, jitter=0, run_immediately=False):
+        """Runs `func` every `seconds`, optionally spread by up to `jitter` seconds."""
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        job = Job(name, func, "interval", interval=seconds, jitter=jitter)
+        first = time.time() if run_immediately else job.compute_next(time.time())
+        return self._add(job, first, run_immediately)
+
+    def cron(self, name, expression, func, jitter=0):
+        """Runs `func` whenever the cron expression matches (local time)."""
+        job = Job(name, func, "cron", cron=CronSpec(expression), jitter=jitter)
+        return self._add(job, job.compute_next(time.time()))
+
+    def once(self, name, delay, func, jitter=0):
+        """Runs `func` once after `delay` seconds."""
+        run_at = time.time() + delay + (random.uniform(0, jitter) if jitter else 0)
+        job = Job(name, func, "once", run_at=run_at, jitter=jitter)
+        return self._add(job, run_at)
+
+    def cancel(self, name):
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            self._cond.notify()
+        return job is not None
+
+    def _add(self, job, first_run, run_immediately=False):
+        with self._cond:
+            saved = self._saved_state.get(job.name)
+            if saved:
+                job.last_run = saved.get("last_run")
+                job.last_duration = saved.get("last_duration")
+                job.last_error = saved.get("last_error")
+                job.run_count = saved.get("run_count", 0)
+                job.failures = saved.get("failures", 0)
+
+                # Keep the persisted cadence across restarts, but never run a
+                # recurring job earlier than its first natural deadline allows.
+                # A cron deadline saved under a different expression is dropped.
+                # run_immediately wins: those jobs warm caches and probes on startup.
+                saved_next = saved.get("next_run")
+                if job.kind == "cron" and saved_next and saved_next > time.time():
+                    if saved.get("cron") == job.cron.expression:
+                        first_run = max(first_run, saved_next)
+                elif job.kind == "interval" and saved_next and not run_immediately:
+                    first_run = max(saved_next, time.time())
+
+            job.next_run = first_run
+            self._jobs[job.name] = job
+            heapq.heappush(self._heap, (first_run, next(self._counter), job.name))
+            self._cond.notify()
+        return job
+
+    # Lifecycle
+
+    def start(self):
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run_loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.save_state()
+
+    def is_alive(self):
+        return bool(self._thread and self._thread.is_alive())
+
+    def run_now(self, name):
+        """Triggers a job immediately (still honouring the overlap guard)."""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                raise KeyError(name)
+            self._dispatch(job)
+
+    def jobs_status(self):
+        with self._cond:
+            return {name: job.status() for name, job in self._jobs.items()}
+
+    def _run_loop(self):
+        logger.info("✅ Scheduler started")
+        with self._cond:
+            while not self._stopped:
+                self.heartbeat = time.time()
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                deadline, _, name = self._heap[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+                job = self._jobs.get(name)
+
+                # Skip heap entries left behind by cancelled or rescheduled jobs
+                if job is None or job.next_run != deadline:
+                    continue
+
+                job.next_run = job.compute_next(time.time())
+                if job.next_run is not None:
+                    heapq.heappush(self._heap, (job.next_run, next(self._counter), job.name))
+
+                self._dispatch(job)
+
+        logger.info("🛑 Scheduler stopped")
+
+    def _dispatch(self, job):
+        # Caller holds self._cond
+        if job.running:
+            job.skipped_overlaps += 1
+            logger.warning(f"⚠️ Job '{job.name}' is still running, skipping this run")
+            return
+
+        job.running = True
+        threading.Thread(target=self._execute, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+    def _execute(self, job):
+        started = time.time()
+        error = None
+        try:
+            job.func()
+        except Exception as e:
+            error = str(e)
+            logger.error(f"❌ Scheduled job '{job.name}' failed: {e}")
+            logger.error(traceback.format_exc())
+
+        with self._cond:
+            job.running = False
+            job.last_run = started
+            job.last_duration = time.time() - started
+            job.last_error = error
+            job.run_count += 1
+            if error:
+                job.failures += 1
+            if job.kind == "once" and self._jobs.get(job.name) is job:
+                del self._jobs[job.name]
+
+        self.save_state()
+
+    # Persistence
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read scheduler state: {e}")
+            return {}
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        # The snapshot is taken under the save lock too, so an older one never replaces a newer one
+        with self._save_lock:
+            with self._cond:
+                state = {name: job.to_state() for name, job in self._jobs.items()}
+
+            tmp_path = f"{self.state_path}.tmp"
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(state, f)
+                os.replace(tmp_path, self.state_path)
+            except Exception as e:
+                logger.error(f"Failed to save scheduler state: {e}")
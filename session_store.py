@@ -0,0 +1,116 @@
+"""In-memory session store with idle expiry.
+
+Entries expire after `ttl` seconds without being written or read through
+`store[key]` or `get()`. `peek()` reads without counting as activity, for
+filters, log context and timers. Expiry is decided by the periodic
+`sweep()` alone, so an entry stays visible to every accessor until the sweep
+after its deadline reclaims it (the TTL is honoured to within one sweep
+interval) and lookups never disagree about whether a session is still there.
+That keeps `peek()`, which runs in every handler filter, down to a single
+dict read with no lock and no clock call. Expiry notices are delivered by
+`sweep()` as well.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Dict-like mapping of user key -> session with idle TTL."""
+
+    def __init__(self, name, ttl, on_expire=None):
+        self.name = name
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.expired_total = 0
+
+        self._data = {}
+        self._deadlines = {}
+        self._pending_notices = deque()
+        self._lock = threading.RLock()
+
+        # peek(key, default=None) reads without extending the entry's lifetime.
+        # It is the dict's own get: atomic, no lock and no Python frame per filter.
+        self.peek = self._data.get
+
+    def _expire(self, key):
+        # Caller holds self._lock
+        value = self._data.pop(key)
+        del self._deadlines[key]
+        self.expired_total += 1
+        if self.on_expire:
+            self._pending_notices.append((key, value))
+
+    def touch(self, key):
+        """Extends the entry's lifetime; returns False if it is gone."""
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._deadlines[key] = time.monotonic() + self.ttl
+            return True
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __getitem__(self, key):
+        with self._lock:
+            value = self._data[key]
+            self._deadlines[key] = time.monotonic() + self.ttl
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._deadlines[key] = time.monotonic() + self.ttl
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            del self._deadlines[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        """Like `store[key]` (extends the entry's lifetime), but returns `default` if it is gone."""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._deadlines[key] = time.monotonic() + self.ttl
+            return self._data[key]
+
+    def pop(self, key, *default):
+        with self._lock:
+            self._deadlines.pop(key, None)
+            return self._data.pop(key, *default)
+
+    def items(self):
+        """Snapshot of the entries."""
+        with self._lock:
+            return list(self._data.items())
+
+    def sweep(self):
+        """Drops every expired entry and delivers queued expiry notices."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, deadline in self._deadlines.items() if deadline <= now]
+            for key in expired:
+                self._expire(key)
+
+            notices = list(self._pending_notices)
+            self._pending_notices.clear()
+
+        for key, value in notices:
+            try:
+                self.on_expire(key, value)
+            except Exception as e:
+                logger.error(f"Failed to deliver {self.name} expiry notice for {key}: {e}")
+
+        if notices:
+            logger.info(f"🧹 Expired {len(notices)} {self.name} sessions ({len(self)} active)")
+        return len(expired)
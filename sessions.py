@@ -0,0 +1,128 @@
+"""Typed, slotted session objects for registrations and transactions.
+
+Sessions used to be free-form dicts keyed by stringified user ids. These
+classes keep the same field names (so Firebase records are unchanged) but
+store them in fixed slots, key them by integer Telegram user id and track
+the flow position with an IntEnum.
+"""
+
+from dataclasses import dataclass, fields
+from enum import IntEnum
+from typing import Optional
+
+from quotes import Quote
+
+
+class Step(IntEnum):
+    """Position of a transaction in the Buy/Sell flow."""
+
+    REJECTED = 0
+    ENTER_AMOUNT = 1
+    AWAITING_PAYMENT = 2         # Buy: upload receipt / Sell: confirm quote
+    RECEIPT_UPLOADED = 3         # Buy: waiting for admin approval
+    ENTER_WALLET = 4             # Buy: user provides wallet address + network
+    AWAITING_USDT_TRANSFER = 5   # Buy: admin sends USDT
+    USDT_SENT = 6                # Buy: user confirms receipt
+    SELECT_NETWORK = 7           # Sell: user picks network
+    AWAITING_PROOF = 8           # Sell: user uploads transfer proof
+    PROOF_UPLOADED = 9           # Sell: waiting for admin confirmation
+    ENTER_BANK_DETAILS = 10      # Sell: user provides bank details
+    AWAITING_NAIRA_TRANSFER = 11 # Sell: admin sends Naira
+    NAIRA_SENT = 12              # Sell: user confirms receipt
+
+
+@dataclass(slots=True)
+class TransactionSession:
+    user_id: int
+    transaction_id: str
+    action: str = ""
+    step: Step = Step.ENTER_AMOUNT
+    start_time: Optional[str] = None
+    amount: Optional[float] = None
+    naira_amount: Optional[float] = None
+    receipt: Optional[str] = None
+    transaction_proof: Optional[str] = None
+    wallet_address: Optional[str] = None
+    network: Optional[str] = None
+    company_wallet: Optional[str] = None
+    bank_details: Optional[str] = None
+    status: Optional[str] = None
+    timer: int = 0
+    timer_message_id: Optional[int] = None
+    quote: Optional[Quote] = None
+
+    def to_dict(self):
+        """Serializes set fields only, with the same keys as the old dicts.
+
+        Spelled out field by field: it runs on every logged step, and direct
+        slot reads are several times faster than iterating `fields()`.
+        """
+        data = {
+            "user_id": self.user_id,
+            "transaction_id": self.transaction_id,
+            "action": self.action,
+            "step": int(self.step),
+            "timer": self.timer,
+        }
+        if self.start_time is not None:
+            data["start_time"] = self.start_time
+        if self.amount is not None:
+            data["amount"] = self.amount
+        if self.naira_amount is not None:
+            data["naira_amount"] = self.naira_amount
+        if self.receipt is not None:
+            data["receipt"] = self.receipt
+        if self.transaction_proof is not None:
+            data["transaction_proof"] = self.transaction_proof
+        if self.wallet_address is not None:
+            data["wallet_address"] = self.wallet_address
+        if self.network is not None:
+            data["network"] = self.network
+        if self.company_wallet is not None:
+            data["company_wallet"] = self.company_wallet
+        if self.bank_details is not None:
+            data["bank_details"] = self.bank_details
+        if self.status is not None:
+            data["status"] = self.status
+        if self.timer_message_id is not None:
+            data["timer_message_id"] = self.timer_message_id
+        if self.quote is not None:
+            data["quote"] = self.quote.to_dict()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {name: data[name] for name in _TRANSACTION_FIELDS if name in data}
+        known["user_id"] = int(known["user_id"])
+        known["step"] = Step(int(known.get("step", Step.ENTER_AMOUNT)))
+        if known.get("quote"):
+            known["quote"] = Quote.from_dict(known["quote"])
+        return cls(**known)
+
+
+@dataclass(slots=True)
+class RegistrationSession:
+    user_id: int
+    username: str
+    step: int = 1
+    full_name: Optional[str] = None
+    email: Optional[str] = None
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "username": self.username,
+            "step": self.step,
+            "full_name": self.full_name,
+            "email": self.email,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {name: data[name] for name in _REGISTRATION_FIELDS if name in data}
+        known["user_id"] = int(known["user_id"])
+        return cls(**known)
+
+
+_TRANSACTION_FIELDS = tuple(f.name for f in fields(TransactionSession))
+_REGISTRATION_FIELDS = tuple(f.name for f in fields(RegistrationSession))
@@ -0,0 +1,432 @@
+"""Storage backends for members, transactions and runtime documents.
+
+All persistence goes through one `Storage` interface, picked at startup
+with STORAGE_BACKEND:
+
+- `firebase` (default): the Firebase Realtime Database. Batched writes use
+  one multi-path update.
+- `sqlite`: a local SQLite file (SQLITE_PATH), for small deployments.
+- `memory`: process-local dicts, for benchmarks and replay. Nothing survives
+  a restart.
+
+Records are plain JSON-compatible dicts in every backend. Members are keyed
+by Telegram username. Transactions are keyed by (user key, transaction id).
+Documents hold runtime state (stats, config overrides, session snapshots,
+broadcast checkpoints) under slash-separated paths, e.g. "stats/aggregates".
+"""
+
+import copy
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Storage(ABC):
+    """The interface every backend implements; a backend missing a method fails when it is created."""
+
+    name = "base"
+
+    # Members
+
+    @abstractmethod
+    def get_member(self, username):
+        ...
+
+    @abstractmethod
+    def get_members(self, usernames):
+        """Returns {username: record} for the usernames that exist."""
+
+    @abstractmethod
+    def put_member(self, username, record):
+        ...
+
+    @abstractmethod
+    def update_member(self, username, fields):
+        """Merges `fields` into the record; a None value removes the field."""
+
+    @abstractmethod
+    def member_page(self, start_after, limit):
+        """Returns up to `limit` (username, record) pairs after `start_after`, in key order."""
+
+    # Transactions
+
+    def put_transaction(self, user_key, transaction_id, record):
+        self.put_transactions([((user_key, transaction_id), record)])
+
+    @abstractmethod
+    def put_transactions(self, items):
+        """Writes [((user_key, transaction_id), record)] in one batch."""
+
+    @abstractmethod
+    def get_transactions(self, user_key):
+        """Returns {transaction_id: record} for one user (archived records excluded)."""
+
+    @abstractmethod
+    def iter_transactions(self):
+        """Yields (user_key, transaction_id, record) for all unarchived transactions."""
+
+    @abstractmethod
+    def archive_transactions(self, cutoff):
+        """Archives transactions whose id sorts before `cutoff`; returns how many moved."""
+
+    # Documents
+
+    @abstractmethod
+    def get_document(self, path):
+        ...
+
+    @abstractmethod
+    def set_document(self, path, value):
+        """Replaces the document; None deletes it."""
+
+    @abstractmethod
+    def update_document(self, path, fields):
+        """Merges `fields` into a dict document; a None value removes the field."""
+
+    def delete_document(self, path):
+        self.set_document(path, None)
+
+    @abstractmethod
+    def append_log(self, path, entry):
+        """Appends an entry to an append-only log (e.g. the config audit log)."""
+
+    @abstractmethod
+    def ping(self):
+        """A cheap round trip, for health checks."""
+
+
+def _merge(record, fields):
+    merged = dict(record or {})
+    for key, value in fields.items():
+        if value is None:
+            merged.pop(key, None)
+        else:
+            merged[key] = value
+    return merged
+
+
+class FirebaseStorage(Storage):
+    name = "firebase"
+
+    def __init__(self, credentials_json, database_url=None, fetch_workers=8):
+        import firebase_admin
+        from firebase_admin import credentials, db
+
+        if not credentials_json:
+            raise FileNotFoundError("❌ Firebase credentials not found in environment variables")
+        cred = credentials.Certificate(json.loads(credentials_json))
+        firebase_admin.initialize_app(cred, {"databaseURL": database_url} if database_url else None)
+        logger.info("✅ Firebase initialized from environment variable")
+
+        self.db = db
+        # The Realtime Database has no multi-get, so batched reads fan out
+        self._fetcher = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="firebase-get")
+
+    def get_member(self, username):
+        return self.db.reference(f'Members/{username}').get()
+
+    def get_members(self, usernames):
+        usernames = list(usernames)
+        records = self._fetcher.map(self.get_member, usernames)
+        return {username: record for username, record in zip(usernames, records) if record is not None}
+
+    def put_member(self, username, record):
+        self.db.reference(f'Members/{username}').set(record)
+
+    def update_member(self, username, fields):
+        self.db.reference(f'Members/{username}').update(fields)
+
+    def member_page(self, start_after, limit):
+        query = self.db.reference('Members').order_by_key()
+        if start_after is None:
+            page = query.limit_to_first(limit).get() or {}
+        else:
+            # start_at is inclusive, so fetch one extra and drop the key already seen
+            page = query.start_at(start_after).limit_to_first(limit + 1).get() or {}
+            page.pop(start_after, None)
+        return list(page.items())[:limit]
+
+    def put_transactions(self, items):
+        # One multi-path update writes the whole batch in a single round trip
+        self.db.reference().update({
+            f'transactions/{user_key}/{transaction_id}': record
+            for (user_key, transaction_id), record in items
+        })
+
+    def get_transactions(self, user_key):
+        return self.db.reference(f'transactions/{user_key}').get() or {}
+
+    def iter_transactions(self):
+        history = self.db.reference('transactions').get() or {}
+        for user_key, entries in history.items():
+            for transaction_id, record in (entries or {}).items():
+                if isinstance(record, dict):
+                    yield user_key, transaction_id, record
+
+    def archive_transactions(self, cutoff):
+        users = self.db.reference('transactions').get(shallow=True) or {}
+        moved = 0
+        for user_key in users:
+            updates = {}
+            for transaction_id, record in self.get_transactions(user_key).items():
+                if transaction_id < cutoff:
+                    updates[f'transactions_archive/{user_key}/{transaction_id}'] = record
+                    updates[f'transactions/{user_key}/{transaction_id}'] = None
+            if updates:
+                # Multi-path update moves the records atomically
+                self.db.reference().update(updates)
+                moved += len(updates) // 2
+        return moved
+
+    def get_document(self, path):
+        return self.db.reference(path).get()
+
+    def set_document(self, path, value):
+        if value is None:
+            self.db.reference(path).delete()
+        else:
+            self.db.reference(path).set(value)
+
+    def update_document(self, path, fields):
+        self.db.reference(path).update(fields)
+
+    def append_log(self, path, entry):
+        self.db.reference(path).push(entry)
+
+    def ping(self):
+        self.db.reference('runtime/health_probe').get()
+
+
+class MemoryStorage(Storage):
+    name = "memory"
+
+    def __init__(self, data=None):
+        self.members = {}
+        self.transactions = {}
+        self.archive = {}
+        self.documents = {}
+        self.logs = {}
+        self._lock = threading.RLock()
+        if data:
+            self.load(data)
+
+    def load(self, data):
+        """Loads a Firebase export: {"Members": {...}, "transactions": {...}}."""
+        with self._lock:
+            self.members.update(copy.deepcopy(data.get("Members") or {}))
+            for user_key, entries in (data.get("transactions") or {}).items():
+                self.transactions.setdefault(user_key, {}).update(copy.deepcopy(entries))
+
+    def get_member(self, username):
+        with self._lock:
+            return copy.deepcopy(self.members.get(username))
+
+    def get_members(self, usernames):
+        with self._lock:
+            return {username: copy.deepcopy(self.members[username]) for username in usernames if username in self.members}
+
+    def put_member(self, username, record):
+        with self._lock:
+            self.members[username] = copy.deepcopy(record)
+
+    def update_member(self, username, fields):
+        with self._lock:
+            self.members[username] = _merge(self.members.get(username), copy.deepcopy(fields))
+
+    def member_page(self, start_after, limit):
+        with self._lock:
+            keys = sorted(key for key in self.members if start_after is None or key > start_after)[:limit]
+            return [(key, copy.deepcopy(self.members[key])) for key in keys]
+
+    def put_transactions(self, items):
+        with self._lock:
+            for (user_key, transaction_id), record in items:
+                self.transactions.setdefault(str(user_key), {})[transaction_id] = copy.deepcopy(record)
+
+    def get_transactions(self, user_key):
+        with self._lock:
+            return copy.deepcopy(self.transactions.get(str(user_key), {}))
+
+    def iter_transactions(self):
+        with self._lock:
+            rows = [(user_key, transaction_id, copy.deepcopy(record))
+                    for user_key, entries in self.transactions.items()
+                    for transaction_id, record in entries.items()]
+        return iter(rows)
+
+    def archive_transactions(self, cutoff):
+        moved = 0
+        with self._lock:
+            for user_key, entries in self.transactions.items():
+                for transaction_id in [transaction_id for transaction_id in entries if transaction_id < cutoff]:
+                    self.archive.setdefault(user_key, {})[transaction_id] = entries.pop(transaction_id)
+                    moved += 1
+        return moved
+
+    def get_document(self, path):
+        with self._lock:
+            return copy.deepcopy(self.documents.get(path))
+
+    def set_document(self, path, value):
+        with self._lock:
+            if value is None:
+                self.documents.pop(path, None)
+            else:
+                self.documents[path] = copy.deepcopy(value)
+
+    def update_document(self, path, fields):
+        with self._lock:
+            self.documents[path] = _merge(self.documents.get(path), copy.deepcopy(fields))
+
+    def append_log(self, path, entry):
+        with self._lock:
+            self.logs.setdefault(path, []).append(copy.deepcopy(entry))
+
+    def ping(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS members (
+            username TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            user_key TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            archived INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_key, transaction_id)
+        );
+        CREATE TABLE IF NOT EXISTS documents (
+            path TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path="bot.sqlite3"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # One connection shared by all threads, serialized by the lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        self._lock = threading.Lock()
+        logger.info(f"✅ SQLite storage opened at {path}")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql, params=(), many=False):
+        with self._lock, self._conn:
+            if many:
+                self._conn.executemany(sql, params)
+            else:
+                self._conn.execute(sql, params)
+
+    def get_member(self, username):
+        rows = self._query("SELECT data FROM members WHERE username = ?", (username,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_members(self, usernames):
+        usernames = list(usernames)
+        found = {}
+        # Stay under SQLite's bound-parameter limit
+        for offset in range(0, len(usernames), 500):
+            chunk = usernames[offset:offset + 500]
+            placeholders = ",".join("?" * len(chunk))
+            for username, data in self._query(f"SELECT username, data FROM members WHERE username IN ({placeholders})", chunk):
+                found[username] = json.loads(data)
+        return found
+
+    def put_member(self, username, record):
+        self._write("INSERT OR REPLACE INTO members (username, data) VALUES (?, ?)", (username, json.dumps(record)))
+
+    def update_member(self, username, fields):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT data FROM members WHERE username = ?", (username,)).fetchall()
+            record = _merge(json.loads(rows[0][0]) if rows else {}, fields)
+            self._conn.execute("INSERT OR REPLACE INTO members (username, data) VALUES (?, ?)", (username, json.dumps(record)))
+
+    def member_page(self, start_after, limit):
+        rows = self._query(
+            "SELECT username, data FROM members WHERE username > ? ORDER BY username LIMIT ?",
+            ("" if start_after is None else start_after, limit)
+        )
+        return [(username, json.loads(data)) for username, data in rows]
+
+    def put_transactions(self, items):
+        self._write(
+            "INSERT OR REPLACE INTO transactions (user_key, transaction_id, data, archived) VALUES (?, ?, ?, 0)",
+            [(str(user_key), transaction_id, json.dumps(record)) for (user_key, transaction_id), record in items],
+            many=True
+        )
+
+    def get_transactions(self, user_key):
+        rows = self._query("SELECT transaction_id, data FROM transactions WHERE user_key = ? AND archived = 0", (str(user_key),))
+        return {transaction_id: json.loads(data) for transaction_id, data in rows}
+
+    def iter_transactions(self):
+        rows = self._query("SELECT user_key, transaction_id, data FROM transactions WHERE archived = 0")
+        return ((user_key, transaction_id, json.loads(data)) for user_key, transaction_id, data in rows)
+
+    def archive_transactions(self, cutoff):
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE transactions SET archived = 1 WHERE archived = 0 AND transaction_id < ?", (cutoff,)
+            ).rowcount
+
+    def get_document(self, path):
+        rows = self._query("SELECT data FROM documents WHERE path = ?", (path,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def set_document(self, path, value):
+        if value is None:
+            self._write("DELETE FROM documents WHERE path = ?", (path,))
+        else:
+            self._write("INSERT OR REPLACE INTO documents (path, data) VALUES (?, ?)", (path, json.dumps(value)))
+
+    def update_document(self, path, fields):
+        with self._lock, self._conn:
+            rows = self._conn.execute("SELECT data FROM documents WHERE path = ?", (path,)).fetchall()
+            document = _merge(json.loads(rows[0][0]) if rows else {}, fields)
+            self._conn.execute("INSERT OR REPLACE INTO documents (path, data) VALUES (?, ?)", (path, json.dumps(document)))
+
+    def append_log(self, path, entry):
+        self._write("INSERT INTO logs (path, data, created_at) VALUES (?, ?, ?)", (path, json.dumps(entry), time.time()))
+
+    def ping(self):
+        self._query("SELECT 1")
+
+
+def create_storage(backend=None):
+    """Builds the backend named by `backend` or STORAGE_BACKEND (default: firebase)."""
+    backend = (backend or os.getenv("STORAGE_BACKEND", "firebase")).lower()
+    if backend == "firebase":
+        return FirebaseStorage(os.getenv("FIREBASE_CREDENTIALS_JSON"), os.getenv("DATABASE_URL"))
+    if backend == "sqlite":
+        return SQLiteStorage(os.getenv("SQLITE_PATH", "bot.sqlite3"))
+    if backend == "memory":
+        logger.warning("⚠️ Using in-memory storage: nothing is persisted across restarts")
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
@@ -1,16 +1,13 @@
 
-import firebase_admin
-from firebase_admin import credentials, db
 import requests
 import telebot
 from telebot import TeleBot, types
 from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
 import datetime
-import schedule
+import functools
 import time
 import threading
 import traceback
-import re
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -18,21 +15,43 @@ import json
 import os
 from dotenv import load_dotenv
 import logging
-from flask import Flask
+import atexit
+from flask import Flask, abort, jsonify, request
 from threading import Thread
+from scheduler import Scheduler
+from session_store import SessionStore
+from sessions import RegistrationSession, Step, TransactionSession
+from lifecycle import Lifecycle, LifecycleMiddleware
+from write_behind import WriteBehindQueue
+from quotes import QuoteEngine
+from pricing import PricingEngine, default_sources
+from analytics import StatsAggregator
+from risk import RiskEngine
+from broadcast import Broadcaster
+from health import INFO, LIVENESS, READINESS, HealthMiddleware, HealthMonitor, age
+from recorder import UpdateRecorder
+from api_budget import ApiCallCounter, MessageTracker
+from storage import create_storage
+from config import ConfigError, ConfigManager, env_source, file_source
+from validation import is_valid_email, is_valid_name, is_valid_wallet_address, parse_bank_details, validate_batch, wallet_networks
+from log_pipeline import LogContextMiddleware, bind_log_context, current_log_context, parse_sample_rates, setup_logging
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
+# Configure logging: handler threads only enqueue, a listener thread writes
+log_listener = setup_logging(
+    os.getenv("LOG_FILE", "bot_errors.log"),
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot_errors.log"),
-        logging.StreamHandler()
-    ]
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", str(5 * 1024 * 1024))),
+    max_age=int(os.getenv("LOG_MAX_AGE", str(24 * 60 * 60))),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", "7")),
+    window=float(os.getenv("LOG_RATE_WINDOW", "60")),
+    burst=int(os.getenv("LOG_RATE_BURST", "5")),
+    sample_rates=parse_sample_rates(os.getenv("LOG_SAMPLE_RATES", "")),
+    capture_loggers=("TeleBot",)
 )
+atexit.register(log_listener.stop)
 
 logger = logging.getLogger(__name__)
 
@@ -41,36 +60,28 @@ app = Flask(__name__)
 
 @app.route('/')
 def home():
+    # Report drain progress while shutting down so the platform routes away
+    if not lifecycle.accepting():
+        return jsonify(lifecycle.status()), 503
     return "Bot is alive!"
 
 def run_flask():
     app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
 
-
 # Start Flask in a separate thread
-flask_thread = Thread(target=run_flask)
-flask_thread.daemon = True
-flask_thread.start()
-
-logger.info("Flask server started")
+def start_flask():
+    flask_thread = Thread(target=run_flask)
+    flask_thread.daemon = True
+    flask_thread.start()
+    logger.info("Flask server started")
 
 # Load secrets from environment variables
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = os.getenv("ADMIN_CHAT_ID")
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-firebase_credentials_json = os.getenv("FIREBASE_CREDENTIALS_JSON")
 
-if firebase_credentials_json:
-    try:
-        firebase_credentials = json.loads(firebase_credentials_json)
-        cred = credentials.Certificate(firebase_credentials)
-        firebase_admin.initialize_app(cred)
-        print("✅ Firebase initialized from environment variable")
-    except Exception as e:
-        print(f"❌ Error initializing Firebase: {e}")
-else:
-    raise FileNotFoundError("❌ Firebase credentials not found in environment variables")
+# Persistence backend (Firebase, SQLite or in-memory), created by the entry point
+# from STORAGE_BACKEND so the module can be imported (e.g. by replay.py) without it
+storage = None
 
 
 # Convert ADMIN_CHAT_ID to integer
@@ -84,34 +95,97 @@ except ValueError as e:
     logger.error(f"❌ ADMIN_CHAT_ID Error: {str(e)}")
 
 # Initialize Telegram Bot
-bot = telebot.TeleBot(BOT_TOKEN)
+bot = telebot.TeleBot(BOT_TOKEN, use_class_middlewares=True)
 logger.info("✅ Telegram bot initialized successfully.")
 
+# Graceful shutdown: track in-flight handlers and drain on SIGTERM
+lifecycle = Lifecycle(drain_timeout=float(os.getenv("DRAIN_TIMEOUT", "20")))
+bot.setup_middleware(LifecycleMiddleware(lifecycle))
+lifecycle.track_updates(bot)
+
+
+# Runtime configuration: defaults < CONFIG_FILE < CONFIG_* env vars < Firebase overrides
+CONFIG_OVERRIDES_PATH = 'config/overrides'
+CONFIG_AUDIT_PATH = 'config/audit'
+DEFAULT_CONFIG = {
+    "pair_markups": {
+        "USDT": {"buy": 30.0, "sell": -8.0},
+        "USDC": {"buy": 30.0, "sell": -8.0},
+        "BTC": {"buy": 0.0, "sell": 0.0},
+    },
+    "network_markups": {"TRC20": 0.0, "BEP20": 0.0, "ERC20": 0.0},
+    "fallback_rate": 1400.0,
+    "transaction_timeout": 15 * 60,  # seconds
+    "usdt_networks": ["TRC20", "ERC20", "BEP20"],
+    "company_wallets": {
+        "TRC20": "TGpQAU6CcHo6rTHrf6gseZy6eu1qnQ4g5m",
+        "BEP20": "0x9498665dc2ca80d8cd108fe76734989960ec85bc"
+    },
+    "admin_account_details": "Bank: Zenith Bank Pc\nAcct Name: MECH XPERT AUTO SERVICES\nAcct No: 1219799200",
+    "support_email": "rehobotics.technologies@gmail.com",
+}
+
+def load_config_overrides():
+    return storage.get_document(CONFIG_OVERRIDES_PATH) or {}
+
+def store_config_override(key, value):
+    storage.update_document(CONFIG_OVERRIDES_PATH, {key: value})
+
+def audit_config_change(entry):
+    storage.append_log(CONFIG_AUDIT_PATH, entry)
+
+config = ConfigManager(
+    DEFAULT_CONFIG,
+    sources=[file_source(os.getenv("CONFIG_FILE", "config.json")), env_source(), load_config_overrides],
+    audit=audit_config_change,
+    store=store_config_override
+)
 
 # Global variables
-user_registration = {}
-transactions = {}
-TRANSACTION_TIMEOUT = 15 * 60  # seconds
+REGISTRATION_SESSION_TTL = 30 * 60  # seconds of inactivity
+TRANSACTION_SESSION_TTL = 2 * config.current.transaction_timeout  # seconds of inactivity
+TIMER_UPDATE_INTERVAL = int(os.getenv("TIMER_UPDATE_INTERVAL", "15"))  # seconds between timer message edits
 transaction_lock = threading.Lock()
 
-# Supported USDT Networks
-USDT_NETWORKS = ["TRC20", "ERC20", "BEP20"]
+def notify_registration_expired(user_id, session):
+    bot.send_message(user_id, "⌛ Your registration session has expired. Use /register to start again.")
 
-# Company USDT Wallets
-COMPANY_WALLETS = {
-    "TRC20": "TGpQAU6CcHo6rTHrf6gseZy6eu1qnQ4g5m",
-    "BEP20": "0x9498665dc2ca80d8cd108fe76734989960ec85bc"
-}
+def notify_transaction_expired(user_id, session):
+    api_calls.finish(session.transaction_id, "expired")
+    bot.send_message(user_id, "⌛ Your transaction session has expired due to inactivity. Please /login to start a new transaction.")
 
-# Admin bank account details
-ADMIN_ACCOUNT_DETAILS = "Bank: Zenith Bank Pc\nAcct Name: MECH XPERT AUTO SERVICES\nAcct No: 1219799200"
+user_registration = SessionStore("registration", REGISTRATION_SESSION_TTL, on_expire=notify_registration_expired)
+transactions = SessionStore("transaction", TRANSACTION_SESSION_TTL, on_expire=notify_transaction_expired)
 
-# Support email address
-SUPPORT_EMAIL = "rehobotics.technologies@gmail.com"
+def resolve_log_context(update):
+    """Log fields for an update: the customer it concerns and their transaction."""
+    user_id = update.from_user.id
+    data = getattr(update, "data", None)
+    # Admin callbacks carry the customer's id at the end of the callback data
+    if data and data.rsplit("_", 1)[-1].isdigit():
+        user_id = int(data.rsplit("_", 1)[-1])
+
+    session = transactions.peek(user_id)
+    if session is None:
+        return {"user_id": user_id}
+    return {"user_id": user_id, "transaction_id": session.transaction_id, "step": int(session.step)}
+
+bot.setup_middleware(LogContextMiddleware(resolve_log_context))
+
+# Bot API calls are counted per transaction (from the log context); prompts and timers are edited in place
+api_calls = ApiCallCounter(lambda: current_log_context().get("transaction_id"))
+api_calls.install(telebot.apihelper)
+message_tracker = MessageTracker(bot)
+
+# Health signals: long-poll round trips and handled updates
+health = HealthMonitor()
+health.track_polling(bot)
+bot.setup_middleware(HealthMiddleware(health))
 
 # Error Handler Function
 def error_handler(func):
     """Decorator to handle API errors and avoid crashes."""
+    @functools.wraps(func)
     def wrapper(message, *args, **kwargs):
         try:
             return func(message, *args, **kwargs)
@@ -139,168 +213,388 @@ def error_handler(func):
                 logger.error(f"Failed to send error message: {msg_error}")
     return wrapper
 
-# Function to keep bot active by sending messages to admin
+# Self-ping the Flask endpoint so the instance is not idled by the platform
 def keep_bot_alive():
+    url = os.getenv("RENDER_EXTERNAL_URL") or f"http://127.0.0.1:{os.environ.get('PORT', 8080)}/"
     try:
-        if not isinstance(ADMIN_CHAT_ID, int):
-            raise ValueError("ADMIN_CHAT_ID is not a valid integer.")
-
-        bot.send_message(ADMIN_CHAT_ID, "🚀 Bot is active and running!")
-        logger.info("✅ Sent keep-alive message to admin")
+        response = requests.get(url, timeout=10)
+        response.raise_for_status()
+        logger.info(f"✅ Keep-alive ping OK ({response.status_code})")
     except Exception as e:
-        logger.error(f"❌ Failed to send keep-alive message: {e}")
+        logger.error(f"❌ Keep-alive ping failed: {e}")
+
+def write_transactions(batch):
+    storage.put_transactions(batch)
+    for (user_key, transaction_id), _ in batch:
+        logger.info(f"Transaction logged: transactions/{user_key}/{transaction_id}")
 
-# Schedule keep-alive messages every 20 minutes
-schedule.every(20).minutes.do(keep_bot_alive)
+# Transaction logs are written in the background, in batches, so handlers never wait on storage.
+# Batches that still fail after the retries are kept on local disk and replayed on the next start.
+transaction_writes = WriteBehindQueue("transaction", write_batch=write_transactions,
+                                      dead_letter_path=os.getenv("TRANSACTION_DEAD_LETTER_PATH", "transaction_dead_letters.jsonl"))
 
-# Run scheduled tasks in a separate thread
-def run_scheduler():
-    while True:
-        schedule.run_pending()
-        time.sleep(10)
+# Volume, revenue and turnaround aggregates, updated on every logged step change
+stats = StatsAggregator()
+STATS_PATH = 'stats/aggregates'
 
-# Start scheduler in the background
-scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-scheduler_thread.start()
-logger.info("✅ Keep-alive mechanism activated. Bot will send messages every 20 minutes.")
+def log_transaction(user_id, session):
+    """Queues transaction details for writing to storage."""
+    record = session.to_dict()
+    stats.observe(record)
+    transaction_writes.submit((str(user_id), session.transaction_id), record)
 
-def log_transaction(telegram_username, transaction_data):
-    """Logs transaction details to Firebase."""
+def save_stats(deadline=None):
+    storage.set_document(STATS_PATH, stats.to_dict())
+
+def load_stats():
     try:
-        transaction_ref = db.reference(f'transactions/{telegram_username}/{transaction_data["transaction_id"]}')
-        transaction_ref.set(transaction_data)
-        logger.info(f"Transaction logged for user {telegram_username}")
+        stats.load(storage.get_document(STATS_PATH))
     except Exception as e:
-        logger.error(f"Failed to log transaction: {e}")
+        logger.error(f"Failed to load stats: {e}")
+
+@app.route('/stats')
+def stats_endpoint():
+    # Disabled unless a token is configured
+    token = os.getenv("STATS_API_TOKEN")
+    if not token:
+        abort(404)
+    if request.headers.get("X-Stats-Token") != token:
+        abort(403)
+    return jsonify({**stats.summary(), "api_calls": api_calls.summary(), "messages": message_tracker.summary()})
 
 def generate_transaction_id():
     """Generates a unique transaction ID."""
     return datetime.datetime.now().strftime("%Y%m%d%H%M%S%f")
 
-def logout_user(telegram_username):
+def transaction_at(user_id, step, action=None):
+    """Filter helper: True when the user's transaction is at `step`."""
+    session = transactions.peek(user_id)
+    return session is not None and session.step == step and (action is None or session.action == action)
+
+def callback_user_id(data):
+    """Extracts the trailing user id from callback data such as `approve_<id>`."""
+    return int(data.rsplit("_", 1)[1])
+
+def logout_user(user_id):
     """Logs out a user by clearing their transaction data."""
-    if telegram_username in transactions:
-        del transactions[telegram_username]
+    session = transactions.pop(user_id, None)
+    if session is not None:
+        api_calls.finish(session.transaction_id, "abandoned")
         try:
-            bot.send_message(telegram_username, "🔒 You have been logged out due to inactivity. Please /login to start a new transaction.")
+            bot.send_message(user_id, "🔒 You have been logged out due to inactivity. Please /login to start a new transaction.")
         except Exception as e:
             logger.error(f"Failed to send logout message: {e}")
 
-def start_countdown_timer(telegram_username):
-    """Starts a countdown timer for the transaction."""
+def timer_text(remaining):
+    # Rounded up to the update interval, so the text (and the message) only changes once per interval
+    remaining = -(-remaining // TIMER_UPDATE_INTERVAL) * TIMER_UPDATE_INTERVAL
+    minutes, seconds = divmod(remaining, 60)
+    return f"⏳ Time remaining: {minutes:02d}:{seconds:02d}"
+
+def start_countdown_timer(user_id, remaining=None):
+    """Starts a countdown timer for the transaction (optionally resuming with `remaining` seconds)."""
     with transaction_lock:
-        if telegram_username not in transactions:
-            transactions[telegram_username] = {}  # Ensure the user dictionary exists
-        
-        # Generate a new transaction ID if none exists
-        if "transaction_id" not in transactions[telegram_username]:
-            transactions[telegram_username]["transaction_id"] = generate_transaction_id()
-            
-        transaction_id = transactions[telegram_username]["transaction_id"]
-        transactions[telegram_username]["timer"] = TRANSACTION_TIMEOUT
-
-        # Ensure "timer_message_id" exists
-        if "timer_message_id" not in transactions[telegram_username]:
-            try:
-                msg = bot.send_message(telegram_username, "⏳ Time remaining: 15:00")
-                transactions[telegram_username]["timer_message_id"] = msg.message_id
-            except Exception as e:
-                logger.error(f"Failed to send timer message: {e}")
+        session = transactions.peek(user_id)
+        if session is None:
+            # Ensure the user session exists
+            session = TransactionSession(user_id, generate_transaction_id())
+            transactions[user_id] = session
+
+        transaction_id = session.transaction_id
+        session.timer = config.current.transaction_timeout if remaining is None else remaining
+
+        # Each transaction gets one timer message; a resumed timer keeps editing the existing one
+        if session.timer_message_id is not None:
+            message_tracker.remember(user_id, session.timer_message_id, slot="timer")
+        try:
+            session.timer_message_id = message_tracker.show(
+                user_id, timer_text(session.timer), slot="timer", new=session.timer_message_id is None
+            )
+        except Exception as e:
+            logger.error(f"Failed to send timer message: {e}")
 
     def countdown():
+        bind_log_context(user_id=user_id, transaction_id=transaction_id)
         while True:
             with transaction_lock:
+                # Read with peek() so the ticking timer doesn't count as user activity
+                session = transactions.peek(user_id)
                 if (
-                    telegram_username not in transactions or 
-                    transactions[telegram_username].get("transaction_id") != transaction_id or 
-                    transactions[telegram_username].get("timer", 0) <= 0
+                    session is None or 
+                    session.transaction_id != transaction_id or 
+                    session.timer <= 0
                 ):
                     break  # Stop countdown if user transaction no longer exists
 
-                minutes, seconds = divmod(transactions[telegram_username]["timer"], 60)
-
                 try:
-                    bot.edit_message_text(
-                        f"⏳ Time remaining: {minutes:02d}:{seconds:02d}",
-                        chat_id=telegram_username,
-                        message_id=transactions[telegram_username]["timer_message_id"]
-                    )
+                    # Unchanged text makes no API call
+                    session.timer_message_id = message_tracker.show(user_id, timer_text(session.timer), slot="timer")
                 except Exception as e:
                     logger.error(f"Error editing timer message: {e}")
                     break  # Stop the timer if message can't be edited
 
-                transactions[telegram_username]["timer"] -= 1
+                session.timer -= 1
 
             time.sleep(1)
 
         with transaction_lock:
-            if telegram_username in transactions and transactions[telegram_username].get("transaction_id") == transaction_id:
+            session = transactions.peek(user_id)
+            if session is not None and session.transaction_id == transaction_id:
                 try:
-                    bot.send_message(telegram_username, "⏱️ Transaction timed out!")
-                    logout_user(telegram_username)
+                    bot.send_message(user_id, "⏱️ Transaction timed out!")
+                    logout_user(user_id)
                 except Exception as e:
                     logger.error(f"Failed to send timeout message: {e}")
 
     timer_thread = threading.Thread(target=countdown, daemon=True)
     timer_thread.start()
 
-# Email validation function
-def is_valid_email(email):
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
+# Active sessions are snapshotted on shutdown and restored by the next instance
+SESSION_SNAPSHOT_PATH = 'runtime/session_snapshot'
 
-# Name validation function
-def is_valid_name(name):
-    if len(name.split()) < 2:
-        return False
-    if len(name) < 3 or len(name) > 100:
-        return False
-    return True
+def snapshot_sessions(deadline=None):
+    snapshot = {
+        "taken_at": time.time(),
+        "transactions": [session.to_dict() for _, session in transactions.items()],
+        "registrations": [session.to_dict() for _, session in user_registration.items()],
+        # Handled updates Telegram will redeliver, since the ack stops at the first rejected one
+        "handled_update_ids": lifecycle.handled_after_ack(),
+    }
+    storage.set_document(SESSION_SNAPSHOT_PATH, snapshot)
+    logger.info(f"💾 Snapshotted {len(snapshot['transactions'])} transactions and {len(snapshot['registrations'])} registrations")
 
-# Account number validation function (10 digits for Nigerian banks)
-def is_valid_account_number(account_number):
-    return account_number.isdigit() and len(account_number) == 10
+def restore_sessions():
+    try:
+        snapshot = storage.get_document(SESSION_SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error(f"Failed to load session snapshot: {e}")
+        return
+    if not snapshot:
+        return
 
-# Wallet address validation function (basic check)
-def is_valid_wallet_address(wallet_address, network):
-    if not wallet_address:
-        return False
+    try:
+        rebuild_sessions(snapshot)
+    except Exception as e:
+        # Keep the snapshot, so the next start can try again; the next drain overwrites it
+        logger.error(f"Failed to restore session snapshot: {e}")
+        logger.error(traceback.format_exc())
+        return
 
-    # TRC20 (TRON) addresses typically start with T and are 34 characters long
-    if network == "TRC20" and wallet_address[0] == "T" and len(wallet_address) == 34:
-        return True
+    # Only now is the snapshot safe to drop
+    try:
+        storage.delete_document(SESSION_SNAPSHOT_PATH)
+    except Exception as e:
+        logger.error(f"Failed to delete session snapshot: {e}")
+
+def rebuild_sessions(snapshot):
+    """Loads the sessions from a snapshot document, resuming their timers."""
+    downtime = int(time.time() - snapshot.get("taken_at", time.time()))
+    lifecycle.skip_handled(snapshot.get("handled_update_ids") or [])
+
+    for data in snapshot.get("registrations") or []:
+        session = RegistrationSession.from_dict(data)
+        user_registration[session.user_id] = session
+
+    resumed = 0
+    for data in snapshot.get("transactions") or []:
+        session = TransactionSession.from_dict(data)
+        if session.timer <= 0:
+            transactions[session.user_id] = session
+            continue
+
+        # Timers keep running while the bot is down
+        remaining = session.timer - downtime
+        if remaining <= 0:
+            try:
+                bot.send_message(session.user_id, "⏱️ Transaction timed out!")
+            except Exception as e:
+                logger.error(f"Failed to send timeout message: {e}")
+            continue
+
+        transactions[session.user_id] = session
+        start_countdown_timer(session.user_id, remaining)
+        resumed += 1
+
+    logger.info(f"♻️ Restored {len(transactions)} transactions ({resumed} timers resumed) and {len(user_registration)} registrations")
+
+# Market prices aggregated from several sources, refreshed in the background by the scheduler
+RATE_CACHE_TTL = 2 * 60  # seconds
+pricing = PricingEngine(
+    default_sources(
+        [name.strip() for name in os.getenv("PRICE_SOURCES", "coingecko,cryptocompare,coinbase").split(",") if name.strip()],
+        timeout=float(os.getenv("PRICE_SOURCE_TIMEOUT", "4"))
+    ),
+    quorum=int(os.getenv("PRICE_QUORUM", "2")),
+    method=os.getenv("PRICE_AGGREGATION", "median"),
+    max_deviation=float(os.getenv("PRICE_MAX_DEVIATION", "0.05")),
+    max_age=RATE_CACHE_TTL
+)
 
-    # BEP20 and ERC20 (Ethereum-based) addresses are 42 characters and start with 0x
-    if (network in ["BEP20", "ERC20"]) and wallet_address.startswith("0x") and len(wallet_address) == 42:
-        return True
+def refresh_prices():
+    """Refreshes every pair; keeps the previous prices if no source answers."""
+    return pricing.refresh()
+
+def get_base_rate(asset="USDT"):
+    """Returns the aggregated market rate while fresh, refreshing on a cache miss."""
+    rate = pricing.rate(asset)
+    if rate is None:
+        refresh_prices()
+        rate = pricing.rate(asset)
+    return rate
+
+# Get the aggregated market rate and add the configured markup
+def get_exchange_rate(action="buy", asset="USDT"):
+    settings = config.current
+    market_rate = get_base_rate(asset)
+    markups = settings.pair_markups.get(asset)
+
+    if market_rate is None or markups is None or action not in markups:
+        if asset != "USDT":
+            return None
+        logger.warning("⚠️ No valid exchange rate available. Using fallback rate.")
+        return settings.fallback_rate
+
+    return market_rate + markups[action]
+
+# Quotes lock the rate at amount entry for the life of the transaction
+quote_engine = QuoteEngine(
+    rate_provider=get_base_rate,
+    markups=config.current.pair_markups["USDT"],
+    fallback_rate=config.current.fallback_rate,
+    ttl=config.current.transaction_timeout,
+    secret=os.getenv("QUOTE_SIGNING_KEY") or f"quote:{BOT_TOKEN}",
+    network_markups=config.current.network_markups
+)
 
-    return False
+def apply_config(settings):
+    """Pushes a new config snapshot into the components that cache values from it."""
+    quote_engine.configure(settings.pair_markups["USDT"], settings.fallback_rate, settings.transaction_timeout, settings.network_markups)
+    transactions.ttl = 2 * settings.transaction_timeout
 
-# Get exchange rate from CoinGecko and add markup
-def get_exchange_rate(action="buy") -> float:
-    url = "https://api.coingecko.com/api/v3/simple/price?ids=tether&vs_currencies=ngn"
-    try:
-        response = requests.get(url, timeout=30)
-        data = response.json()
+config.subscribe(apply_config)
 
-        # Get exchange rate safely
-        coingecko_rate = data.get("tether", {}).get("ngn")
+def quote_summary(quote):
+    if quote is None:
+        return "🧾 Quote: none"
+    return f"🧾 Quote {quote.quote_id}: ₦{quote.rate}/USDT ({quote.source})"
 
-        if coingecko_rate is None:
-            logger.warning("⚠️ API response did not return a valid exchange rate. Using fallback rate.")
-            return 1400.0  # Fallback rate
+def requote_keyboard(user_id):
+    keyboard = InlineKeyboardMarkup()
+    keyboard.row(InlineKeyboardButton("🔁 Re-quote", callback_data=f"requote_{user_id}"))
+    return keyboard
 
-        # Apply markup for buying and selling
-        if action == "buy":
-            return float(coingecko_rate) + 30  # Buying price
-        elif action == "sell":
-            return float(coingecko_rate) - 8  # Selling price
-        else:
-            logger.warning("⚠️ Invalid action passed to get_exchange_rate(). Using fallback rate.")
-            return 1400.0
-    except Exception as e:
-        logger.error(f"⚠️ API Request Failed: {e}. Using fallback rate.")
-        return 1400.0  # Fallback rate
+def verify_session_quote(user_id, session):
+    """Checks a stored quote before settlement: a bad signature or an expired quote blocks settlement.
+
+    Returns False if the trade must not settle at the quoted rate; the admin
+    is offered a Re-quote button that prices the trade afresh.
+    """
+    quote = session.quote
+    if quote is None:
+        return True
+
+    if not quote_engine.verify(quote):
+        logger.error(f"❌ Quote {quote.quote_id} for user {user_id} failed signature verification, settlement refused")
+        if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
+            bot.send_message(ADMIN_CHAT_ID, f"⛔ Quote {quote.quote_id} for user {user_id} failed verification and was not settled. "
+                                           f"Re-quote the trade to price it again.", reply_markup=requote_keyboard(user_id))
+        return False
+
+    if not quote.is_valid():
+        expired_at = datetime.datetime.fromtimestamp(quote.expires_at).strftime("%H:%M:%S")
+        logger.warning(f"⚠️ Quote {quote.quote_id} for user {user_id} expired at {expired_at}, settlement refused")
+        if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
+            bot.send_message(ADMIN_CHAT_ID, f"⛔ Quote {quote.quote_id} for user {user_id} expired at {expired_at}. "
+                                           f"It was not settled at ₦{quote.rate}/USDT. Re-quote the trade to price it at the current rate.",
+                             reply_markup=requote_keyboard(user_id))
+        return False
+    return True
+
+# Expire registrations and transactions that were abandoned mid-flow
+def sweep_stale_sessions():
+    user_registration.sweep()
+    transactions.sweep()
+
+# Move old transaction records out of the hot `transactions/` node
+HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "30"))
+
+def compact_transaction_history():
+    # Transaction IDs are timestamps, so they compare chronologically
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=HISTORY_RETENTION_DAYS)).strftime("%Y%m%d%H%M%S%f")
+    moved = storage.archive_transactions(cutoff)
+
+    logger.info(f"🗄️ Archived {moved} transactions older than {HISTORY_RETENTION_DAYS} days")
+
+# Health checks behind /healthz (liveness) and /readyz (readiness)
+HEALTH_POLL_MAX_AGE = int(os.getenv("HEALTH_POLL_MAX_AGE", "120"))  # a long poll returns every 30s
+HEALTH_SCHEDULER_MAX_AGE = int(os.getenv("HEALTH_SCHEDULER_MAX_AGE", "180"))
+HEALTH_STORAGE_INTERVAL = 30
+HEALTH_RATE_MAX_AGE = int(os.getenv("HEALTH_RATE_MAX_AGE", "900"))
+HEALTH_MAX_QUEUED_UPDATES = int(os.getenv("HEALTH_MAX_QUEUED_UPDATES", "50"))
+
+def check_polling():
+    # Before the first poll completes, measure from startup
+    last_poll_age = age(health.last_poll or health.started_at)
+    return last_poll_age <= HEALTH_POLL_MAX_AGE, {
+        "last_poll_age": last_poll_age,
+        "consecutive_failures": health.poll_failures,
+        "last_error": health.last_poll_error,
+    }
+
+def check_last_update():
+    # A quiet bot is not an unhealthy one, so this is informational only
+    return True, {"last_update_age": age(health.last_update), "updates": health.updates}
+
+def check_scheduler():
+    heartbeat_age = age(scheduler.heartbeat)
+    alive = scheduler.is_alive() and heartbeat_age is not None and heartbeat_age <= HEALTH_SCHEDULER_MAX_AGE
+    return alive, {"thread_alive": scheduler.is_alive(), "heartbeat_age": heartbeat_age}
+
+def probe_storage():
+    storage.ping()
+    return {"backend": storage.name}
+
+def check_rate():
+    rate_age = age(pricing.fetched_at)
+    return rate_age is not None and rate_age <= HEALTH_RATE_MAX_AGE, {"rate_age": rate_age, "source_errors": dict(pricing.source_errors)}
+
+def check_worker_pool():
+    worker_pool = getattr(bot, "worker_pool", None)
+    if worker_pool is None:
+        return True, {"threaded": False}
+    queued = worker_pool.tasks.qsize()
+    return queued <= HEALTH_MAX_QUEUED_UPDATES, {"queued": queued, "workers": worker_pool.num_threads}
+
+def check_lifecycle():
+    return lifecycle.accepting(), {"state": lifecycle.state, "in_flight": lifecycle.in_flight}
+
+health.add_check("polling", check_polling, LIVENESS)
+health.add_check("scheduler", check_scheduler, LIVENESS)
+health.add_check("storage", health.probe_check("storage", max_age=3 * HEALTH_STORAGE_INTERVAL), READINESS)
+health.add_check("rate", check_rate, READINESS)
+health.add_check("worker_pool", check_worker_pool, READINESS)
+health.add_check("lifecycle", check_lifecycle, READINESS)
+health.add_check("last_update", check_last_update, INFO)
+
+@app.route('/healthz')
+def healthz():
+    ok, report = health.report(LIVENESS)
+    return jsonify(report), 200 if ok else 503
+
+@app.route('/readyz')
+def readyz():
+    ok, report = health.report(READINESS)
+    return jsonify(report), 200 if ok else 503
+
+# Background jobs
+scheduler = Scheduler(state_path=os.getenv("SCHEDULER_STATE_PATH", "scheduler_state.json"))
+scheduler.every("keep_alive", 10 * 60, keep_bot_alive, jitter=30)
+scheduler.every("price_refresh", RATE_CACHE_TTL // 2, refresh_prices, jitter=5, run_immediately=True)
+scheduler.every("stale_session_sweep", 60, sweep_stale_sessions, jitter=5)
+scheduler.cron("history_compaction", "30 3 * * *", compact_transaction_history, jitter=10 * 60)
+scheduler.every("stats_persist", 5 * 60, save_stats, jitter=15)
+scheduler.every("config_reload", 60, lambda: config.reload("poll"), jitter=5)
+scheduler.every("storage_probe", HEALTH_STORAGE_INTERVAL, lambda: health.run_probe("storage", probe_storage), run_immediately=True)
 
 @bot.message_handler(commands=['start'])
 @error_handler
@@ -358,53 +652,57 @@ def handle_welcome_button(message):
 @bot.message_handler(commands=['register'])
 @error_handler
 def register_user_step1(message):
-    user_id = str(message.from_user.id)
+    user_id = message.from_user.id
     telegram_username = message.from_user.username
 
     if not telegram_username:  
         bot.reply_to(message, "❌ You need a Telegram username to register. Please go to your Telegram >> Profile and set a User Name.")
         return
 
-    user_ref = db.reference(f'Members/{telegram_username}')
-    user_data = user_ref.get()
+    user_data = storage.get_member(telegram_username)
 
     if user_data:
         bot.reply_to(message, "⚠️ You are already registered! Use /login to access your account.")
         return
 
     bot.reply_to(message, "📝 Please enter your first Name and Last name:")
-    user_registration[telegram_username] = {"step": 1, "user_id": user_id}
+    user_registration[user_id] = RegistrationSession(user_id, telegram_username)
+
+def registration_at(user_id, step):
+    """Filter helper: True when the user's registration is at `step`."""
+    session = user_registration.peek(user_id)
+    return session is not None and session.step == step
 
-@bot.message_handler(func=lambda message: message.from_user.username in user_registration and user_registration[message.from_user.username]["step"] == 1)
+@bot.message_handler(func=lambda message: registration_at(message.from_user.id, 1))
 @error_handler
 def register_user_step2(message):
-    telegram_username = message.from_user.username
+    session = user_registration[message.from_user.id]
     full_name = message.text.strip()
 
     if not is_valid_name(full_name):
         bot.reply_to(message, "❌ Invalid name format. Please enter your full name.")
         return
 
-    user_registration[telegram_username]["full_name"] = full_name
-    user_registration[telegram_username]["step"] = 2
+    session.full_name = full_name
+    session.step = 2
     bot.reply_to(message, "📧 Please enter your email address:")
 
-@bot.message_handler(func=lambda message: message.from_user.username in user_registration and user_registration[message.from_user.username]["step"] == 2)
+@bot.message_handler(func=lambda message: registration_at(message.from_user.id, 2))
 @error_handler
 def register_user_step3(message):
-    telegram_username = message.from_user.username
+    session = user_registration[message.from_user.id]
     email = message.text.strip()
 
     if not is_valid_email(email):
         bot.reply_to(message, "❌ Invalid email format. Please enter a valid email address.")
         return
 
-    user_registration[telegram_username]["email"] = email
-    user_registration[telegram_username]["step"] = 3
+    session.email = email
+    session.step = 3
 
     registration_details = f"👤 *Registration Details:*\n\n" \
-                           f"📝 Full Name: {user_registration[telegram_username]['full_name']}\n" \
-                           f"📧 Email: {user_registration[telegram_username]['email']}\n"
+                           f"📝 Full Name: {session.full_name}\n" \
+                           f"📧 Email: {session.email}\n"
 
     keyboard = InlineKeyboardMarkup()
     keyboard.row(
@@ -416,24 +714,26 @@ def register_user_step3(message):
 
 @bot.callback_query_handler(func=lambda call: call.data in ["confirm_registration", "cancel_registration"])
 def handle_registration_confirmation(call):
-    telegram_username = call.from_user.username
+    user_id = call.from_user.id
+    session = user_registration.get(user_id)
 
-    if telegram_username not in user_registration:
+    if session is None:
         bot.answer_callback_query(call.id, "Registration session expired. Please start again.")
         return
 
+    telegram_username = session.username
+
     if call.data == "confirm_registration":
         user_data = {
             "username": telegram_username,
-            "user_id": user_registration[telegram_username]["user_id"],
-            "full_name": user_registration[telegram_username]["full_name"],
-            "email": user_registration[telegram_username]["email"],
+            "user_id": str(user_id),
+            "full_name": session.full_name,
+            "email": session.email,
             "registration_date": datetime.datetime.now().isoformat(),
             "registered": True
         }
 
-        user_ref = db.reference(f'Members/{telegram_username}')
-        user_ref.set(user_data)
+        storage.put_member(telegram_username, user_data)
 
         bot.send_message(call.message.chat.id, f"✅ Registration successful, {user_data['full_name']}!\n\n"
                                                f" welcome {user_data['email']}.\n"
@@ -448,8 +748,7 @@ def handle_registration_confirmation(call):
         bot.send_message(call.message.chat.id, "❌ Registration cancelled. Use /register to start again when you're ready.")
 
     # Clear registration data
-    if telegram_username in user_registration:
-        del user_registration[telegram_username]
+    user_registration.pop(user_id, None)
 
     bot.answer_callback_query(call.id)
 
@@ -462,16 +761,19 @@ def login_user(message):
         bot.reply_to(message, "❌ You need a Telegram username to register. Please go to your Telegram >> Profile and set a User Name.")
         return
 
-    user_ref = db.reference(f'Members/{telegram_username}')
-    user_data = user_ref.get()
+    user_data = storage.get_member(telegram_username)
 
     # Ensure `user_data` is a dictionary
     if not isinstance(user_data, dict):  
-        bot.reply_to(message, "⚠️ Error retrieving your account. \n\n Please Register to use this service or \n contact support rehobotics.technologies@gmail.com \n  or on Telegram @CryptoNairaExchangeSupport \n if your are already registered and having issues \n accessing the service. /register ")
+        bot.reply_to(message, f"⚠️ Error retrieving your account. \n\n Please Register to use this service or \n contact support {config.current.support_email} \n  or on Telegram @CryptoNairaExchangeSupport \n if your are already registered and having issues \n accessing the service. /register ")
         return
 
     full_name = user_data.get("full_name", "Unknown")
 
+    # Logging in again means the user can be reached, so include them in broadcasts again
+    if user_data.get("active") is False:
+        storage.update_member(telegram_username, {"active": True, "inactive_reason": None})
+
     warning_text = ( "⚠️ *SCAM ALERT!* ⚠️\n\n"
                      "🚨 *No transaction outside this bot is permitted or authorized.*\n"
                      "🚫 *Admin will NEVER call or message you for transactions outside this bot.*\n"
@@ -484,104 +786,350 @@ def login_user(message):
     show_buy_sell_buttons(message.chat.id)
 
 # Display buy/sell buttons
-def show_buy_sell_buttons(user_id):
+def show_buy_sell_buttons(user_id, text="What would you like to do?"):
+    keyboard = InlineKeyboardMarkup()
+    buy_button = InlineKeyboardButton("💰 Buy USDT", callback_data="buy_usdt")
+    sell_button = InlineKeyboardButton("💵 Sell USDT", callback_data="sell_usdt")
+    keyboard.row(buy_button, sell_button)
+    message_tracker.show(user_id, text, reply_markup=keyboard, new=True)
+
+# Offered once a trade completes, in place of the confirmation prompt
+def new_transaction_keyboard():
     keyboard = InlineKeyboardMarkup()
     buy_button = InlineKeyboardButton("💰 Buy USDT", callback_data="buy_usdt")
     sell_button = InlineKeyboardButton("💵 Sell USDT", callback_data="sell_usdt")
+    exit_button = InlineKeyboardButton("🚪 Exit", callback_data="exit")
     keyboard.row(buy_button, sell_button)
-    bot.send_message(user_id, "What would you like to do?", reply_markup=keyboard)
+    keyboard.row(exit_button)
+    return keyboard
 
 # Rate command handler
 @bot.message_handler(commands=['rate'])
 @error_handler
 def rate_command(message):
-    buy_rate = get_exchange_rate("buy")
-    sell_rate = get_exchange_rate("sell")
-    bot.send_message(message.chat.id, 
-                    f"Current Exchange Rates:\n\n"
-                    f"Buy: 1 USDT = ₦{buy_rate}\n"
-                    f"Sell: 1 USDT = ₦{sell_rate}")
+    lines = ["Current Exchange Rates:"]
+    for asset in config.current.pair_markups:
+        buy_rate = get_exchange_rate("buy", asset)
+        sell_rate = get_exchange_rate("sell", asset)
+        if buy_rate is None or sell_rate is None:
+            continue
+        lines += ["", f"Buy: 1 {asset} = ₦{buy_rate:,.2f}", f"Sell: 1 {asset} = ₦{sell_rate:,.2f}"]
+    bot.send_message(message.chat.id, "\n".join(lines))
+
+def format_naira(value):
+    return f"₦{value:,.2f}"
+
+def format_duration(seconds):
+    if seconds is None:
+        return "n/a"
+    if seconds == float("inf"):
+        return "> 24h"
+    return f"≤ {int(seconds // 60)}m {int(seconds % 60)}s" if seconds >= 60 else f"≤ {int(seconds)}s"
+
+# Admin-only trading statistics
+@bot.message_handler(commands=['stats'])
+@error_handler
+def stats_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    summary = stats.summary()
+    lines = ["📊 *Trading statistics*", ""]
+    for label, key in (("Today", "today"), ("Last 7 days", "last_7_days"), ("All time", "all_time")):
+        period = summary[key]
+        lines.append(f"*{label}* ({period['trades']} trades)")
+        lines.append(f"  Buy: {period['buy_usdt']:,.2f} USDT / {format_naira(period['buy_naira'])}")
+        lines.append(f"  Sell: {period['sell_usdt']:,.2f} USDT / {format_naira(period['sell_naira'])}")
+        lines.append(f"  Markup revenue: {format_naira(period['markup_revenue'])}")
+
+    networks = ", ".join(f"{name}: {count}" for name, count in sorted(summary["networks"].items())) or "none"
+    lines += ["", f"🔹 Networks: {networks}", "", "⏱️ Receipt → approval"]
+    for action, turnaround in summary["turnaround_seconds"].items():
+        lines.append(f"  {action}: p50 {format_duration(turnaround['p50'])}, p95 {format_duration(turnaround['p95'])} ({turnaround['samples']} samples)")
+
+    per_trade = api_calls.summary()["calls_per_completed_trade"]
+    if per_trade["samples"]:
+        lines += ["", f"📨 API calls per completed trade: mean {per_trade['mean']}, p95 {per_trade['p95']} ({per_trade['samples']} trades since restart)"]
+
+    bot.send_message(message.chat.id, "\n".join(lines), parse_mode="Markdown")
+
+# Admin-only audit of stored transaction history
+@bot.message_handler(commands=['audit'])
+@error_handler
+def audit_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    records = (
+        (f"{user_key}/{transaction_id}", record)
+        for user_key, transaction_id, record in storage.iter_transactions()
+    )
+    report = validate_batch(records)
+
+    if not report:
+        bot.send_message(message.chat.id, "✅ Audit complete: no invalid wallet addresses or bank details found.")
+        return
+
+    lines = [f"{key}: {', '.join(problems)}" for key, problems in list(report.items())[:30]]
+    more = f"\n...and {len(report) - 30} more" if len(report) > 30 else ""
+    bot.send_message(message.chat.id, f"⚠️ Audit found {len(report)} records with problems:\n\n" + "\n".join(lines) + more)
+
+# Admin broadcasts, streamed over `Members/` a page at a time
+BROADCAST_PATH = 'broadcasts'
+ACTIVE_BROADCAST_PATH = 'runtime/active_broadcast'
+
+def fetch_member_page(start_after, limit):
+    return storage.member_page(start_after, limit)
+
+def save_broadcast_checkpoint(state):
+    storage.set_document(f"{BROADCAST_PATH}/{state['broadcast_id']}", state)
+    if state["status"] in ("running", "paused"):
+        storage.set_document(ACTIVE_BROADCAST_PATH, state["broadcast_id"])
+    else:
+        storage.delete_document(ACTIVE_BROADCAST_PATH)
+
+def load_broadcast_checkpoint(broadcast_id):
+    return storage.get_document(f"{BROADCAST_PATH}/{broadcast_id}")
+
+def mark_member_inactive(member_key, reason):
+    storage.update_member(member_key, {"active": False, "inactive_reason": reason})
+
+broadcaster = Broadcaster(
+    send=lambda chat_id, text: bot.send_message(chat_id, text),
+    fetch_page=fetch_member_page,
+    save_checkpoint=save_broadcast_checkpoint,
+    load_checkpoint=load_broadcast_checkpoint,
+    mark_inactive=mark_member_inactive,
+    rate=float(os.getenv("BROADCAST_RATE", "20")),
+    workers=int(os.getenv("BROADCAST_WORKERS", "8")),
+)
+
+def resume_interrupted_broadcast():
+    """Picks up a broadcast that was running when the previous instance stopped."""
+    try:
+        broadcast_id = storage.get_document(ACTIVE_BROADCAST_PATH)
+        if broadcast_id:
+            state = broadcaster.resume(broadcast_id)
+            logger.info(f"📣 Resumed broadcast {broadcast_id} after {state['last_key']}")
+    except Exception as e:
+        logger.error(f"Failed to resume broadcast: {e}")
+
+def format_broadcast(state):
+    return (f"📣 Broadcast {state['broadcast_id']}: {state['status']}\n"
+            f"Sent: {state['sent']}, failed: {state['failed']}, "
+            f"inactive: {state['inactive']}, skipped: {state['skipped']}\n"
+            f"Last member: {state.get('last_key') or '-'}")
+
+# Admin-only broadcast commands
+@bot.message_handler(commands=['broadcast'])
+@error_handler
+def broadcast_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    text = message.text.partition(" ")[2].strip()
+    if not text:
+        bot.send_message(message.chat.id, "Usage: /broadcast <message>")
+        return
+    try:
+        broadcast_id = broadcaster.start(text, created_by=message.chat.id)
+    except RuntimeError as e:
+        bot.send_message(message.chat.id, f"❌ {e}. Use /broadcast_status to follow it or /broadcast_stop to stop it.")
+        return
+    bot.send_message(message.chat.id, f"📣 Broadcast {broadcast_id} started. Use /broadcast_status to follow progress.")
+
+@bot.message_handler(commands=['broadcast_resume'])
+@error_handler
+def broadcast_resume_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    broadcast_id = message.text.partition(" ")[2].strip() or storage.get_document(ACTIVE_BROADCAST_PATH)
+    if not broadcast_id:
+        bot.send_message(message.chat.id, "Usage: /broadcast_resume <broadcast id>")
+        return
+    try:
+        state = broadcaster.resume(broadcast_id)
+    except KeyError:
+        bot.send_message(message.chat.id, f"❌ No broadcast found with id {broadcast_id}.")
+        return
+    except (RuntimeError, ValueError) as e:
+        bot.send_message(message.chat.id, f"❌ {e}.")
+        return
+    bot.send_message(message.chat.id, f"📣 Broadcast {broadcast_id} resumed after {state['last_key'] or 'the start'}.")
+
+@bot.message_handler(commands=['broadcast_stop'])
+@error_handler
+def broadcast_stop_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    if not broadcaster.is_running():
+        bot.send_message(message.chat.id, "No broadcast is running.")
+        return
+    broadcaster.stop(timeout=30)
+    bot.send_message(message.chat.id, format_broadcast(broadcaster.state))
+
+@bot.message_handler(commands=['broadcast_status'])
+@error_handler
+def broadcast_status_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    broadcast_id = message.text.partition(" ")[2].strip()
+    if broadcast_id:
+        state = load_broadcast_checkpoint(broadcast_id)
+    else:
+        state = broadcaster.state
+    if not state:
+        bot.send_message(message.chat.id, "No broadcast found.")
+        return
+    bot.send_message(message.chat.id, format_broadcast(state))
+
+# Admin-only runtime configuration
+@bot.message_handler(commands=['config'])
+@error_handler
+def config_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    settings = config.current
+    updated_at = datetime.datetime.fromtimestamp(settings.updated_at).isoformat(timespec="seconds") if settings.updated_at else "-"
+    lines = [f"⚙️ Config v{settings.version} (by {settings.updated_by}, {updated_at})", ""]
+    lines += [f"{key}: {json.dumps(value)}" for key, value in settings.values().items()]
+    hidden = [network for network in settings.usdt_networks if network not in settings.enabled_networks]
+    if hidden:
+        lines += ["", f"⚠️ Not offered to users (no company wallet): {', '.join(hidden)}"]
+    lines += ["", "Change with /setconfig <key> <value>, e.g.", "/setconfig network_markups.ERC20 5", "/setconfig company_wallets.ERC20 0x..."]
+    bot.send_message(message.chat.id, "\n".join(lines))
+
+@bot.message_handler(commands=['setconfig'])
+@error_handler
+def setconfig_command(message):
+    if message.chat.id != ADMIN_CHAT_ID:
+        return
+
+    parts = message.text.split(maxsplit=2)
+    if len(parts) < 3:
+        bot.send_message(message.chat.id, "Usage: /setconfig <key> <value>")
+        return
+    try:
+        version = config.set(parts[1], parts[2], actor=f"admin:{message.from_user.id}")
+    except (ConfigError, ValueError) as e:
+        bot.send_message(message.chat.id, f"❌ Rejected: {e}")
+        return
+
+    if version is None:
+        bot.send_message(message.chat.id, "No change: the value is already set.")
+    else:
+        bot.send_message(message.chat.id, f"✅ Config v{version} applied.")
+
+# Velocity and fraud checks run before state transitions
+risk = RiskEngine.from_env()
+
+def alert_risk(user_id, decision):
+    """Flags a suspicious trade to the admin (at most once per key per window)."""
+    logger.warning(f"⚠️ Risk check for user {user_id}: {decision.reason}")
+    if decision.alert and ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
+        action = "Blocked" if not decision.allowed else "Flagged"
+        bot.send_message(ADMIN_CHAT_ID, f"🚨 {action} user {user_id}: {decision.reason}")
 
 # Buy/Sell selection handler
 @bot.callback_query_handler(func=lambda call: call.data in ["buy_usdt", "sell_usdt"])
 def handle_buy_sell(call):
-    telegram_username = str(call.from_user.id)
+    user_id = call.from_user.id
     action = "Buy" if call.data == "buy_usdt" else "Sell"
 
-    # Generate transaction ID
-    transaction_id = generate_transaction_id()
+    decision = risk.check_session_start(user_id)
+    if not decision.allowed:
+        alert_risk(user_id, decision)
+        bot.answer_callback_query(call.id, "⚠️ Too many transactions started. Please wait a few minutes and try again.", show_alert=True)
+        return
+
+    previous = transactions.peek(user_id)
+    if previous is not None:
+        api_calls.finish(previous.transaction_id, "abandoned")
 
     # Initialize transaction tracking for this user
-    transactions[telegram_username] = {
-        "transaction_id": transaction_id,
-        "step": 1, 
-        "action": action,
-        "start_time": datetime.datetime.now().isoformat()
-    }
+    session = TransactionSession(
+        user_id,
+        generate_transaction_id(),
+        action=action,
+        step=Step.ENTER_AMOUNT,
+        start_time=datetime.datetime.now().isoformat()
+    )
+    transactions[user_id] = session
+    # The middleware bound the context before this transaction existed
+    bind_log_context(transaction_id=session.transaction_id, step=int(session.step))
 
     # Log the initialized transaction
-    log_transaction(telegram_username, transactions[telegram_username])
+    log_transaction(user_id, session)
 
     # Acknowledge the callback query
     bot.answer_callback_query(call.id)
 
-    # Send initial timer message and store its message_id
     try:
-        timer_message = bot.send_message(telegram_username, "⏳ Initializing timer...")
-        transactions[telegram_username]["timer_message_id"] = timer_message.message_id
-
-        # Start countdown timer
-        start_countdown_timer(telegram_username)
-
-        # Ask for amount
-        bot.send_message(telegram_username, f"🎉 WOW, That's Awesome \n\n"
-                        f"💰 You chose to {action} USDT.\n\nEnter the amount:")
+        # Ask for the amount in place of the Buy/Sell prompt, then start the countdown (it sends the timer message)
+        message_tracker.replace(call.message, f"🎉 WOW, That's Awesome \n\n"
+                                              f"💰 You chose to {action} USDT.\n\nEnter the amount:")
+        start_countdown_timer(user_id)
     except Exception as e:
         logger.error(f"Error in buy/sell handler: {e}")
 
-@bot.message_handler(func=lambda message: str(message.from_user.id) in transactions and transactions[str(message.from_user.id)].get("step") == 1)
+def is_amount(text):
+    try:
+        float(text)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+# The amount can be revised until the receipt/confirmation, at the same locked quote
+@bot.message_handler(func=lambda message: transaction_at(message.from_user.id, Step.ENTER_AMOUNT) or
+                     (transaction_at(message.from_user.id, Step.AWAITING_PAYMENT) and is_amount(message.text)))
 @error_handler
 def amount_input(message):
-    user_id = str(message.from_user.id)
+    user_id = message.from_user.id
 
     try:
         amount = float(message.text)
-        user_data = transactions.get(user_id, {})
+        session = transactions.get(user_id)
 
-        if not user_data:
+        if session is None:
             bot.send_message(user_id, "❌ Transaction not found. Please restart the process.")
             return
 
-        action = user_data.get("action", "")
+        action = session.action
 
-        # Convert action to lowercase for consistency
-        action_lower = action.lower()
+        # Reuse the locked quote while it is valid; revising the amount doesn't refetch
+        quote = quote_engine.quote_for(action, session.quote)
+        rate = quote.rate
+        naira_amount = quote.naira_for(amount)
 
-        rate = get_exchange_rate(action_lower)
-        naira_amount = amount * rate
-
-        transactions[user_id]["amount"] = amount
-        transactions[user_id]["naira_amount"] = naira_amount
-        transactions[user_id]["step"] = 2
+        session.quote = quote
+        session.amount = amount
+        session.naira_amount = naira_amount
+        session.step = Step.AWAITING_PAYMENT
 
         if action == "Buy":
             keyboard = InlineKeyboardMarkup()
             decline_button = InlineKeyboardButton("❌ Decline / Go to Sell USDT", callback_data="sell_usdt")
             keyboard.row(decline_button)
-            bot.send_message(user_id, f"✅ Exchange Rate: ₦{rate}/USDT\n"
-                                     f"💵 You will pay: ₦{naira_amount:.2f}\n\n"
-                                     f"🔹 Transfer the amount to:\n{ADMIN_ACCOUNT_DETAILS}\n\n"
-                                     f"Make your transfer into the Naira account provided \n"
-                                     f"📎 Then Upload proof of payment after transfer.", reply_markup=keyboard)
+            message_tracker.show(user_id, f"✅ Exchange Rate: ₦{rate}/USDT\n"
+                                          f"💵 You will pay: ₦{naira_amount:.2f}\n\n"
+                                          f"🔹 Transfer the amount to:\n{config.current.admin_account_details}\n\n"
+                                          f"Make your transfer into the Naira account provided \n"
+                                          f"📎 Then Upload proof of payment after transfer.\n\n"
+                                          f"✏️ To change the amount, just send a new one.", reply_markup=keyboard, new=True)
 
         else:  # Selling case
             keyboard = InlineKeyboardMarkup()
             confirm_button = InlineKeyboardButton("✅ Confirm", callback_data="confirm_sell")
             cancel_button = InlineKeyboardButton("❌ Cancel", callback_data="cancel_transaction")
             keyboard.row(confirm_button, cancel_button)
-            bot.send_message(user_id, f"✅ Exchange Rate: ₦{rate}/USDT\n"
-                                     f"💰 You will receive: ₦{naira_amount:.2f}\n\n"
-                                     f"⚠️ Are you sure you want to proceed?", reply_markup=keyboard)
+            message_tracker.show(user_id, f"✅ Exchange Rate: ₦{rate}/USDT\n"
+                                          f"💰 You will receive: ₦{naira_amount:.2f}\n\n"
+                                          f"⚠️ Are you sure you want to proceed?\n\n"
+                                          f"✏️ To change the amount, just send a new one.", reply_markup=keyboard, new=True)
 
     except ValueError:
         bot.reply_to(message, "❌ Invalid amount. Please enter a numeric value.")
@@ -591,17 +1139,26 @@ def amount_input(message):
 @bot.message_handler(content_types=['photo'])
 @error_handler
 def handle_receipt_upload(message):
-    user_id = str(message.from_user.id)
+    user_id = message.from_user.id
+    session = transactions.get(user_id)
 
-    if user_id not in transactions:
+    if session is None:
         return
 
-    user_data = transactions[user_id]
+    awaiting_upload = (session.step == Step.AWAITING_PAYMENT and session.action == "Buy") or \
+                      (session.step == Step.AWAITING_PROOF and session.action == "Sell")
+    if awaiting_upload:
+        decision = risk.check_receipt(user_id)
+        if not decision.allowed:
+            alert_risk(user_id, decision)
+            bot.send_message(user_id, "⚠️ Too many uploads. Please wait a few minutes before uploading again.")
+            return
 
     # Handle Buy USDT receipt upload
-    if user_data.get("step") == 2 and user_data.get("action") == "Buy":
-        transactions[user_id]["step"] = 3
-        transactions[user_id]["receipt"] = message.photo[-1].file_id
+    if session.step == Step.AWAITING_PAYMENT and session.action == "Buy":
+        session.step = Step.RECEIPT_UPLOADED
+        session.receipt = message.photo[-1].file_id
+        log_transaction(user_id, session)
 
         keyboard = InlineKeyboardMarkup()
         approve_button = InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}")
@@ -610,19 +1167,21 @@ def handle_receipt_upload(message):
         keyboard.row(approve_button, reject_button, pending_button)
 
         if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
-            bot.send_photo(ADMIN_CHAT_ID, transactions[user_id]["receipt"], 
+            bot.send_photo(ADMIN_CHAT_ID, session.receipt, 
                           caption=f"📥 Payment proof received from {user_id}.\n to buy USDT"
-                                  f"💵 Amount: ₦{transactions[user_id]['naira_amount']:.2f}\n"
-                                  f"💰 USDT Amount: {transactions[user_id]['amount']}\n"
+                                  f"💵 Amount: ₦{session.naira_amount:.2f}\n"
+                                  f"💰 USDT Amount: {session.amount}\n"
+                                  f"{quote_summary(session.quote)}\n"
                                   f"🔍 Please verify and confirm.", 
                           reply_markup=keyboard)
 
         bot.send_message(user_id, "✅ Receipt uploaded successfully. Awaiting admin confirmation.")
 
     # Handle Sell USDT transaction proof upload
-    elif user_data.get("step") == 8 and user_data.get("action") == "Sell":
-        transactions[user_id]["step"] = 9
-        transactions[user_id]["transaction_proof"] = message.photo[-1].file_id
+    elif session.step == Step.AWAITING_PROOF and session.action == "Sell":
+        session.step = Step.PROOF_UPLOADED
+        session.transaction_proof = message.photo[-1].file_id
+        log_transaction(user_id, session)
 
         keyboard = InlineKeyboardMarkup()
         confirm_button = InlineKeyboardButton("✅ Confirm", callback_data=f"confirm_{user_id}")
@@ -634,32 +1193,38 @@ def handle_receipt_upload(message):
         if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
             bot.send_photo(ADMIN_CHAT_ID, message.photo[-1].file_id,
                           caption=f"📥 USDT transfer proof from user {user_id}\n to sell USDT"
-                                  f"💰 Amount: {transactions[user_id]['amount']} USDT\n"
-                                  f"🔹 Network: {transactions[user_id].get('network', 'Unknown')}\n"
+                                  f"💰 Amount: {session.amount} USDT\n"
+                                  f"🔹 Network: {session.network or 'Unknown'}\n"
+                                  f"{quote_summary(session.quote)}\n"
                                   f"🔍 Please verify and confirm.",
                           reply_markup=keyboard)
 
         bot.send_message(user_id, "✅ Proof received. Awaiting admin confirmation.")
 
 # Admin response handler for receipt verification
-@bot.callback_query_handler(func=lambda call: call.data.startswith(("approve_", "reject_", "pending_")))
+@bot.callback_query_handler(func=lambda call: call.data.startswith(("approve_", "reject_", "pending_")) and not call.data.startswith("pending_payment_"))
 @error_handler
 def handle_admin_response(call):
-    action, user_id = call.data.split("_")
+    action = call.data.split("_")[0]
+    user_id = callback_user_id(call.data)
+    session = transactions.get(user_id)
 
-    if user_id in transactions:
+    if session is not None:
         if action == "approve":
-            transactions[user_id]["step"] = 4
+            if not verify_session_quote(user_id, session):
+                bot.answer_callback_query(call.id, "⛔ Quote expired, payment not approved", show_alert=True)
+                return
+            session.step = Step.ENTER_WALLET
             bot.send_message(user_id, "✅ Payment confirmed!\n\n"
                                      "📌 Provide your wallet address for USDT transfer.")
             # Update transaction log
-            log_transaction(user_id, transactions[user_id])
+            log_transaction(user_id, session)
 
             bot.answer_callback_query(call.id, "Payment approved")
 
         elif action == "reject":
-            transactions[user_id]["step"] = 0
-            bot.send_message(user_id, "❌ Your proof of payment uploaded has been rejected. \n This could either be one or more reasons such as \n\n 1. Wrong upload: Please check to ascertain that your upload is correct\n 2. Un-clear (blur) upload: please re-upload a clearer image for verification \n \n However, If you think this is NOT right, Please contact support rehobotics.technologies@gmail.com or on Telegram @CryptoNairaExchangeSupport ")
+            session.step = Step.REJECTED
+            bot.send_message(user_id, f"❌ Your proof of payment uploaded has been rejected. \n This could either be one or more reasons such as \n\n 1. Wrong upload: Please check to ascertain that your upload is correct\n 2. Un-clear (blur) upload: please re-upload a clearer image for verification \n \n However, If you think this is NOT right, Please contact support {config.current.support_email} or on Telegram @CryptoNairaExchangeSupport ")
             bot.answer_callback_query(call.id, "Payment rejected")
 
         elif action == "pending":
@@ -667,50 +1232,71 @@ def handle_admin_response(call):
             bot.answer_callback_query(call.id, "Status set to pending")
 
 # Wallet address handler for Buy USDT
-@bot.message_handler(func=lambda message: str(message.from_user.id) in transactions and transactions[str(message.from_user.id)].get("step") == 4 and transactions[str(message.from_user.id)].get("action") == "Buy")
+@bot.message_handler(func=lambda message: transaction_at(message.from_user.id, Step.ENTER_WALLET, "Buy"))
 def handle_wallet_address(message):
-    user_id = str(message.from_user.id)
-    transactions[user_id]["wallet_address"] = message.text
+    user_id = message.from_user.id
+    wallet_address = message.text.strip()
+
+    # Only offer networks the address is actually valid on
+    enabled_networks = config.current.enabled_networks
+    networks = wallet_networks(wallet_address, enabled_networks)
+    if not networks:
+        bot.send_message(user_id, f"❌ That is not a valid {' or '.join(enabled_networks)} wallet address. Please check it and send it again.")
+        return
+
+    decision = risk.check_wallet(user_id, wallet_address)
+    if decision.flagged:
+        alert_risk(user_id, decision)
+
+    transactions[user_id].wallet_address = wallet_address
 
     keyboard = InlineKeyboardMarkup()
-    trc20_button = InlineKeyboardButton("🔹 TRC20", callback_data="wallet_TRC20")
-    bep20_button = InlineKeyboardButton("🔹 BEP20", callback_data="wallet_BEP20")
-    keyboard.row(trc20_button, bep20_button)
+    keyboard.row(*[InlineKeyboardButton(f"🔹 {network}", callback_data=f"wallet_{network}") for network in networks])
 
-    bot.send_message(user_id, "✅ Choose the USDT network:", reply_markup=keyboard)
+    message_tracker.show(user_id, "✅ Choose the USDT network:", reply_markup=keyboard, new=True)
 
 # Network selection handler for Buy USDT
 @bot.callback_query_handler(func=lambda call: call.data.startswith("wallet_"))
 def handle_wallet_network(call):
-    user_id = str(call.from_user.id)
+    user_id = call.from_user.id
     network = call.data.split("_")[1]
 
-    if user_id in transactions and transactions[user_id].get("step") == 4 and transactions[user_id].get("action") == "Buy":
-        transactions[user_id]["step"] = 5
-        transactions[user_id]["network"] = network
+    if transaction_at(user_id, Step.ENTER_WALLET, "Buy"):
+        session = transactions[user_id]
+        if not is_valid_wallet_address(session.wallet_address, network):
+            bot.answer_callback_query(call.id, f"❌ This address is not valid on {network}.", show_alert=True)
+            return
+
+        session.step = Step.AWAITING_USDT_TRANSFER
+        session.network = network
 
-        # Notify the user
-        bot.send_message(user_id, f"✅ You selected *{network}* network.\n\n"
-                                 f"📩 Please wait while the USDT transfer is done into your Wallet Address:\n\n"
-                                 f"🔹 Address: {transactions[user_id]['wallet_address']}\n",
-                         parse_mode="Markdown")
+        # A network markup is taken from the USDT sent, since the Naira has already been paid
+        rate_note = ""
+        if session.quote is not None and session.quote.rate_for(network) != session.quote.rate:
+            session.amount = round(session.quote.usdt_for(session.naira_amount, network), 2)
+            rate_note = f"ℹ️ {network} rate: ₦{session.quote.rate_for(network)}/USDT. You will receive {session.amount} USDT.\n\n"
+
+        # Notify the user in place of the network prompt
+        message_tracker.replace(call.message, f"{rate_note}"
+                                              f"✅ You selected *{network}* network.\n\n"
+                                              f"📩 Please wait while the USDT transfer is done into your Wallet Address:\n\n"
+                                              f"🔹 Address: {session.wallet_address}\n\n"
+                                              f"⏳ Awaiting USDT transfer confirmation from the admin.",
+                                parse_mode="Markdown")
 
         # Notify Admin to confirm the transfer
         keyboard = InlineKeyboardMarkup()
         transfer_done_button = InlineKeyboardButton("✅ Transfer Done", callback_data=f"transfer_done_{user_id}")
         keyboard.row(transfer_done_button)
 
+        # The address is monospaced so it can be copied with a tap
         if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
             bot.send_message(ADMIN_CHAT_ID, f"📌 User {user_id} provided wallet details:\n"
-                                           f"🔹 Address: {transactions[user_id]['wallet_address']}\n"
+                                           f"🔹 Address: `{session.wallet_address}`\n"
                                            f"🔹 Network: {network}\n"
-                                           f"💰 Amount: {transactions[user_id]['amount']} USDT\n"
+                                           f"💰 Amount: {session.amount} USDT\n"
                                            f"📌 Proceed with USDT transfer and click below when done.",
-                            reply_markup=keyboard)
-
-            bot.send_message(ADMIN_CHAT_ID, f" \n {transactions[user_id]['wallet_address']}\n")
-
-        bot.send_message(user_id, "⏳ Awaiting USDT transfer confirmation from the admin.")
+                            parse_mode="Markdown", reply_markup=keyboard)
 
         # Clear the callback query
         bot.answer_callback_query(call.id)
@@ -719,13 +1305,14 @@ def handle_wallet_network(call):
 @bot.callback_query_handler(func=lambda call: call.data.startswith("transfer_done_"))
 @error_handler
 def handle_admin_transfer_done(call):
-    user_id = call.data.split("_")[2]
+    user_id = callback_user_id(call.data)
 
-    if user_id in transactions and transactions[user_id].get("step") == 5:
-        transactions[user_id]["step"] = 6
+    if transaction_at(user_id, Step.AWAITING_USDT_TRANSFER):
+        session = transactions[user_id]
+        session.step = Step.USDT_SENT
 
         # Update transaction log
-        log_transaction(user_id, transactions[user_id])
+        log_transaction(user_id, session)
 
         # Ask the user to confirm receipt
         keyboard = InlineKeyboardMarkup()
@@ -733,12 +1320,12 @@ def handle_admin_transfer_done(call):
         not_received_button = InlineKeyboardButton("❌ Not Received", callback_data="not_received")
         keyboard.row(confirm_button, not_received_button)
 
-        bot.send_message(user_id, "✅ The admin has confirmed the USDT transfer.\n\n"
-                                 "📌 Please confirm if you have received it.", reply_markup=keyboard)
+        message_tracker.show(user_id, "✅ The admin has confirmed the USDT transfer.\n\n"
+                                      "📌 Please confirm if you have received it.", reply_markup=keyboard, new=True)
 
         if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
-            bot.send_message(ADMIN_CHAT_ID, f"✅ You have confirmed the transfer for user {user_id}.\n\n"
-                                           "Waiting for the user to acknowledge receipt.")
+            message_tracker.replace(call.message, f"✅ You have confirmed the transfer for user {user_id}.\n\n"
+                                                  "Waiting for the user to acknowledge receipt.", slot=f"transfer_{user_id}")
 
         # Clear the callback query
         bot.answer_callback_query(call.id)
@@ -746,33 +1333,30 @@ def handle_admin_transfer_done(call):
 # User receipt confirmation handler
 @bot.callback_query_handler(func=lambda call: call.data in ["confirm_received", "not_received"])
 def handle_transaction_end(call):
-    user_id = str(call.from_user.id)
+    user_id = call.from_user.id
+    session = transactions.get(user_id)
 
-    if user_id in transactions:
+    if session is not None:
         if call.data == "confirm_received":
             if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
-                bot.send_message(ADMIN_CHAT_ID, f"✅ User {user_id} has confirmed receipt of {transactions[user_id]['amount']} USDT.")
+                bot.send_message(ADMIN_CHAT_ID, f"✅ User {user_id} has confirmed receipt of {session.amount} USDT.")
 
-            bot.send_message(user_id, "✅ Transaction completed successfully!\n\n"
-                                     "Would you like to start another transaction?")
+            message_tracker.replace(call.message, "✅ Transaction completed successfully!\n\n"
+                                                  "Would you like to start another transaction?",
+                                    reply_markup=new_transaction_keyboard())
 
             # Update transaction log
-            log_transaction(user_id, transactions[user_id])
-
-            keyboard = InlineKeyboardMarkup()
-            new_transaction_buy = InlineKeyboardButton("💰 Buy USDT", callback_data="buy_usdt")
-            new_transaction_sell = InlineKeyboardButton("💵 Sell USDT", callback_data="sell_usdt")
-            exit_button = InlineKeyboardButton("🚪 Exit", callback_data="exit")
-            keyboard.row(new_transaction_buy, new_transaction_sell)
-            keyboard.row(exit_button)
+            log_transaction(user_id, session)
 
-            bot.send_message(user_id, "Select an option:", reply_markup=keyboard)
+            # Clear transaction data
+            transactions.pop(user_id, None)
+            api_calls.finish(session.transaction_id)
 
         elif call.data == "not_received":
             if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
                 bot.send_message(ADMIN_CHAT_ID, f"⚠️ User {user_id} reported NOT receiving USDT transfer.\n"
                                               f"Please verify and resolve the issue.")
-            bot.send_message(user_id, "\n⚠️  We apologise for any delay as this could either be \n due to Poor Internet Network connection or due to inter-Bank transfer \n \n Please exercise patients and wait for some minutes for the transaction to reflect, then Click *CONFIRM RECEIVED* above \n Or you can contact admin: rehobotics.technologies@gmail.com or on Telegram @CryptoNairaExchangeSupport")
+            bot.send_message(user_id, f"\n⚠️  We apologise for any delay as this could either be \n due to Poor Internet Network connection or due to inter-Bank transfer \n \n Please exercise patients and wait for some minutes for the transaction to reflect, then Click *CONFIRM RECEIVED* above \n Or you can contact admin: {config.current.support_email} or on Telegram @CryptoNairaExchangeSupport")
 
         # Clear the callback query
         bot.answer_callback_query(call.id)
@@ -783,29 +1367,29 @@ def handle_transaction_end(call):
 @bot.callback_query_handler(func=lambda call: call.data in ["confirm_sell", "cancel_transaction"])
 @error_handler
 def handle_sell_confirmation(call):
-    telegram_username = str(call.from_user.id)
+    user_id = call.from_user.id
 
     if call.data == "confirm_sell":
         # Make sure we maintain the existing transaction data
-        if telegram_username in transactions:
-            current_data = transactions[telegram_username]
-            current_data["step"] = 7
-            transactions[telegram_username] = current_data
+        session = transactions.get(user_id)
+        if session is not None:
+            session.step = Step.SELECT_NETWORK
         else:
-            transactions[telegram_username] = {"step": 7, "action": "Sell"}
+            session = TransactionSession(user_id, generate_transaction_id(), action="Sell", step=Step.SELECT_NETWORK)
+            transactions[user_id] = session
 
             # Update transaction log
-            log_transaction(telegram_username, transactions[telegram_username])
+            log_transaction(user_id, session)
 
         keyboard = InlineKeyboardMarkup()
-        keyboard.row(InlineKeyboardButton("TRC20", callback_data="network_TRC20"),
-                     InlineKeyboardButton("BEP20", callback_data="network_BEP20"))
-        bot.send_message(telegram_username, "📌 Please select the **network** for your USDT transfer:", reply_markup=keyboard)
+        keyboard.row(*[InlineKeyboardButton(network, callback_data=f"network_{network}") for network in config.current.enabled_networks])
+        message_tracker.replace(call.message, "📌 Please select the **network** for your USDT transfer:", reply_markup=keyboard)
     else:
-        bot.send_message(telegram_username, "❌ Transaction has been canceled. \n I am sorry to see that you cancelled the transaction. \n Hope you use my service again?")
+        message_tracker.replace(call.message, "❌ Transaction has been canceled. \n I am sorry to see that you cancelled the transaction. \n Hope you use my service again?")
         # Clean up the transaction data
-        if telegram_username in transactions:
-            transactions.pop(telegram_username)
+        session = transactions.pop(user_id, None)
+        if session is not None:
+            api_calls.finish(session.transaction_id, "abandoned")
 
     # Clear the callback query
     bot.answer_callback_query(call.id)
@@ -813,44 +1397,101 @@ def handle_sell_confirmation(call):
 # Network selection handler for Sell USDT
 @bot.callback_query_handler(func=lambda call: call.data.startswith("network_"))
 def handle_network_selection(call):
-    user_id = str(call.from_user.id)
+    user_id = call.from_user.id
     network = call.data.split("_")[1]
 
-    if user_id in transactions and transactions[user_id].get("step") == 7:
-        wallet_address = COMPANY_WALLETS.get(network)
+    if transaction_at(user_id, Step.SELECT_NETWORK):
+        session = transactions[user_id]
+        settings = config.current
+        wallet_address = settings.company_wallets.get(network) if network in settings.enabled_networks else None
 
         if wallet_address:
-            transactions[user_id].update({
-                "network": network, 
-                "company_wallet": wallet_address, 
-                "step": 8
-            })
-
-            bot.send_message(user_id, f"✅ Please upload a 'clear/readable' screenshot of the transaction as proof here.\n\n"
-                                     f"Pay this Amount: {transactions[user_id]['amount']} USDT\n"
-                                     f"🔹 Network: {network}\n\n"
-                                     f" Pay {transactions[user_id]['amount']} USDT into the below Wallet Address\n For ease, just copy the below Wallet address")
-
-            bot.send_message(user_id, f"\n {wallet_address}\n")
+            session.network = network
+            session.company_wallet = wallet_address
+            session.step = Step.AWAITING_PROOF
+
+            # Apply the network markup frozen in the quote to the payout
+            rate_note = ""
+            if session.quote is not None and session.quote.rate_for(network) != session.quote.rate:
+                session.naira_amount = session.quote.naira_for(session.amount, network)
+                rate_note = f"ℹ️ {network} rate: ₦{session.quote.rate_for(network)}/USDT. You will receive ₦{session.naira_amount:,.2f}.\n\n"
+
+            # The wallet address is monospaced so it can be copied with a tap
+            message_tracker.replace(call.message, f"{rate_note}"
+                                                  f"✅ Please upload a 'clear/readable' screenshot of the transaction as proof here.\n\n"
+                                                  f"Pay this Amount: {session.amount} USDT\n"
+                                                  f"🔹 Network: {network}\n\n"
+                                                  f" Pay {session.amount} USDT into the below Wallet Address\n For ease, just tap the Wallet address to copy it:\n\n"
+                                                  f"`{wallet_address}`",
+                                    parse_mode="Markdown")
         else:
-            bot.send_message(user_id, "\n ⚠️ Oh! Gosh! you have entered or selected an Invalid Network")
+            bot.answer_callback_query(call.id, "⚠️ Oh! Gosh! you have entered or selected an Invalid Network", show_alert=True)
+            return
 
     # Clear the callback query
     bot.answer_callback_query(call.id)
 
+# Admin re-prices a trade whose quote expired (or failed verification) before settlement
+@bot.callback_query_handler(func=lambda call: call.data.startswith("requote_"))
+@error_handler
+def admin_requote_transaction(call):
+    user_id = callback_user_id(call.data)
+    session = transactions.get(user_id)
+
+    buy_waiting = session is not None and session.action == "Buy" and session.step == Step.RECEIPT_UPLOADED
+    sell_waiting = session is not None and session.action == "Sell" and session.step == Step.PROOF_UPLOADED
+    if not (buy_waiting or sell_waiting):
+        bot.answer_callback_query(call.id, "⚠️ This transaction is no longer awaiting settlement.", show_alert=True)
+        return
+
+    previous = session.quote
+    quote = quote_engine.issue(session.action)
+    session.quote = quote
+
+    keyboard = InlineKeyboardMarkup()
+    if buy_waiting:
+        # The Naira is already paid, so the fresh rate changes the USDT sent
+        session.amount = round(quote.usdt_for(session.naira_amount), 2)
+        user_text = (f"ℹ️ Your quote expired before your payment was approved, so it was re-priced at ₦{quote.rate}/USDT.\n"
+                     f"💰 You will receive {session.amount} USDT for your ₦{session.naira_amount:.2f}.")
+        keyboard.row(InlineKeyboardButton("✅ Approve", callback_data=f"approve_{user_id}"),
+                     InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}"))
+    else:
+        # The USDT is already sent, so the fresh rate changes the Naira paid out
+        session.naira_amount = quote.naira_for(session.amount, session.network)
+        user_text = (f"ℹ️ Your quote expired before your transfer was confirmed, so it was re-priced at ₦{quote.rate_for(session.network)}/USDT.\n"
+                     f"💵 You will receive ₦{session.naira_amount:,.2f} for your {session.amount} USDT.")
+        keyboard.row(InlineKeyboardButton("✅ Confirm", callback_data=f"confirm_{user_id}"),
+                     InlineKeyboardButton("❌ Reject", callback_data=f"reject_{user_id}"))
+
+    log_transaction(user_id, session)
+    logger.info(f"🔁 Re-quoted transaction for user {user_id}: {previous.quote_id if previous else 'none'} -> {quote.quote_id} at ₦{quote.rate}/USDT")
+
+    bot.send_message(user_id, user_text)
+    bot.send_message(call.message.chat.id, f"🔁 Re-quoted {session.action} for user {user_id}\n"
+                                   f"💰 USDT Amount: {session.amount}\n"
+                                   f"💵 Naira Amount: ₦{session.naira_amount:.2f}\n"
+                                   f"{quote_summary(quote)}",
+                     reply_markup=keyboard)
+    bot.answer_callback_query(call.id, "Trade re-quoted")
+
 # Admin confirm USDT transfer for Sell USDT
 @bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_"))
 @error_handler
 def admin_confirm_transaction(call):
-    telegram_username = call.data.split("_")[1]
+    user_id = callback_user_id(call.data)
 
-    if telegram_username in transactions and transactions[telegram_username].get("step") == 9:
-        transactions[telegram_username]["step"] = 10
+    if transaction_at(user_id, Step.PROOF_UPLOADED):
+        session = transactions[user_id]
+        if not verify_session_quote(user_id, session):
+            bot.answer_callback_query(call.id, "⛔ Quote expired, transfer not confirmed", show_alert=True)
+            return
+        session.step = Step.ENTER_BANK_DETAILS
 
         # Update transaction log
-        log_transaction(telegram_username, transactions[telegram_username])
+        log_transaction(user_id, session)
 
-        bot.send_message(telegram_username, "✅ Transaction confirmed. Please provide your Naira bank details in this format:\n\n"
+        bot.send_message(user_id, "✅ Transaction confirmed. Please provide your Naira bank details in this format:\n\n"
                                  "Bank Name\n"
                                  "Account Number\n"
                                  "Account Name")
@@ -859,20 +1500,22 @@ def admin_confirm_transaction(call):
     bot.answer_callback_query(call.id)
 
 # Bank details handler for Sell USDT
-@bot.message_handler(func=lambda msg: str(msg.from_user.id) in transactions and transactions[str(msg.from_user.id)].get("step") == 10)
+@bot.message_handler(func=lambda msg: transaction_at(msg.from_user.id, Step.ENTER_BANK_DETAILS))
 def handle_bank_details(message):
-    user_id = str(message.from_user.id)
-    bank_info = message.text.split('\n')
+    user_id = message.from_user.id
+    details, error = parse_bank_details(message.text)
 
-    if len(bank_info) < 3:
-        bot.send_message(user_id, "❌ Please provide your bank details in the correct format:\n\n"
-                                 "Bank Name\n"
-                                 "Account Number\n"
-                                 "Account Name")
+    if error:
+        bot.send_message(user_id, error)
         return
 
-    transactions[user_id]["bank_details"] = message.text
-    transactions[user_id]["step"] = 11
+    decision = risk.check_bank_account(user_id, details["account_number"])
+    if decision.flagged:
+        alert_risk(user_id, decision)
+
+    session = transactions[user_id]
+    session.bank_details = message.text
+    session.step = Step.AWAITING_NAIRA_TRANSFER
 
     # Create a keyboard for admin
     keyboard = InlineKeyboardMarkup()
@@ -884,8 +1527,9 @@ def handle_bank_details(message):
         bot.send_message(ADMIN_CHAT_ID, 
                         f"🔹 User ID: {user_id} provided bank details:\n"
                         f"{message.text}\n\n"
-                        f"💲 USDT Amount: {transactions[user_id]['amount']}\n"
-                        f"💵 Naira Amount: ₦{transactions[user_id]['naira_amount']:.2f}\n\n"
+                        f"💲 USDT Amount: {session.amount}\n"
+                        f"💵 Naira Amount: ₦{session.naira_amount:.2f}\n"
+                        f"{quote_summary(session.quote)}\n\n"
                         f"✅ Click 'Transfer Done' after transferring Naira equivalent.",
                         reply_markup=keyboard)
 
@@ -895,13 +1539,14 @@ def handle_bank_details(message):
 @bot.callback_query_handler(func=lambda call: call.data.startswith("naira_sent_"))
 @error_handler
 def admin_naira_transfer_done(call):
-    user_id = call.data.split("_")[2]
+    user_id = callback_user_id(call.data)
 
-    if user_id in transactions and transactions[user_id].get("step") == 11:
-        transactions[user_id]["step"] = 12
+    if transaction_at(user_id, Step.AWAITING_NAIRA_TRANSFER):
+        session = transactions[user_id]
+        session.step = Step.NAIRA_SENT
 
         # Update transaction log
-        log_transaction(user_id, transactions[user_id])
+        log_transaction(user_id, session)
 
         keyboard = InlineKeyboardMarkup()
         received_button = InlineKeyboardButton("✅ Received", callback_data=f"received_{user_id}")
@@ -922,43 +1567,38 @@ def admin_naira_transfer_done(call):
 # User confirms receipt of Naira for Sell USDT
 @bot.callback_query_handler(func=lambda call: call.data.startswith(("received_", "not_received_")))
 def handle_naira_receipt_confirmation(call):
-    action = call.data.split("_")[0]
-    telegram_username = call.data.split("_")[1]
+    action = "received" if call.data.startswith("received_") else "not_received"
+    user_id = callback_user_id(call.data)
 
-    if telegram_username in transactions and transactions[telegram_username].get("step") == 12:
+    if transaction_at(user_id, Step.NAIRA_SENT):
+        session = transactions[user_id]
         if action == "received":
             if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
-                bot.send_message(ADMIN_CHAT_ID, f"✅ User {telegram_username} has confirmed receipt of ₦{transactions[telegram_username]['naira_amount']:.2f}")
-
-            bot.send_message(telegram_username, "🎉 Thank you for confirming! Transaction completed successfully.")
-
-            # Offer new transaction
-            keyboard = InlineKeyboardMarkup()
-            buy_button = InlineKeyboardButton("💰 Buy USDT", callback_data="buy_usdt")
-            sell_button = InlineKeyboardButton("💵 Sell USDT", callback_data="sell_usdt")
-            exit_button = InlineKeyboardButton("🚪 Exit", callback_data="exit")
-            keyboard.row(buy_button, sell_button)
-            keyboard.row(exit_button)
+                bot.send_message(ADMIN_CHAT_ID, f"✅ User {user_id} has confirmed receipt of ₦{session.naira_amount:.2f}")
 
-            bot.send_message(telegram_username, "Would you like to start another transaction?", reply_markup=keyboard)
+            # Offer a new transaction in place of the confirmation prompt
+            message_tracker.replace(call.message, "🎉 Thank you for confirming! Transaction completed successfully.\n\n"
+                                                  "Would you like to start another transaction?",
+                                    reply_markup=new_transaction_keyboard())
 
             # Clear transaction data
-            transactions.pop(telegram_username, None)
+            transactions.pop(user_id, None)
+            api_calls.finish(session.transaction_id)
 
         elif action == "not_received":
             if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
-                bot.send_message(ADMIN_CHAT_ID, 
-                               f"⚠️ User {telegram_username} reported NOT receiving their Naira payment of ₦{transactions[telegram_username]['naira_amount']:.2f}.\n"
-                               f"Please investigate and resolve this issue.")
-
                 # Create pending notification button
                 keyboard = InlineKeyboardMarkup()
-                pending_button = InlineKeyboardButton("⏳ Notify User of Pending Status", callback_data=f"pending_payment_{telegram_username}")
+                pending_button = InlineKeyboardButton("⏳ Notify User of Pending Status", callback_data=f"pending_payment_{user_id}")
                 keyboard.row(pending_button)
 
-                bot.send_message(ADMIN_CHAT_ID, "You can notify the user of a pending status:", reply_markup=keyboard)
+                bot.send_message(ADMIN_CHAT_ID, 
+                               f"⚠️ User {user_id} reported NOT receiving their Naira payment of ₦{session.naira_amount:.2f}.\n"
+                               f"Please investigate and resolve this issue.\n\n"
+                               f"You can notify the user of a pending status:",
+                               reply_markup=keyboard)
 
-            bot.send_message(telegram_username, "⚠️ Your issue has been reported to the admin or you can chat up support here on Telegram @CryptoNairaExchangeSupport. They will contact you shortly.")
+            bot.send_message(user_id, "⚠️ Your issue has been reported to the admin or you can chat up support here on Telegram @CryptoNairaExchangeSupport. They will contact you shortly.")
 
     # Clear the callback query
     bot.answer_callback_query(call.id)
@@ -967,19 +1607,20 @@ def handle_naira_receipt_confirmation(call):
 @bot.callback_query_handler(func=lambda call: call.data == "exit")
 @error_handler
 def handle_exit(call):
-    telegram_username = str(call.from_user.id)
+    user_id = call.from_user.id
 
     # Clear any transaction data
-    if telegram_username in transactions:
-        transactions.pop(telegram_username)
+    session = transactions.pop(user_id, None)
+    if session is not None:
+        api_calls.finish(session.transaction_id, "abandoned")
 
-    bot.send_message(telegram_username, "👋 Thank you for using our service. Have a great day!")
+    message_tracker.replace(call.message, "👋 Thank you for using our service. Have a great day!")
     bot.answer_callback_query(call.id)
 
 # Pending payment notification handler
 @bot.callback_query_handler(func=lambda call: call.data.startswith("pending_payment_"))
 def handle_pending_payment(call):
-    user_id = call.data.split("_")[-1]  # Extract user ID from callback data
+    user_id = callback_user_id(call.data)  # Extract user ID from callback data
 
     # Notify the user with a persuasive message
     bot.send_message(user_id, "⏳ **Payment has already been processed!**\n\n"
@@ -998,34 +1639,69 @@ def handle_pending_payment(call):
 @bot.message_handler(func=lambda message: True)
 @error_handler
 def handle_all_messages(message):
-    user_id = str(message.from_user.id)
+    user_id = message.from_user.id
 
     # Check if user is in a transaction
     if user_id in transactions:
         bot.send_message(user_id, "Please complete your current transaction first.")
     else:
-        bot.send_message(user_id, "Welcome! Please use the buttons below to start a transaction:")
-        show_buy_sell_buttons(user_id)
+        show_buy_sell_buttons(user_id, "Welcome! Please use the buttons below to start a transaction:")
 
 @bot.callback_query_handler(func=lambda call: call.data == "cancel_transaction")
 def cancel_transaction(call):
-    telegram_username = str(call.from_user.id)
+    user_id = call.from_user.id
+    session = transactions.get(user_id)
 
-    if telegram_username in transactions:
-        transactions[telegram_username]["status"] = "cancelled"
+    if session is not None:
+        session.status = "cancelled"
 
         # Update transaction log
-        log_transaction(telegram_username, transactions[telegram_username])
+        log_transaction(user_id, session)
 
-        logout_user(telegram_username)
-        bot.send_message(telegram_username, "❌ Transaction cancelled. \n I am sorry to see that you cancelled the transaction. \n Hope you use my service again?")
+        logout_user(user_id)
+        bot.send_message(user_id, "❌ Transaction cancelled. \n I am sorry to see that you cancelled the transaction. \n Hope you use my service again?")
     else:
-        bot.send_message(telegram_username, "❌ No active transaction found.")
+        bot.send_message(user_id, "❌ No active transaction found.")
 
 # Start bot polling with proper error handling
 if __name__ == "__main__":
     try:
         logger.info("🤖 Bot is starting...")
+        start_flask()
+        storage = create_storage()
+
+        # Opt-in: record raw incoming updates for offline replay (see replay.py)
+        update_recorder = None
+        if os.getenv("UPDATE_RECORD_PATH"):
+            update_recorder = UpdateRecorder(
+                os.getenv("UPDATE_RECORD_PATH"),
+                max_bytes=int(os.getenv("UPDATE_RECORD_MAX_BYTES", str(20 * 1024 * 1024))),
+                max_age=int(os.getenv("UPDATE_RECORD_MAX_AGE", str(24 * 60 * 60)))
+            )
+            update_recorder.install(telebot.apihelper)
+            atexit.register(update_recorder.close)
+
+        # Drain order: stop polling, wait for handlers, then flush state
+        lifecycle.install_signal_handlers()
+        lifecycle.on_stop(bot.stop_polling)
+        lifecycle.register_flush("broadcast", broadcaster.stop_for_shutdown)
+        lifecycle.register_flush("transaction_writes", transaction_writes.flush)
+        lifecycle.register_flush("session_snapshot", snapshot_sessions)
+        lifecycle.register_flush("stats", save_stats)
+        lifecycle.register_flush("scheduler", lambda deadline: scheduler.stop())
+
+        config.reload("startup")
+        restore_sessions()
+        load_stats()
+        try:
+            transaction_writes.replay_dead_letters(deadline=time.monotonic() + 30)
+        except Exception as e:
+            logger.error(f"Failed to replay transaction dead letters: {e}")
+        resume_interrupted_broadcast()
+
+        scheduler.start()
+        logger.info("✅ Scheduler activated: keep-alive, rate refresh, session sweep and history compaction.")
+
         # Send an initial message to admin to confirm bot is up
         try:
             if ADMIN_CHAT_ID and isinstance(ADMIN_CHAT_ID, int):
@@ -1036,6 +1712,23 @@ if __name__ == "__main__":
         # Start polling with better error handling
         logger.info("🤖 Bot is running... Press Ctrl+C to stop.")
         bot.infinity_polling(timeout=60, long_polling_timeout=30)
+
+        # Polling only returns once a drain has been requested
+        if not lifecycle.wait(lifecycle.drain_timeout + 5):
+            logger.warning("⚠️ Drain did not finish in time")
+
+        # Confirm updates up to the first rejected one; the handled ones above it are skipped after the restart
+        offset = lifecycle.ack_offset()
+        if offset is not None:
+            # The ack fetches an update it doesn't handle; keep it out of the recording
+            if update_recorder is not None:
+                update_recorder.uninstall()
+            try:
+                bot.get_updates(offset=offset, limit=1, timeout=0)
+                logger.info(f"✅ Acknowledged updates before {offset}")
+            except Exception as e:
+                logger.error(f"Failed to acknowledge handled updates: {e}")
+        logger.info("\n🛑 Bot stopped.")
     except KeyboardInterrupt:
         logger.info("\n🛑 Bot stopped by admin.")
     except Exception as e:
@@ -0,0 +1,46 @@
+from analytics import StatsAggregator
+
+
+def settled_buy():
+    return {
+        "transaction_id": "20250101120000000000",
+        "action": "Buy",
+        "step": 6,
+        "amount": 10.0,
+        "naira_amount": 15300.0,
+        "network": "TRC20",
+        "quote": {"markup": 30.0},
+    }
+
+
+def test_settled_step_logged_twice_is_counted_once():
+    stats = StatsAggregator()
+    stats.observe(settled_buy())
+    stats.observe(settled_buy())
+
+    assert stats.totals["trades"] == 1
+
+
+def test_settled_step_logged_again_after_restart_is_counted_once():
+    before = StatsAggregator()
+    before.observe(settled_buy())
+
+    # The next instance loads the saved aggregates, then the user confirms receipt
+    after = StatsAggregator()
+    after.load(before.to_dict())
+    after.observe(settled_buy())
+
+    assert after.totals["trades"] == 1
+    assert after.totals["buy_usdt"] == 10.0
+    assert after.totals["markup_revenue"] == 300.0
+    assert after.networks == {"TRC20": 1}
+
+
+def test_markup_revenue_includes_the_network_markup():
+    record = settled_buy()
+    record["quote"] = {"markup": 30.0, "network_markups": {"TRC20": 5.0, "ERC20": 20.0}}
+
+    stats = StatsAggregator()
+    stats.observe(record)
+
+    assert stats.totals["markup_revenue"] == 350.0
@@ -0,0 +1,90 @@
+import pytest
+
+from validation import (
+    bank_code_for,
+    is_valid_account_number,
+    is_valid_evm_address,
+    is_valid_tron_address,
+    keccak256,
+    parse_bank_details,
+    wallet_networks,
+)
+
+# Mixed-case checksum vectors from the EIP-55 specification
+EIP55_VECTORS = (
+    "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed",
+    "0xfB6916095ca1df60bB79Ce92cE3Ea74c37c5d359",
+    "0xdbF03B407c01E7cD3CBea99509d93f8DDDC8C6FB",
+    "0xD1220A0cf47c7B9Be7A2E6BA89F429762e7b9aDb",
+)
+
+USDT_TRC20_CONTRACT = "TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t"
+
+
+def test_keccak256_of_empty_input():
+    assert keccak256(b"").hex() == "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+
+
+@pytest.mark.parametrize("address", EIP55_VECTORS)
+def test_eip55_vectors_are_valid(address):
+    assert is_valid_evm_address(address)
+
+
+@pytest.mark.parametrize("address", EIP55_VECTORS)
+def test_eip55_vectors_with_one_letter_case_flipped_are_rejected(address):
+    index = next(i for i, char in enumerate(address[2:], 2) if char.isalpha())
+    corrupted = address[:index] + address[index].swapcase() + address[index + 1:]
+
+    assert not is_valid_evm_address(corrupted)
+
+
+def test_single_case_evm_addresses_carry_no_checksum():
+    assert is_valid_evm_address("0x52908400098527886E0F7030069857D2E4169EE7")
+    assert is_valid_evm_address("0xde709f2102306220921060314715629080e2fb77")
+
+
+def test_tron_usdt_contract_address():
+    assert is_valid_tron_address(USDT_TRC20_CONTRACT)
+    assert not is_valid_tron_address(USDT_TRC20_CONTRACT[:-1] + "u")
+
+
+def test_wallet_networks_matches_address_family():
+    assert wallet_networks(USDT_TRC20_CONTRACT, ["TRC20", "BEP20", "ERC20"]) == ["TRC20"]
+    assert wallet_networks(EIP55_VECTORS[0], ["TRC20", "BEP20", "ERC20"]) == ["BEP20", "ERC20"]
+
+
+def test_nuban_check_digit():
+    assert is_valid_account_number("1000000001", "057")
+    assert not is_valid_account_number("1000000002", "057")
+
+
+@pytest.mark.parametrize("bank_name, code", [
+    ("First City Monument Bank", "214"),
+    ("First Bank of Nigeria", "011"),
+    ("GTBank", "058"),
+    ("Zenith Bank", "057"),
+    ("Kuda", None),
+])
+def test_bank_aliases(bank_name, code):
+    assert bank_code_for(bank_name) == code
+
+
+def test_parse_bank_details():
+    details, error = parse_bank_details("Zenith Bank\n1000 000 001\nAda Obi")
+
+    assert error is None
+    assert details == {"bank_name": "Zenith Bank", "bank_code": "057", "account_number": "1000000001", "account_name": "Ada Obi"}
+
+
+def test_parse_bank_details_rejects_a_bad_check_digit():
+    details, error = parse_bank_details("Zenith Bank\n1000000002\nAda Obi")
+
+    assert details is None
+    assert "not a valid Zenith Bank account number" in error
+
+
+def test_parse_bank_details_accepts_banks_without_a_known_code():
+    details, error = parse_bank_details("Kuda\n1000000002\nAda Obi")
+
+    assert error is None
+    assert details["bank_code"] is None
@@ -0,0 +1,225 @@
+"""Input validation for registration, wallet addresses and bank details.
+
+Patterns are compiled once. Wallet addresses are checked properly rather
+than by prefix and length: TRC20 addresses by their base58check checksum,
+EVM (BEP20/ERC20) addresses by the EIP-55 mixed-case checksum. Results are
+cached, since the same addresses come back again and again. Account numbers
+are checked with the NUBAN check digit when the bank is known.
+`validate_batch` runs the same checks over stored transaction history.
+"""
+
+import hashlib
+import re
+from functools import lru_cache
+
+EMAIL_RE = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+ACCOUNT_NUMBER_RE = re.compile(r'^\d{10}$')
+TRON_ADDRESS_RE = re.compile(r'^T[1-9A-HJ-NP-Za-km-z]{33}$')
+EVM_ADDRESS_RE = re.compile(r'^0x[0-9a-fA-F]{40}$')
+
+EVM_NETWORKS = ("BEP20", "ERC20")
+
+# Email validation function
+def is_valid_email(email):
+    return EMAIL_RE.match(email) is not None
+
+# Name validation function
+def is_valid_name(name):
+    if len(name.split()) < 2:
+        return False
+    if len(name) < 3 or len(name) > 100:
+        return False
+    return True
+
+
+# Base58check (TRON)
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BASE58_INDEX = {char: index for index, char in enumerate(_BASE58_ALPHABET)}
+
+def _b58decode(text):
+    number = 0
+    for char in text:
+        number = number * 58 + _BASE58_INDEX[char]
+    body = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    # Each leading "1" encodes a leading zero byte
+    padding = len(text) - len(text.lstrip("1"))
+    return b"\x00" * padding + body
+
+@lru_cache(maxsize=4096)
+def is_valid_tron_address(address):
+    if not TRON_ADDRESS_RE.match(address):
+        return False
+    raw = _b58decode(address)
+    if len(raw) != 25 or raw[0] != 0x41:
+        return False
+    payload, checksum = raw[:21], raw[21:]
+    return hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] == checksum
+
+
+# Keccak-256 (EIP-55). hashlib's sha3_256 uses different padding, so it can't be used here.
+
+_KECCAK_RC = (
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+)
+_KECCAK_ROT = (
+    (0, 36, 3, 41, 18),
+    (1, 44, 10, 45, 2),
+    (62, 6, 43, 15, 61),
+    (28, 55, 25, 21, 56),
+    (27, 20, 39, 8, 14),
+)
+_MASK64 = (1 << 64) - 1
+
+def _rotl64(value, shift):
+    return ((value << shift) | (value >> (64 - shift))) & _MASK64 if shift else value
+
+def _keccak_f(lanes):
+    for round_constant in _KECCAK_RC:
+        c = [lanes[x][0] ^ lanes[x][1] ^ lanes[x][2] ^ lanes[x][3] ^ lanes[x][4] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ _rotl64(c[(x + 1) % 5], 1) for x in range(5)]
+        lanes = [[lanes[x][y] ^ d[x] for y in range(5)] for x in range(5)]
+
+        b = [[0] * 5 for _ in range(5)]
+        for x in range(5):
+            for y in range(5):
+                b[y][(2 * x + 3 * y) % 5] = _rotl64(lanes[x][y], _KECCAK_ROT[x][y])
+
+        lanes = [[b[x][y] ^ (~b[(x + 1) % 5][y] & b[(x + 2) % 5][y]) for y in range(5)] for x in range(5)]
+        lanes[0][0] ^= round_constant
+    return lanes
+
+def keccak256(data):
+    rate = 136
+    padded = bytearray(data) + b"\x01"
+    padded += b"\x00" * (-len(padded) % rate)
+    padded[-1] |= 0x80
+
+    lanes = [[0] * 5 for _ in range(5)]
+    for offset in range(0, len(padded), rate):
+        block = padded[offset:offset + rate]
+        for i in range(rate // 8):
+            lanes[i % 5][i // 5] ^= int.from_bytes(block[i * 8:i * 8 + 8], "little")
+        lanes = _keccak_f(lanes)
+
+    return b"".join(lanes[i % 5][i // 5].to_bytes(8, "little") for i in range(4))
+
+@lru_cache(maxsize=4096)
+def is_valid_evm_address(address):
+    if not EVM_ADDRESS_RE.match(address):
+        return False
+    body = address[2:]
+
+    # All-lowercase or all-uppercase addresses carry no checksum
+    if body == body.lower() or body == body.upper():
+        return True
+
+    digest = keccak256(body.lower().encode()).hex()
+    for char, nibble in zip(body, digest):
+        if char.isalpha() and char.isupper() != (int(nibble, 16) >= 8):
+            return False
+    return True
+
+
+# Wallet address validation function
+def is_valid_wallet_address(wallet_address, network):
+    if not wallet_address:
+        return False
+    if network == "TRC20":
+        return is_valid_tron_address(wallet_address)
+    if network in EVM_NETWORKS:
+        return is_valid_evm_address(wallet_address)
+    return False
+
+def wallet_networks(wallet_address, networks):
+    """Returns the networks from `networks` that `wallet_address` is valid on."""
+    return [network for network in networks if is_valid_wallet_address(wallet_address, network)]
+
+
+# NUBAN (Nigerian account numbers)
+
+# CBN 3-digit codes; longer aliases first so "first city monument" wins over "first"
+BANK_CODES = (
+    ("first city monument", "214"), ("fcmb", "214"),
+    ("united bank for africa", "033"), ("uba", "033"),
+    ("guaranty", "058"), ("gtbank", "058"), ("gtb", "058"), ("gt bank", "058"),
+    ("standard chartered", "068"), ("stanbic", "221"),
+    ("first bank", "011"), ("firstbank", "011"),
+    ("access", "044"), ("diamond", "063"), ("zenith", "057"), ("fidelity", "070"),
+    ("union", "032"), ("sterling", "232"), ("wema", "035"), ("ecobank", "050"),
+    ("keystone", "082"), ("polaris", "076"), ("skye", "076"), ("unity", "215"),
+    ("heritage", "030"), ("providus", "101"), ("jaiz", "301"), ("titan", "102"),
+    ("citi", "023"), ("suntrust", "100"), ("globus", "103"),
+)
+_NUBAN_WEIGHTS = (3, 7, 3, 3, 7, 3, 3, 7, 3, 3, 7, 3)
+
+def bank_code_for(bank_name):
+    """Returns the CBN code for a bank name, or None for banks we can't check (e.g. fintechs)."""
+    name = bank_name.lower()
+    for alias, code in BANK_CODES:
+        if alias in name:
+            return code
+    return None
+
+def nuban_check_digit(bank_code, serial):
+    total = sum(int(digit) * weight for digit, weight in zip(bank_code + serial, _NUBAN_WEIGHTS))
+    return (10 - total % 10) % 10
+
+# Account number validation function (10-digit NUBAN)
+def is_valid_account_number(account_number, bank_code=None):
+    if not ACCOUNT_NUMBER_RE.match(account_number):
+        return False
+    if bank_code is None:
+        return True
+    return nuban_check_digit(bank_code, account_number[:9]) == int(account_number[9])
+
+def parse_bank_details(text):
+    """Parses "Bank Name / Account Number / Account Name" lines.
+
+    Returns (details, error): details is a dict on success, error a user-facing message otherwise.
+    """
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    if len(lines) < 3:
+        return None, "❌ Please provide your bank details in the correct format:\n\nBank Name\nAccount Number\nAccount Name"
+
+    bank_name, account_number, account_name = lines[0], lines[1].replace(" ", ""), " ".join(lines[2:])
+    bank_code = bank_code_for(bank_name)
+
+    if not ACCOUNT_NUMBER_RE.match(account_number):
+        return None, "❌ The account number must be exactly 10 digits."
+    if not is_valid_account_number(account_number, bank_code):
+        return None, f"❌ {account_number} is not a valid {bank_name} account number. Please check it and try again."
+    if len(account_name) < 3:
+        return None, "❌ Please provide the full account name."
+
+    return {"bank_name": bank_name, "bank_code": bank_code, "account_number": account_number, "account_name": account_name}, None
+
+
+# Batch auditing
+
+def validate_record(record):
+    """Returns a list of problems with a stored transaction record."""
+    problems = []
+    wallet_address = record.get("wallet_address")
+    network = record.get("network")
+    if wallet_address and network and not is_valid_wallet_address(wallet_address, network):
+        problems.append(f"invalid {network} wallet address")
+    if record.get("bank_details"):
+        _, error = parse_bank_details(record["bank_details"])
+        if error:
+            problems.append("invalid bank details")
+    return problems
+
+def validate_batch(records):
+    """Validates `{key: record}` pairs; returns {key: problems} for records with problems."""
+    report = {}
+    for key, record in records:
+        problems = validate_record(record)
+        if problems:
+            report[key] = problems
+    return report
@@ -0,0 +1,141 @@
+"""Write-behind queue for persistence calls made from handlers.
+
+Handlers submit `(key, value)` pairs and return immediately; a writer thread
+applies them in order. Pending writes for the same key are coalesced so only
+the latest value is written. With `write_batch`, everything pending (up to
+`batch_size`) is written in one call. `flush()` is used by the shutdown drain.
+
+Writes that still fail after the retries are appended to a local JSON-lines
+dead-letter file (the store they were meant for is the thing failing) and
+`replay_dead_letters()` resubmits them on the next start. Writes are keyed
+puts, so replaying one that did land after all is harmless.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    def __init__(self, name, write=None, retries=3, retry_delay=1.0, write_batch=None, batch_size=100,
+                 dead_letter_path=None):
+        """Pass `write(key, value)`, or `write_batch([(key, value), ...])` to batch."""
+        self.name = name
+        self.dead_letter_path = dead_letter_path
+        self.write = write
+        self.write_batch = write_batch
+        self.batch_size = batch_size if write_batch else 1
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.written = 0
+        self.failed = 0
+
+        self._pending = OrderedDict()
+        self._cond = threading.Condition()
+        self._busy = 0  # writes taken off the queue but not yet applied
+        self._thread = threading.Thread(target=self._run, name=f"writer-{name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, value):
+        with self._cond:
+            # Later writes for the same key replace earlier ones
+            self._pending.pop(key, None)
+            self._pending[key] = value
+            self._cond.notify_all()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending) + self._busy
+
+    def flush(self, deadline=None):
+        """Waits until every submitted write has been applied (or the monotonic deadline passes)."""
+        with self._cond:
+            while self._pending or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logger.warning(f"⚠️ {self.name} flush timed out with {len(self._pending)} writes pending")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = [self._pending.popitem(last=False) for _ in range(min(self.batch_size, len(self._pending)))]
+                self._busy = len(batch)
+
+            self._apply(batch)
+
+            with self._cond:
+                self._busy = 0
+                self._cond.notify_all()
+
+    def _apply(self, batch):
+        for attempt in range(1, self.retries + 1):
+            try:
+                if self.write_batch:
+                    self.write_batch(batch)
+                else:
+                    key, value = batch[0]
+                    self.write(key, value)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                keys = batch[0][0] if len(batch) == 1 else f"batch of {len(batch)}"
+                logger.error(f"Failed to write {self.name} {keys} (attempt {attempt}/{self.retries}): {e}")
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay * attempt)
+        self.failed += len(batch)
+        self._dead_letter(batch)
+
+    def _dead_letter(self, batch):
+        if not self.dead_letter_path:
+            logger.error(f"❌ Dropped {len(batch)} {self.name} writes after {self.retries} attempts")
+            return
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for key, value in batch:
+                    f.write(json.dumps({"key": key, "value": value}, ensure_ascii=False, default=str) + "\n")
+            logger.error(f"❌ Saved {len(batch)} failed {self.name} writes to {self.dead_letter_path}")
+        except Exception as e:
+            logger.error(f"❌ Failed to save {len(batch)} {self.name} writes to {self.dead_letter_path}: {e}")
+
+    def replay_dead_letters(self, deadline=None):
+        """Resubmits writes saved by earlier failures; returns how many were replayed.
+
+        The file is moved aside first, so writes that fail again are saved to a
+        fresh one. The moved file is deleted once every replayed write has been
+        applied or saved again; if the flush times out it is kept for next time.
+        """
+        if not self.dead_letter_path or not os.path.exists(self.dead_letter_path):
+            return 0
+        replaying = f"{self.dead_letter_path}.replaying"
+        if not os.path.exists(replaying):
+            os.replace(self.dead_letter_path, replaying)
+
+        count = 0
+        with open(replaying, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.error(f"Skipping unreadable {self.name} dead letter: {line[:200]!r}")
+                    continue
+                key = entry["key"]
+                # JSON turns tuple keys into lists
+                self.submit(tuple(key) if isinstance(key, list) else key, entry["value"])
+                count += 1
+
+        if self.flush(deadline):
+            os.remove(replaying)
+        logger.info(f"♻️ Replayed {count} {self.name} writes from {self.dead_letter_path}")
+        return count